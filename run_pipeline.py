@@ -117,6 +117,9 @@ def parse_args():
 
   # 场景包含所有障碍物（默认只包含匹配的）
   python3 run_pipeline.py --all-objects
+
+  # 按场景范围裁剪地图（加快仿真器加载和 sim_map/routing_map 生成）
+  python3 run_pipeline.py --crop-map --crop-margin 150
         """,
     )
 
@@ -134,6 +137,25 @@ def parse_args():
         help="场景包含所有障碍物 (默认: 只包含匹配的障碍物)",
     )
 
+    parser.add_argument(
+        "--crop-map",
+        action="store_true",
+        help="按生成场景中障碍物和主车的范围裁剪地图，输出更小的子地图",
+    )
+
+    parser.add_argument(
+        "--crop-margin",
+        type=float,
+        default=100.0,
+        help="裁剪地图时的边距（米，默认: 100）",
+    )
+
+    parser.add_argument(
+        "--transform-positions",
+        action="store_true",
+        help="按地图偏移变换模板中的主车起终点、路由点等位置",
+    )
+
     parser.add_argument(
         "--skip-decrypt", action="store_true", help="跳过解密步骤 (即使 raw.json 存在)"
     )
@@ -161,20 +183,17 @@ def main():
     """)
 
     # Step 0: 解密原始数据 (如果 raw.json 存在)
-    if (
-        not args.skip_decrypt
-        and Path("input/raw.json").exists()
-        and not Path("input/data.json").exists()
-    ):
-        print_step(0, "解密原始数据")
-        if not run_command(
-            ["python3", "src/step0_decrypt_raw_data.py"], "解密 raw.json"
-        ):
-            return 1
+    # 在 step 1 进程内完成：解密结果直接用于匹配，data.json 在后台线程中写出。
+    # 即使 data.json 已存在也重新解密（raw.json 可能已更新），
+    # 按密文哈希的解密缓存让未变化的记录跳过解密
+    decrypt_in_step1 = not args.skip_decrypt and Path("input/raw.json").exists()
+    if decrypt_in_step1:
+        print("ℹ️  raw.json 将在计算偏移量时直接解密（同时写出 input/data.json）")
 
     # 检查必需文件
     print("检查必需文件...")
-    if not check_files_exist("input/scenarios.json", "input/data.json"):
+    data_file = "input/raw.json" if decrypt_in_step1 else "input/data.json"
+    if not check_files_exist("input/scenarios.json", data_file):
         print("\n请确保以下文件存在于 input/ 目录:")
         print("  - input/scenarios.json (原始场景)")
         print("  - input/data.json (障碍物数据)")
@@ -231,7 +250,19 @@ def main():
 
     # Step 1: 计算偏移量
     print_step(1, "计算偏移量（匈牙利算法）")
-    if not run_command(["python3", "src/step1_calculate_offset.py"], "计算偏移量"):
+    step1_cmd = ["python3", "src/step1_calculate_offset.py"]
+    if decrypt_in_step1:
+        step1_cmd.extend(
+            [
+                "--raw",
+                "input/raw.json",
+                "--write-data",
+                "input/data.json",
+                "--cache-dir",
+                ".cache/decrypt",
+            ]
+        )
+    if not run_command(step1_cmd, "计算偏移量"):
         return 1
 
     # Step 2: 生成可视化
@@ -249,6 +280,10 @@ def main():
 
     # 构建场景生成命令
     cmd = ["python3", "src/step3_create_scenario.py"]
+    if args.transform_positions:
+        # 主车起终点、路由点等模板位置使用与地图相同的偏移变换
+        cmd.append("--transform-positions")
+        print("ℹ️  模板中的主车起终点、路由点等位置将按地图偏移变换")
 
     # 如果有地图，传递 map_name 参数
     if has_map:
@@ -307,10 +342,23 @@ def main():
             map_file,
             str(output_map_file),
             "--format",
-            "binary",
+            "both",
+            "--cache-dir",
+            ".cache/step2_maps",
+            "--verify",
         ]
         if new_map_id:
             map_cmd.extend(["--new-map-id", new_map_id])
+        if args.crop_map and scenario_output:
+            map_cmd.extend(
+                [
+                    "--crop-scenario",
+                    scenario_output,
+                    "--crop-margin",
+                    str(args.crop_margin),
+                ]
+            )
+            print(f"ℹ️  地图将按场景范围裁剪（边距 {args.crop_margin}m）")
 
         if not run_command(map_cmd, "应用偏移到地图"):
             return 1
@@ -365,6 +413,8 @@ def main():
         output_map_dir_path = Path(f"output/{map_name}_offset")
         if (output_map_dir_path / "base_map.bin").exists():
             print("       ├── base_map.bin (必需)")
+        if (output_map_dir_path / "base_map.txt").exists():
+            print("       ├── base_map.txt (文本格式)")
         if (output_map_dir_path / "sim_map.bin").exists():
             print("       ├── sim_map.bin (Dreamview显示)")
         if (output_map_dir_path / "routing_map.bin").exists():
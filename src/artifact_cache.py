@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+内容寻址的产物缓存
+按 key 存储文件，命中时硬链接（或复制）到目标位置，带 LRU 容量上限和完整性校验
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+
+def hash_file(filepath: str, chunk_size: int = 1 << 20) -> str:
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(*parts) -> str:
+    """将若干参数组合为缓存 key（SHA-256 十六进制）"""
+    content = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    """
+    产物缓存
+
+    目录结构:
+        <cache_dir>/<key[:2]>/<key>        缓存内容
+        <cache_dir>/<key[:2]>/<key>.json   元信息（大小、SHA-256）
+
+    条目的 mtime 作为最近使用时间，超过容量上限时淘汰最久未使用的条目
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 << 30):
+        """
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存容量上限（字节），默认 2GB
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, key: str):
+        entry_dir = self.cache_dir / key[:2]
+        return entry_dir / key, entry_dir / f"{key}.json"
+
+    def _remove(self, key: str):
+        for path in self._paths(key):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """
+        查找缓存条目并校验完整性
+
+        Args:
+            key: 缓存 key
+
+        Returns:
+            缓存内容的路径；未命中或校验失败时返回 None（校验失败的条目会被删除）
+        """
+        data_path, meta_path = self._paths(key)
+        if not data_path.exists() or not meta_path.exists():
+            return None
+
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            valid = (
+                data_path.stat().st_size == meta["size"]
+                and hash_file(str(data_path)) == meta["sha256"]
+            )
+        except (OSError, ValueError, KeyError):
+            valid = False
+
+        if not valid:
+            print(f"  ⚠️  缓存条目校验失败，已删除: {key[:16]}")
+            self._remove(key)
+            return None
+
+        # 更新最近使用时间
+        os.utime(data_path)
+        return data_path
+
+    def get(self, key: str, dest: str) -> bool:
+        """
+        命中时将缓存内容硬链接（跨文件系统时复制）到 dest
+
+        Args:
+            key: 缓存 key
+            dest: 目标文件路径
+
+        Returns:
+            是否命中
+        """
+        data_path = self.lookup(key)
+        if data_path is None:
+            return False
+
+        dest_path = Path(dest)
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+        if dest_path.exists():
+            dest_path.unlink()
+        try:
+            os.link(data_path, dest_path)
+        except OSError:
+            shutil.copyfile(data_path, dest_path)
+        return True
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """命中时返回缓存内容，否则返回 None"""
+        data_path = self.lookup(key)
+        if data_path is None:
+            return None
+        return data_path.read_bytes()
+
+    def put(self, key: str, src: str):
+        """
+        将文件存入缓存
+
+        Args:
+            key: 缓存 key
+            src: 源文件路径
+        """
+        data_path, _ = self._paths(key)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = data_path.with_name(f"{key}.tmp")
+        shutil.copyfile(src, tmp_path)
+        self._commit(key, tmp_path)
+
+    def put_bytes(self, key: str, data: bytes):
+        """将字节内容存入缓存"""
+        data_path, _ = self._paths(key)
+        data_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = data_path.with_name(f"{key}.tmp")
+        tmp_path.write_bytes(data)
+        self._commit(key, tmp_path)
+
+    def _commit(self, key: str, tmp_path: Path):
+        """写入元信息并将临时文件原子地放到位，然后按容量淘汰"""
+        data_path, meta_path = self._paths(key)
+        meta = {"size": tmp_path.stat().st_size, "sha256": hash_file(str(tmp_path))}
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, data_path)
+        self.evict()
+
+    def evict(self):
+        """淘汰最久未使用的条目，直到总大小不超过容量上限"""
+        entries = []
+        total = 0
+        for data_path in self.cache_dir.glob("??/*"):
+            if data_path.suffix in (".json", ".tmp"):
+                continue
+            stat = data_path.stat()
+            entries.append((stat.st_mtime, stat.st_size, data_path.name))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
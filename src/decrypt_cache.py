@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+解密结果缓存
+按密文寻址，把解密后 world 的紧凑 JSON 追加写入打包文件（每次运行一个 .pack 和对应的 .idx 索引），
+打开时一次性加载所有索引，命中时只需一次定位读取，不再逐条解密、也不需要逐条打开小文件
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+
+
+def ciphertext_key(encrypted_data: str) -> str:
+    """
+    记录的缓存 key：Base64 密文的长度、开头（包含 IV）和末尾（包含最后一个密文块）
+
+    AES-CBC 的最后一个密文块依赖 IV 和全部明文，而 IV 每条记录随机生成，
+    因此这三者即可区分不同的密文，不需要对整段密文求哈希
+
+    Args:
+        encrypted_data: Base64 编码的加密数据
+
+    Returns:
+        缓存 key
+    """
+    return f"{len(encrypted_data)}:{encrypted_data[:24]}:{encrypted_data[-24:]}"
+
+
+class DecryptCache:
+    """
+    解密结果缓存
+
+    目录结构:
+        <cache_dir>/<namespace>-<pid>-<time>.pack   解密结果（紧凑 JSON，依次追加）
+        <cache_dir>/<namespace>-<pid>-<time>.idx    每行 "key\\toffset\\tlength"
+
+    namespace 区分密钥、字段投影和缓存格式版本。每次运行只追加写入自己的打包文件，
+    多个进程同时使用同一缓存目录不会冲突。打包文件先于索引写入，中断时超出打包文件的索引行被忽略。
+    打包文件的 mtime 作为最近使用时间，关闭时按容量上限整体淘汰最久未使用的打包文件
+    """
+
+    def __init__(self, cache_dir: str, namespace: str, max_bytes: int = 2 << 30):
+        """
+        Args:
+            cache_dir: 缓存目录
+            namespace: 命名空间（密钥、字段投影等决定缓存内容的参数）
+            max_bytes: 缓存容量上限（字节），默认 2GB
+        """
+        self.path = Path(cache_dir)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+
+        self._entries: Dict[str, Tuple[Path, int, int]] = {}
+        self._readers = {}
+        self._used = set()
+        self._pack_path = None
+        self._pack = None
+        self._index = None
+
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        """加载本命名空间的所有索引"""
+        pattern = f"{self.namespace}-*{INDEX_SUFFIX}"
+        for index_path in sorted(self.path.glob(pattern)):
+            pack_path = index_path.with_suffix(PACK_SUFFIX)
+            try:
+                pack_size = pack_path.stat().st_size
+            except FileNotFoundError:
+                continue
+            with open(index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 3:
+                        continue  # 中断时写了一半的行
+                    key, offset, length = parts[0], int(parts[1]), int(parts[2])
+                    if offset + length <= pack_size:
+                        self._entries[key] = (pack_path, offset, length)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        读取缓存内容
+
+        Args:
+            key: 缓存 key（ciphertext_key）
+
+        Returns:
+            缓存内容；未命中时返回 None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        pack_path, offset, length = entry
+        if pack_path == self._pack_path:
+            self.flush()
+        reader = self._readers.get(pack_path)
+        if reader is None:
+            reader = self._readers[pack_path] = open(pack_path, "rb")
+        reader.seek(offset)
+        data = reader.read(length)
+        if len(data) != length:
+            # 打包文件被截断
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._used.add(pack_path)
+        return data
+
+    def put(self, key: str, data: bytes):
+        """
+        追加一条缓存内容（已存在的 key 跳过）
+
+        Args:
+            key: 缓存 key（ciphertext_key）
+            data: 缓存内容
+        """
+        if key in self._entries:
+            return
+        if self._pack is None:
+            name = f"{self.namespace}-{os.getpid()}-{time.time_ns()}"
+            self._pack_path = self.path / f"{name}{PACK_SUFFIX}"
+            self._pack = open(self._pack_path, "ab")
+            self._index = open(
+                self.path / f"{name}{INDEX_SUFFIX}", "a", encoding="utf-8"
+            )
+
+        offset = self._pack.tell()
+        self._pack.write(data)
+        self._index.write(f"{key}\t{offset}\t{len(data)}\n")
+        self._entries[key] = (self._pack_path, offset, len(data))
+
+    def flush(self):
+        """写出缓冲的内容（先打包文件，后索引）"""
+        if self._pack is not None:
+            self._pack.flush()
+            self._index.flush()
+
+    def close(self):
+        """写出剩余内容、更新命中的打包文件的使用时间，然后按容量淘汰"""
+        self.flush()
+        for f in (self._pack, self._index, *self._readers.values()):
+            if f is not None:
+                f.close()
+        self._pack = self._index = None
+        self._readers = {}
+
+        for pack_path in self._used:
+            try:
+                os.utime(pack_path)
+            except FileNotFoundError:
+                pass
+        self._used = set()
+        self.evict()
+
+    def evict(self):
+        """淘汰最久未使用的打包文件（所有命名空间），直到总大小不超过容量上限"""
+        packs = []
+        total = 0
+        for pack_path in self.path.glob(f"*{PACK_SUFFIX}"):
+            stat = pack_path.stat()
+            packs.append((stat.st_mtime, stat.st_size, pack_path))
+            total += stat.st_size
+
+        packs.sort()
+        removed = set()
+        for _, size, pack_path in packs:
+            if total <= self.max_bytes:
+                break
+            for path in (pack_path, pack_path.with_suffix(INDEX_SUFFIX)):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            removed.add(pack_path)
+            total -= size
+        if removed:
+            self._entries = {
+                key: entry
+                for key, entry in self._entries.items()
+                if entry[0] not in removed
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+多帧障碍物存储模块
+把解密后的逐帧 world 中的障碍物按列（ID、类型、位置、朝向、尺寸）追加写入二进制列文件，
+并建立时间戳 -> 行范围的帧索引；加载时内存映射，可按帧或时间窗口快速读取
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+FRAME_STORE_VERSION = 1
+
+# 数值列（每列一个 .bin 文件，按行追加）
+VALUE_COLUMNS = ("x", "y", "heading", "length", "width", "height")
+# data.json 中对应的字段
+VALUE_FIELDS = ("positionX", "positionY", "heading", "length", "width", "height")
+
+# 编码列：障碍物 ID 和类型在 ids.npy / meta.json 的字符串表中的下标
+CODE_COLUMNS = {"id": np.int32, "type": np.int16}
+
+
+def frame_columns(world: dict, timestamp=None) -> dict:
+    """
+    把一帧 world 中的障碍物转换为列（可在解密 worker 进程中计算）
+
+    Args:
+        world: 解密后的 world（data.json 格式）
+        timestamp: 记录的时间戳（world 中没有 timestamp 时使用）
+
+    Returns:
+        {"timestamp", "sequence", "ids", "types", "values": (N, 6) 数值列}
+    """
+    objects = world.get("object", [])
+    values = np.array(
+        [[obj[field] for field in VALUE_FIELDS] for obj in objects], dtype=np.float64
+    ).reshape(-1, len(VALUE_FIELDS))
+    return {
+        "timestamp": world.get("timestamp", timestamp),
+        "sequence": world.get("sequenceNum", -1),
+        "ids": [str(obj["id"]) for obj in objects],
+        "types": [obj.get("type", "UNKNOWN") for obj in objects],
+        "values": values,
+    }
+
+
+class FrameStoreWriter:
+    """
+    逐帧追加写入的帧存储
+
+    行数据先在内存中缓存，达到 chunk_rows 行后整块追加到列文件，
+    内存占用与帧数无关（只有 ID 字符串表和帧索引随数据增长）
+    """
+
+    def __init__(self, store_dir: str, chunk_rows: int = 65536):
+        """
+        Args:
+            store_dir: 存储目录
+            chunk_rows: 每次写出的行数
+        """
+        self.path = Path(store_dir)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.chunk_rows = chunk_rows
+
+        self._files = {
+            name: open(self.path / f"{name}.bin", "wb")
+            for name in (*VALUE_COLUMNS, *CODE_COLUMNS)
+        }
+        self._pending = []
+        self._pending_rows = 0
+        self._id_codes = {}
+        self._type_codes = {}
+
+        self.rows = 0
+        self.frame_timestamp = []
+        self.frame_sequence = []
+        self.frame_start = []
+
+    def append(self, columns: dict):
+        """追加一帧（frame_columns 的结果）"""
+        id_codes = np.array(
+            [self._id_codes.setdefault(i, len(self._id_codes)) for i in columns["ids"]],
+            dtype=CODE_COLUMNS["id"],
+        )
+        type_codes = np.array(
+            [
+                self._type_codes.setdefault(t, len(self._type_codes))
+                for t in columns["types"]
+            ],
+            dtype=CODE_COLUMNS["type"],
+        )
+        timestamp = columns["timestamp"]
+        self.frame_timestamp.append(
+            float(timestamp) if timestamp is not None else float(len(self.frame_start))
+        )
+        self.frame_sequence.append(int(columns["sequence"]))
+        self.frame_start.append(self.rows + self._pending_rows)
+
+        self._pending.append((columns["values"], id_codes, type_codes))
+        self._pending_rows += len(id_codes)
+        if self._pending_rows >= self.chunk_rows:
+            self._flush()
+
+    def append_world(self, world: dict, timestamp=None):
+        """追加一帧解密后的 world"""
+        self.append(frame_columns(world, timestamp))
+
+    def _flush(self):
+        if not self._pending:
+            return
+        values = np.concatenate([chunk[0] for chunk in self._pending])
+        for column, name in enumerate(VALUE_COLUMNS):
+            self._files[name].write(np.ascontiguousarray(values[:, column]).tobytes())
+        self._files["id"].write(np.concatenate([c[1] for c in self._pending]).tobytes())
+        self._files["type"].write(
+            np.concatenate([c[2] for c in self._pending]).tobytes()
+        )
+        self.rows += self._pending_rows
+        self._pending = []
+        self._pending_rows = 0
+
+    def close(self) -> dict:
+        """
+        写出剩余数据、帧索引和元数据
+
+        保存的文件:
+            meta.json               行数、帧数、列类型、类型名称表
+            <column>.bin            每列一个原始二进制文件（x、y、heading、length、width、height、id、type）
+            ids.npy                 (K,) 障碍物 ID 字符串表（id 列为下标）
+            frame_timestamp.npy     (F,) 每帧时间戳
+            frame_sequence.npy      (F,) 每帧序列号（没有时为 -1）
+            frame_offsets.npy       (F + 1,) 每帧在列中的起始行
+            time_order.npy          (F,) 按时间戳排序的帧下标
+
+        Returns:
+            统计信息
+        """
+        self._flush()
+        for f in self._files.values():
+            f.close()
+
+        frame_timestamp = np.array(self.frame_timestamp, dtype=np.float64)
+        arrays = {
+            "ids": np.array(list(self._id_codes), dtype=np.str_),
+            "frame_timestamp": frame_timestamp,
+            "frame_sequence": np.array(self.frame_sequence, dtype=np.int64),
+            "frame_offsets": np.array([*self.frame_start, self.rows], dtype=np.int64),
+            "time_order": np.argsort(frame_timestamp, kind="stable"),
+        }
+        for name, array in arrays.items():
+            np.save(self.path / f"{name}.npy", array)
+
+        meta = {
+            "version": FRAME_STORE_VERSION,
+            "rows": self.rows,
+            "frames": len(self.frame_start),
+            "value_columns": list(VALUE_COLUMNS),
+            "code_columns": {
+                name: np.dtype(dtype).name for name, dtype in CODE_COLUMNS.items()
+            },
+            "types": list(self._type_codes),
+        }
+        with open(self.path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+
+        return {"frames": meta["frames"], "rows": self.rows, "ids": len(arrays["ids"])}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class FrameStore:
+    """内存映射加载的帧存储"""
+
+    def __init__(self, store_dir: str):
+        """
+        Args:
+            store_dir: FrameStoreWriter 生成的存储目录
+        """
+        store_path = Path(store_dir)
+        with open(store_path / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != FRAME_STORE_VERSION:
+            raise ValueError(f"不支持的帧存储版本: {meta.get('version')}")
+
+        self.rows = meta["rows"]
+        self.types = meta["types"]
+
+        def column(name, dtype):
+            if self.rows == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(
+                store_path / f"{name}.bin", dtype=dtype, mode="r", shape=(self.rows,)
+            )
+
+        self.columns = {name: column(name, np.float64) for name in VALUE_COLUMNS}
+        for name, dtype in meta["code_columns"].items():
+            self.columns[name] = column(name, np.dtype(dtype))
+
+        def load(name):
+            return np.load(store_path / f"{name}.npy", mmap_mode="r")
+
+        self.ids = load("ids")
+        self.frame_timestamp = load("frame_timestamp")
+        self.frame_sequence = load("frame_sequence")
+        self.frame_offsets = load("frame_offsets")
+        self.time_order = load("time_order")
+        self._sorted_timestamp = np.asarray(self.frame_timestamp)[self.time_order]
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.frame_timestamp)
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def frame(self, index: int) -> Dict[str, np.ndarray]:
+        """
+        读取一帧的障碍物列（内存映射视图，不复制）
+
+        Returns:
+            {列名: (N,) 数组}，id / type 列为字符串表下标
+        """
+        start, end = self.frame_offsets[index], self.frame_offsets[index + 1]
+        return {name: values[start:end] for name, values in self.columns.items()}
+
+    def window(self, start_timestamp: float, end_timestamp: float) -> np.ndarray:
+        """时间戳在 [start_timestamp, end_timestamp] 内的帧下标（按时间排序）"""
+        lo = np.searchsorted(self._sorted_timestamp, start_timestamp, side="left")
+        hi = np.searchsorted(self._sorted_timestamp, end_timestamp, side="right")
+        return np.asarray(self.time_order[lo:hi])
+
+    def frame_at(self, timestamp: float) -> int:
+        """时间戳不晚于 timestamp 的最近一帧（早于所有帧时返回第一帧）"""
+        pos = np.searchsorted(self._sorted_timestamp, timestamp, side="right") - 1
+        return int(self.time_order[max(pos, 0)])
+
+    def objects(self, index: int) -> List[dict]:
+        """
+        以 data.json 格式返回一帧的障碍物（可直接用于匹配和场景生成）
+
+        Returns:
+            障碍物列表，只包含 id、type 和位置、朝向、尺寸字段
+        """
+        frame = self.frame(index)
+        ids = self.ids[np.asarray(frame["id"])].tolist()
+        types = [self.types[code] for code in frame["type"].tolist()]
+        values = zip(*(frame[name].tolist() for name in VALUE_COLUMNS))
+        return [
+            {"id": obj_id, "type": obj_type, **dict(zip(VALUE_FIELDS, row))}
+            for obj_id, obj_type, row in zip(ids, types, values)
+        ]
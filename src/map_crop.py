@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+地图裁剪模块
+根据场景障碍物的范围（加边距）裁剪地图，只保留相交的元素及其引用，
+输出更小但引用自洽的子地图
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+from map_geometry import ELEMENT_TYPES, MapGeometry
+from step3_create_scenario import load_scenario_file
+
+# Lane 上指向其他 lane 的引用字段（保留一跳邻居）
+LANE_NEIGHBOR_FIELDS = (
+    "predecessor_id",
+    "successor_id",
+    "left_neighbor_forward_lane_id",
+    "right_neighbor_forward_lane_id",
+    "left_neighbor_reverse_lane_id",
+    "right_neighbor_reverse_lane_id",
+    "self_reverse_lane_id",
+)
+
+
+def scenario_region(
+    scenario_file: str, margin: float = 100.0
+) -> Tuple[float, float, float, float]:
+    """
+    计算场景中障碍物和主车位置的包围盒（加边距）
+
+    初始位置为 lanePosition 时，使用 step 3 在实体 properties 中保留的世界坐标
+    （world_x / world_y）；两者都没有的初始位置跳过
+
+    Args:
+        scenario_file: 场景文件路径（坐标系需与变换后的地图一致，支持 gzip 压缩）
+        margin: 边距（米）
+
+    Returns:
+        (min_x, min_y, max_x, max_y)
+    """
+    scenario, _, _ = load_scenario_file(scenario_file)
+
+    positions = []
+    entity_positions = _entity_world_positions(scenario)
+    privates = scenario["scenario"]["storyboard"]["init"]["actions"]["privates"]
+    for private in privates:
+        entity_ref = private.get("entityRef", {}).get("entityRef")
+        for action in private["privateActions"]:
+            if "teleportAction" in action:
+                pos = action["teleportAction"]["position"].get("worldPosition")
+                if pos is not None:
+                    positions.append((pos["x"], pos["y"]))
+                elif entity_ref in entity_positions:
+                    positions.append(entity_positions[entity_ref])
+
+    # 主车起点、终点和路由点
+    auto_car = scenario["scenario"].get("autoCarInfo", {})
+    for key in ("start", "end"):
+        if key in auto_car:
+            positions.append((auto_car[key]["x"], auto_car[key]["y"]))
+    for waypoint in auto_car.get("routingRequest", {}).get("waypoint", []):
+        positions.append((waypoint["pose"]["x"], waypoint["pose"]["y"]))
+
+    if not positions:
+        raise ValueError(f"场景中没有可用于裁剪的位置: {scenario_file}")
+
+    xy = np.array(positions, dtype=np.float64)
+    min_x, min_y = xy.min(axis=0) - margin
+    max_x, max_y = xy.max(axis=0) + margin
+    return float(min_x), float(min_y), float(max_x), float(max_y)
+
+
+def _entity_world_positions(scenario: dict) -> dict:
+    """从实体 properties 中读取 step 3 保留的世界坐标 {实体 ID: (x, y)}"""
+    positions = {}
+    entities = scenario["scenario"].get("entities", {})
+    for scenario_object in entities.get("scenarioObjects", []):
+        if "properties" in scenario_object:
+            properties = scenario_object["properties"]
+        else:
+            entity = next(iter(scenario_object.get("entityObject", {}).values()), {})
+            properties = entity.get("properties") or {}
+        values = {p["name"]: p["value"] for p in properties.get("property", [])}
+        if "world_x" in values and "world_y" in values:
+            positions[scenario_object["id"]] = (
+                float(values["world_x"]),
+                float(values["world_y"]),
+            )
+    return positions
+
+
+def _elements_in_region(geometry: MapGeometry, region) -> np.ndarray:
+    """返回包围盒与区域相交的元素（下标对应 geometry 的元素表）"""
+    min_x, min_y, max_x, max_y = region
+    lengths = np.diff(geometry.offsets)
+    nonempty = np.nonzero(lengths)[0]
+    hit = np.zeros(len(geometry.element_ids), dtype=bool)
+    if len(nonempty) == 0:
+        return hit
+
+    starts = geometry.offsets[nonempty]
+    poly_min = np.minimum.reduceat(geometry.points, starts, axis=0)
+    poly_max = np.maximum.reduceat(geometry.points, starts, axis=0)
+    # reduceat 对空折线会取下一个点，这里只保留非空折线
+    poly_hit = (
+        (poly_min[:, 0] <= max_x)
+        & (poly_max[:, 0] >= min_x)
+        & (poly_min[:, 1] <= max_y)
+        & (poly_max[:, 1] >= min_y)
+    )
+    hit[geometry.polyline_element[nonempty[poly_hit]]] = True
+    return hit
+
+
+def _is_repeated(field) -> bool:
+    """兼容新旧 protobuf 版本的 repeated 字段判断"""
+    if hasattr(field, "is_repeated"):
+        return field.is_repeated
+    return field.label == field.LABEL_REPEATED
+
+
+def _filter_id_refs(message, kept_ids: set) -> int:
+    """
+    删除消息中指向已裁剪元素的 Id 引用（只处理顶层字段，跳过自身 id）
+
+    Returns:
+        删除的引用数量
+    """
+    removed = 0
+    for field, value in message.ListFields():
+        if field.message_type is None or field.message_type.name != "Id":
+            continue
+        if field.name == "id":
+            continue
+        if _is_repeated(field):
+            keep = [ref.id for ref in value if ref.id in kept_ids]
+            if len(keep) != len(value):
+                removed += len(value) - len(keep)
+                del value[:]
+                for ref_id in keep:
+                    value.add().id = ref_id
+        elif value.id not in kept_ids:
+            message.ClearField(field.name)
+            removed += 1
+    return removed
+
+
+def crop_map(map_obj, geometry: MapGeometry, region):
+    """
+    裁剪地图
+
+    保留规则:
+      1. 几何与区域相交的元素
+      2. 保留 lane 的一跳邻居（前驱/后继/左右相邻/反向车道）
+      3. 包含保留 lane 的 road，被保留 lane/road 引用的 junction
+      4. 所有对象都被保留的 overlap
+      5. 不参与几何裁剪的元素类型（如 pnc_junction）整体保留
+    最后删除所有指向已裁剪元素的引用，保证子地图自洽
+
+    Args:
+        map_obj: 变换后的 map_pb2.Map 对象
+        geometry: map_obj 的几何（extract_map_geometry 的结果）
+        region: (min_x, min_y, max_x, max_y)
+
+    Returns:
+        (cropped_map, stats)，cropped_map 为新的 Map 对象，
+        stats 包含每类元素裁剪前后的数量 counts 和删除的引用数 removed_refs
+    """
+    hit = _elements_in_region(geometry, region)
+    kept = {element_type: set() for element_type in ELEMENT_TYPES}
+    for element_id, element_type, is_hit in zip(
+        geometry.element_ids, geometry.element_type.tolist(), hit.tolist()
+    ):
+        if is_hit:
+            kept[ELEMENT_TYPES[element_type]].add(element_id)
+
+    # lane 一跳邻居
+    neighbor_ids = set()
+    for lane in map_obj.lane:
+        if lane.id.id in kept["lane"]:
+            for field in LANE_NEIGHBOR_FIELDS:
+                if hasattr(lane, field):
+                    neighbor_ids.update(ref.id for ref in getattr(lane, field))
+    kept["lane"] |= neighbor_ids
+
+    # 包含保留 lane 的 road
+    for road in map_obj.road:
+        if any(
+            lane_id.id in kept["lane"]
+            for section in road.section
+            for lane_id in section.lane_id
+        ):
+            kept["road"].add(road.id.id)
+
+    # 被引用的 junction
+    for lane in map_obj.lane:
+        if lane.id.id in kept["lane"] and lane.HasField("junction_id"):
+            kept["junction"].add(lane.junction_id.id)
+    for road in map_obj.road:
+        if road.id.id in kept["road"] and road.HasField("junction_id"):
+            kept["junction"].add(road.junction_id.id)
+
+    cropped = type(map_obj)()
+    cropped.header.CopyFrom(map_obj.header)
+
+    counts = {}
+    kept_ids = set()
+    element_fields = []
+    for field in map_obj.DESCRIPTOR.fields:
+        if not _is_repeated(field) or field.message_type is None:
+            continue
+        if field.name == "overlap":
+            continue
+        source = getattr(map_obj, field.name)
+        target = getattr(cropped, field.name)
+        for element in source:
+            if field.name not in kept or element.id.id in kept[field.name]:
+                target.add().CopyFrom(element)
+        if field.name in kept:
+            counts[field.name] = (len(source), len(target))
+        kept_ids.update(element.id.id for element in target)
+        element_fields.append(field.name)
+
+    # overlap: 所有对象都保留时才保留
+    kept_overlaps = 0
+    for overlap in map_obj.overlap:
+        if all(obj.id.id in kept_ids for obj in overlap.object):
+            cropped.overlap.add().CopyFrom(overlap)
+            kept_overlaps += 1
+    counts["overlap"] = (len(map_obj.overlap), kept_overlaps)
+    kept_ids.update(overlap.id.id for overlap in cropped.overlap)
+
+    # 删除悬空引用
+    removed_refs = 0
+    for field_name in element_fields:
+        for element in getattr(cropped, field_name):
+            removed_refs += _filter_id_refs(element, kept_ids)
+    for road in cropped.road:
+        for section in road.section:
+            removed_refs += _filter_id_refs(section, kept_ids)
+
+    return cropped, {"counts": counts, "removed_refs": removed_refs}
@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+地图几何提取模块
+按固定遍历顺序收集 Apollo HD Map 中的所有坐标点，提供向量化的读写接口
+"""
+
+import time
+from typing import List
+
+import numpy as np
+
+# 元素类型（遍历顺序与 MapOffsetTransformer.transform_map 保持一致）
+ELEMENT_TYPES = (
+    "lane",
+    "road",
+    "junction",
+    "crosswalk",
+    "stop_sign",
+    "signal",
+    "yield_sign",
+    "clear_area",
+    "speed_bump",
+    "parking_space",
+)
+
+# 折线在元素中的角色
+POLYLINE_ROLES = (
+    "central_curve",
+    "left_boundary",
+    "right_boundary",
+    "outer_polygon",
+    "polygon",
+    "stop_line",
+    "position",
+)
+
+ELEMENT_TYPE_CODES = {name: code for code, name in enumerate(ELEMENT_TYPES)}
+POLYLINE_ROLE_CODES = {name: code for code, name in enumerate(POLYLINE_ROLES)}
+
+# 来自 line_segment 的折线角色（polygon 为闭合多边形，不参与简化）
+LINE_SEGMENT_ROLES = tuple(role for role in POLYLINE_ROLES if role != "polygon")
+
+
+def _curve_points(curve):
+    """遍历 Curve 中每个 line_segment 的点容器"""
+    for segment in curve.segment:
+        yield segment.line_segment.point
+
+
+def iter_map_polylines(map_obj):
+    """
+    按固定顺序遍历地图中的所有折线
+
+    Args:
+        map_obj: map_pb2.Map 对象
+
+    Yields:
+        (element_type, element, role, points) 元组，points 为 PointENU 的 repeated 字段
+    """
+    for lane in map_obj.lane:
+        for points in _curve_points(lane.central_curve):
+            yield "lane", lane, "central_curve", points
+        for points in _curve_points(lane.left_boundary.curve):
+            yield "lane", lane, "left_boundary", points
+        for points in _curve_points(lane.right_boundary.curve):
+            yield "lane", lane, "right_boundary", points
+
+    for road in map_obj.road:
+        for section in road.section:
+            for edge in section.boundary.outer_polygon.edge:
+                for points in _curve_points(edge.curve):
+                    yield "road", road, "outer_polygon", points
+
+    for element_type in ("junction", "crosswalk"):
+        if hasattr(map_obj, element_type):
+            for element in getattr(map_obj, element_type):
+                if hasattr(element, "polygon"):
+                    yield element_type, element, "polygon", element.polygon.point
+
+    for element_type in ("stop_sign", "signal", "yield_sign"):
+        if hasattr(map_obj, element_type):
+            for element in getattr(map_obj, element_type):
+                for stop_line in element.stop_line:
+                    for points in _curve_points(stop_line):
+                        yield element_type, element, "stop_line", points
+
+    if hasattr(map_obj, "clear_area"):
+        for clear_area in map_obj.clear_area:
+            if hasattr(clear_area, "polygon"):
+                yield "clear_area", clear_area, "polygon", clear_area.polygon.point
+
+    if hasattr(map_obj, "speed_bump"):
+        for speed_bump in map_obj.speed_bump:
+            if hasattr(speed_bump, "position"):
+                for curve in speed_bump.position:
+                    for points in _curve_points(curve):
+                        yield "speed_bump", speed_bump, "position", points
+
+    if hasattr(map_obj, "parking_space"):
+        for parking_space in map_obj.parking_space:
+            if hasattr(parking_space, "polygon"):
+                yield (
+                    "parking_space",
+                    parking_space,
+                    "polygon",
+                    parking_space.polygon.point,
+                )
+
+
+class MapGeometry:
+    """
+    地图几何的扁平数组表示
+
+    Attributes:
+        points: (N, 2) 所有点的 x, y 坐标
+        offsets: (P + 1,) 每条折线在 points 中的起始下标
+        polyline_element: (P,) 每条折线所属元素在元素表中的下标
+        polyline_role: (P,) 每条折线的角色编码（见 POLYLINE_ROLES）
+        element_type: (E,) 每个元素的类型编码（见 ELEMENT_TYPES）
+        element_ids: 每个元素的 ID
+        containers: 每条折线对应的 proto 点容器（仅从 Map 提取时存在）
+    """
+
+    def __init__(
+        self,
+        points: np.ndarray,
+        offsets: np.ndarray,
+        polyline_element: np.ndarray,
+        polyline_role: np.ndarray,
+        element_type: np.ndarray,
+        element_ids: List[str],
+        containers: list = None,
+    ):
+        self.points = points
+        self.offsets = offsets
+        self.polyline_element = polyline_element
+        self.polyline_role = polyline_role
+        self.element_type = element_type
+        self.element_ids = element_ids
+        self.containers = containers
+
+    @property
+    def num_points(self) -> int:
+        return len(self.points)
+
+    @property
+    def num_polylines(self) -> int:
+        return len(self.polyline_element)
+
+    def detached(self) -> "MapGeometry":
+        """返回共享当前数组、但不持有 proto 引用的副本（points 被替换时不受影响）"""
+        return MapGeometry(
+            points=self.points,
+            offsets=self.offsets,
+            polyline_element=self.polyline_element,
+            polyline_role=self.polyline_role,
+            element_type=self.element_type,
+            element_ids=self.element_ids,
+        )
+
+    def polyline_point_type(self) -> np.ndarray:
+        """返回每个点所属元素的类型编码 (N,)"""
+        polyline_type = self.element_type[self.polyline_element]
+        return np.repeat(polyline_type, np.diff(self.offsets))
+
+    def point_counts_by_type(self) -> dict:
+        """按元素类型统计点数"""
+        counts = np.bincount(
+            self.polyline_point_type(), minlength=len(ELEMENT_TYPES)
+        )
+        return {name: int(counts[code]) for code, name in enumerate(ELEMENT_TYPES)}
+
+    def bounds(self):
+        """
+        计算所有点的包围盒
+
+        Returns:
+            (min_x, min_y, max_x, max_y)，没有点时返回 None
+        """
+        if self.num_points == 0:
+            return None
+        min_x, min_y = self.points.min(axis=0)
+        max_x, max_y = self.points.max(axis=0)
+        return float(min_x), float(min_y), float(max_x), float(max_y)
+
+    def simplify(self, tolerance: float) -> dict:
+        """
+        对所有 line_segment 折线做 Douglas-Peucker 简化，并同步修改 proto
+
+        端点始终保留，因此 CurveSegment 的 start_position / heading 和
+        车道之间的衔接不受影响
+
+        Args:
+            tolerance: 简化容差（米）
+
+        Returns:
+            {element_type: 删除的点数}
+        """
+        if self.containers is None:
+            raise ValueError("该几何对象不包含 proto 引用，无法写回")
+
+        line_codes = [POLYLINE_ROLE_CODES[role] for role in LINE_SEGMENT_ROLES]
+        selected = np.isin(self.polyline_role, line_codes)
+        keep = douglas_peucker_mask(self.points, self.offsets, selected, tolerance)
+
+        point_type = self.polyline_point_type()
+        removed_counts = np.bincount(point_type[~keep], minlength=len(ELEMENT_TYPES))
+
+        # 只重建有点被删除的折线
+        kept_cumsum = np.concatenate([[0], np.cumsum(keep, dtype=np.int64)])
+        kept_per_polyline = (
+            kept_cumsum[self.offsets[1:]] - kept_cumsum[self.offsets[:-1]]
+        )
+        changed = np.nonzero(kept_per_polyline != np.diff(self.offsets))[0]
+        offsets = self.offsets.tolist()
+        keep_list = keep.tolist()
+        for i in changed.tolist():
+            container = self.containers[i]
+            start = offsets[i]
+            kept_points = [
+                (point.x, point.y, point.z)
+                for point, k in zip(container, keep_list[start : offsets[i + 1]])
+                if k
+            ]
+            del container[:]
+            for x, y, z in kept_points:
+                point = container.add()
+                point.x = x
+                point.y = y
+                point.z = z
+
+        self.points = self.points[keep]
+        self.offsets = np.concatenate([[0], np.cumsum(kept_per_polyline)]).astype(
+            np.int64
+        )
+        return {
+            name: int(removed_counts[code]) for code, name in enumerate(ELEMENT_TYPES)
+        }
+
+    def save_npz(self, filepath: str):
+        """
+        将几何保存为未压缩的 .npz（列式数组）
+
+        包含的数组:
+            points, offsets, polyline_element, polyline_role,
+            element_type, element_ids, element_type_names, polyline_role_names
+
+        Args:
+            filepath: 输出文件路径
+        """
+        np.savez(
+            filepath,
+            points=self.points,
+            offsets=self.offsets,
+            polyline_element=self.polyline_element,
+            polyline_role=self.polyline_role,
+            element_type=self.element_type,
+            element_ids=np.array(self.element_ids, dtype=np.str_),
+            element_type_names=np.array(ELEMENT_TYPES, dtype=np.str_),
+            polyline_role_names=np.array(POLYLINE_ROLES, dtype=np.str_),
+        )
+
+    def write_points(self, xy: np.ndarray, perf=None):
+        """
+        将坐标数组写回 proto 点容器
+
+        Args:
+            xy: (N, 2) 坐标数组，顺序与 points 相同
+            perf: 性能记录器（可选），按元素类型记录 write.<type> 阶段
+        """
+        if self.containers is None:
+            raise ValueError("该几何对象不包含 proto 引用，无法写回")
+
+        xs = xy[:, 0].tolist()
+        ys = xy[:, 1].tolist()
+        offsets = self.offsets.tolist()
+
+        # 遍历顺序中同类元素的折线是连续的，按类型分块写回
+        polyline_type = self.element_type[self.polyline_element]
+        bounds = np.flatnonzero(np.diff(polyline_type)) + 1
+        block_starts = [0] + bounds.tolist()
+        block_ends = bounds.tolist() + [self.num_polylines]
+        for block_start, block_end in zip(block_starts, block_ends):
+            start_time = time.perf_counter()
+            for i in range(block_start, block_end):
+                start = offsets[i]
+                end = offsets[i + 1]
+                for point, x, y in zip(
+                    self.containers[i], xs[start:end], ys[start:end]
+                ):
+                    point.x = x
+                    point.y = y
+            if perf is not None and block_end > block_start:
+                perf.add(
+                    f"write.{ELEMENT_TYPES[polyline_type[block_start]]}",
+                    time.perf_counter() - start_time,
+                    offsets[block_end] - offsets[block_start],
+                )
+
+
+def load_map_geometry(filepath: str) -> MapGeometry:
+    """
+    加载 MapGeometry.save_npz 导出的几何
+
+    Args:
+        filepath: .npz 文件路径
+
+    Returns:
+        MapGeometry 对象（不包含 proto 引用）
+    """
+    with np.load(filepath) as data:
+        if tuple(data["element_type_names"]) != ELEMENT_TYPES or tuple(
+            data["polyline_role_names"]
+        ) != POLYLINE_ROLES:
+            raise ValueError(f"几何文件的类型表与当前版本不一致: {filepath}")
+
+        return MapGeometry(
+            points=data["points"],
+            offsets=data["offsets"],
+            polyline_element=data["polyline_element"],
+            polyline_role=data["polyline_role"],
+            element_type=data["element_type"],
+            element_ids=data["element_ids"].tolist(),
+        )
+
+
+def compare_geometry(
+    source: MapGeometry,
+    output: MapGeometry,
+    forward,
+    inverse,
+) -> dict:
+    """
+    校验 output 是否为 source 在给定变换下的结果
+
+    两者需按同一遍历顺序提取；先比较每类元素的点数和每条折线的点数，
+    结构一致时再向量化计算正向/逆向残差
+
+    Args:
+        source: 输入地图的几何
+        output: 输出地图的几何
+        forward: 正向变换函数，(N, 2) -> (N, 2)
+        inverse: 逆变换函数，(N, 2) -> (N, 2)
+
+    Returns:
+        校验报告字典
+    """
+    source_counts = source.point_counts_by_type()
+    output_counts = output.point_counts_by_type()
+    mismatched_types = [
+        name for name in ELEMENT_TYPES if source_counts[name] != output_counts[name]
+    ]
+
+    structure_ok = (
+        not mismatched_types
+        and np.array_equal(source.offsets, output.offsets)
+        and np.array_equal(source.element_type, output.element_type)
+        and list(source.element_ids) == list(output.element_ids)
+    )
+
+    report = {
+        "structure_ok": bool(structure_ok),
+        "num_points": [source.num_points, output.num_points],
+        "num_polylines": [source.num_polylines, output.num_polylines],
+        "point_counts": {
+            name: [source_counts[name], output_counts[name]] for name in ELEMENT_TYPES
+        },
+        "mismatched_types": mismatched_types,
+    }
+    if not structure_ok or source.num_points == 0:
+        return report
+
+    forward_residual = np.linalg.norm(forward(source.points) - output.points, axis=1)
+    inverse_residual = np.linalg.norm(inverse(output.points) - source.points, axis=1)
+    report.update(
+        forward_max=float(forward_residual.max()),
+        forward_mean=float(forward_residual.mean()),
+        inverse_max=float(inverse_residual.max()),
+        inverse_mean=float(inverse_residual.mean()),
+    )
+    return report
+
+
+def douglas_peucker_mask(
+    points: np.ndarray,
+    offsets: np.ndarray,
+    selected: np.ndarray,
+    tolerance: float,
+) -> np.ndarray:
+    """
+    向量化的 Douglas-Peucker 折线简化
+
+    所有折线的待处理区间同时推进：每一轮对全部区间的内部点计算到弦的距离，
+    按区间取最大值，超过容差的区间在最远点处一分为二
+
+    Args:
+        points: (N, 2) 所有点
+        offsets: (P + 1,) 折线起始下标
+        selected: (P,) 是否简化该折线
+        tolerance: 容差（米）
+
+    Returns:
+        (N,) 布尔数组，True 表示保留该点
+    """
+    keep = np.ones(len(points), dtype=bool)
+    lengths = np.diff(offsets)
+    polylines = np.nonzero(selected & (lengths >= 3))[0]
+    if len(polylines) == 0:
+        return keep
+
+    # 区间为闭区间 [start, end]，端点保留，内部点先标记为删除
+    starts = offsets[polylines]
+    ends = offsets[polylines + 1] - 1
+    interior = lengths[polylines] - 2
+    keep[
+        np.repeat(starts + 1 - np.cumsum(interior) + interior, interior)
+        + np.arange(interior.sum())
+    ] = False
+
+    while len(starts):
+        counts = ends - starts - 1
+        active = counts > 0
+        starts, ends, counts = starts[active], ends[active], counts[active]
+        if len(starts) == 0:
+            break
+
+        range_offsets = np.cumsum(counts) - counts
+        range_id = np.repeat(np.arange(len(starts)), counts)
+        index = np.repeat(starts + 1 - range_offsets, counts) + np.arange(counts.sum())
+
+        # 点到弦（线段）的距离
+        a = points[starts][range_id]
+        d = points[ends][range_id] - a
+        p = points[index] - a
+        seg_len2 = (d**2).sum(axis=1)
+        t = np.clip(
+            (p * d).sum(axis=1) / np.where(seg_len2 > 0, seg_len2, 1.0), 0.0, 1.0
+        )
+        dist = np.hypot(p[:, 0] - t * d[:, 0], p[:, 1] - t * d[:, 1])
+
+        # 每个区间的最远点（取第一个最大值）
+        max_dist = np.maximum.reduceat(dist, range_offsets)
+        is_max = dist == max_dist[range_id]
+        first = np.flatnonzero(is_max)
+        _, first_in_range = np.unique(range_id[first], return_index=True)
+        split_index = index[first[first_in_range]]
+
+        split = max_dist > tolerance
+        keep[split_index[split]] = True
+        starts, ends = (
+            np.concatenate([starts[split], split_index[split]]),
+            np.concatenate([split_index[split], ends[split]]),
+        )
+
+    return keep
+
+
+def extract_map_geometry(map_obj, perf=None) -> MapGeometry:
+    """
+    从地图中提取所有坐标点
+
+    Args:
+        map_obj: map_pb2.Map 对象
+        perf: 性能记录器（可选），按元素类型记录 extract.<type> 阶段
+
+    Returns:
+        MapGeometry 对象（保留 proto 点容器引用，可写回）
+    """
+    coords = []
+    offsets = [0]
+    polyline_element = []
+    polyline_role = []
+    element_type = []
+    element_ids = []
+    containers = []
+
+    last_element = None
+    current_type = None
+    type_start_time = time.perf_counter()
+    type_start_points = 0
+
+    def record_type():
+        if perf is not None and current_type is not None:
+            perf.add(
+                f"extract.{current_type}",
+                time.perf_counter() - type_start_time,
+                len(coords) // 2 - type_start_points,
+            )
+
+    for type_name, element, role, points in iter_map_polylines(map_obj):
+        if type_name != current_type:
+            record_type()
+            current_type = type_name
+            type_start_time = time.perf_counter()
+            type_start_points = len(coords) // 2
+
+        if element is not last_element:
+            element_type.append(ELEMENT_TYPE_CODES[type_name])
+            element_ids.append(element.id.id)
+            last_element = element
+
+        coords.extend([c for point in points for c in (point.x, point.y)])
+        offsets.append(len(coords) // 2)
+        polyline_element.append(len(element_ids) - 1)
+        polyline_role.append(POLYLINE_ROLE_CODES[role])
+        containers.append(points)
+    record_type()
+
+    return MapGeometry(
+        points=np.array(coords, dtype=np.float64).reshape(-1, 2),
+        offsets=np.array(offsets, dtype=np.int64),
+        polyline_element=np.array(polyline_element, dtype=np.int32),
+        polyline_role=np.array(polyline_role, dtype=np.int8),
+        element_type=np.array(element_type, dtype=np.int8),
+        element_ids=element_ids,
+        containers=containers,
+    )
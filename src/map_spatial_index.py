@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""
+地图空间索引模块
+对 lane / crosswalk / junction / parking_space 几何建立均匀网格索引，
+以 .npy 文件保存，加载时内存映射，支持区域查询和最近车道查询
+"""
+
+import json
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from map_geometry import ELEMENT_TYPE_CODES, POLYLINE_ROLE_CODES, MapGeometry
+
+# 参与索引的元素类型及其形状折线的角色
+INDEXED_SHAPES = {
+    "lane": "central_curve",
+    "crosswalk": "polygon",
+    "junction": "polygon",
+    "parking_space": "polygon",
+}
+
+INDEX_FORMAT_VERSION = 1
+
+
+def _select_shape_polylines(geometry: MapGeometry) -> np.ndarray:
+    """返回参与索引的折线下标"""
+    polyline_type = geometry.element_type[geometry.polyline_element]
+    mask = np.zeros(geometry.num_polylines, dtype=bool)
+    for type_name, role in INDEXED_SHAPES.items():
+        mask |= (polyline_type == ELEMENT_TYPE_CODES[type_name]) & (
+            geometry.polyline_role == POLYLINE_ROLE_CODES[role]
+        )
+    # 忽略空折线
+    mask &= np.diff(geometry.offsets) > 0
+    return np.nonzero(mask)[0]
+
+
+def build_spatial_index(
+    geometry: MapGeometry, output_dir: str, cell_size: float = 50.0
+) -> dict:
+    """
+    根据地图几何构建网格索引并保存
+
+    保存的文件:
+        meta.json            网格原点、单元尺寸、行列数
+        element_ids.npy      (E,) 元素 ID
+        element_type.npy     (E,) 元素类型编码
+        element_bbox.npy     (E, 4) 元素包围盒 min_x, min_y, max_x, max_y
+        shape_points.npy     (N, 2) 形状折线点（lane 为中心线，其余为多边形）
+        shape_offsets.npy    (P + 1,) 每条形状折线的起始下标
+        shape_element.npy    (P,) 每条形状折线所属元素
+        cell_start.npy       (C + 1,) 每个网格单元在 cell_items 中的起始下标
+        cell_items.npy       (M,) 网格单元内的元素下标
+
+    Args:
+        geometry: 变换后的地图几何
+        output_dir: 索引目录
+        cell_size: 网格单元尺寸（米）
+
+    Returns:
+        索引统计信息
+    """
+    polylines = _select_shape_polylines(geometry)
+    starts = geometry.offsets[polylines]
+    ends = geometry.offsets[polylines + 1]
+    lengths = ends - starts
+
+    # 形状折线点（按折线顺序拼接）
+    point_index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(
+        lengths.sum()
+    )
+    shape_points = geometry.points[point_index]
+    shape_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+    # 重新编号元素，只保留参与索引的元素
+    source_elements, shape_element = np.unique(
+        geometry.polyline_element[polylines], return_inverse=True
+    )
+    shape_element = shape_element.astype(np.int32)
+    element_type = geometry.element_type[source_elements]
+    element_ids = np.array(
+        [geometry.element_ids[i] for i in source_elements], dtype=np.str_
+    )
+
+    # 折线包围盒 -> 元素包围盒
+    if len(shape_points):
+        poly_min = np.minimum.reduceat(shape_points, shape_offsets[:-1], axis=0)
+        poly_max = np.maximum.reduceat(shape_points, shape_offsets[:-1], axis=0)
+    else:
+        poly_min = poly_max = np.zeros((0, 2))
+    num_elements = len(source_elements)
+    element_bbox = np.empty((num_elements, 4))
+    element_bbox[:, :2] = np.inf
+    element_bbox[:, 2:] = -np.inf
+    np.minimum.at(element_bbox[:, :2], shape_element, poly_min)
+    np.maximum.at(element_bbox[:, 2:], shape_element, poly_max)
+
+    # 网格划分
+    if num_elements:
+        origin = element_bbox[:, :2].min(axis=0)
+        extent = element_bbox[:, 2:].max(axis=0) - origin
+    else:
+        origin = np.zeros(2)
+        extent = np.zeros(2)
+    nx, ny = (np.floor(extent / cell_size).astype(np.int64) + 1).tolist()
+
+    cell_lo = np.floor((element_bbox[:, :2] - origin) / cell_size).astype(np.int64)
+    cell_hi = np.floor((element_bbox[:, 2:] - origin) / cell_size).astype(np.int64)
+    cell_lo = np.clip(cell_lo, 0, [nx - 1, ny - 1])
+    cell_hi = np.clip(cell_hi, 0, [nx - 1, ny - 1])
+    span_x = cell_hi[:, 0] - cell_lo[:, 0] + 1
+    span_y = cell_hi[:, 1] - cell_lo[:, 1] + 1
+    counts = span_x * span_y
+
+    # 展开 (元素, 单元) 对
+    items = np.repeat(np.arange(num_elements, dtype=np.int32), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = np.repeat(cell_lo[:, 0], counts) + local % np.repeat(span_x, counts)
+    cy = np.repeat(cell_lo[:, 1], counts) + local // np.repeat(span_x, counts)
+    cells = cy * nx + cx
+
+    order = np.argsort(cells, kind="stable")
+    cell_items = items[order]
+    cell_start = np.searchsorted(cells[order], np.arange(nx * ny + 1)).astype(np.int64)
+
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    arrays = {
+        "element_ids": element_ids,
+        "element_type": element_type,
+        "element_bbox": element_bbox,
+        "shape_points": shape_points,
+        "shape_offsets": shape_offsets,
+        "shape_element": shape_element,
+        "cell_start": cell_start,
+        "cell_items": cell_items,
+    }
+    for name, array in arrays.items():
+        np.save(output_path / f"{name}.npy", array)
+
+    meta = {
+        "version": INDEX_FORMAT_VERSION,
+        "origin": origin.tolist(),
+        "cell_size": cell_size,
+        "nx": nx,
+        "ny": ny,
+        "element_types": list(INDEXED_SHAPES),
+    }
+    with open(output_path / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+    return {
+        "elements": num_elements,
+        "cells": nx * ny,
+        "entries": len(cell_items),
+    }
+
+
+def _point_polyline_distance(x: float, y: float, points: np.ndarray) -> float:
+    """点到折线的最短距离"""
+    if len(points) == 1:
+        return float(np.hypot(points[0, 0] - x, points[0, 1] - y))
+    a = points[:-1]
+    d = points[1:] - a
+    seg_len2 = (d**2).sum(axis=1)
+    t = ((x - a[:, 0]) * d[:, 0] + (y - a[:, 1]) * d[:, 1]) / np.where(
+        seg_len2 > 0, seg_len2, 1.0
+    )
+    t = np.clip(t, 0.0, 1.0)
+    px = a[:, 0] + t * d[:, 0] - x
+    py = a[:, 1] + t * d[:, 1] - y
+    return float(np.sqrt((px**2 + py**2).min()))
+
+
+class MapSpatialIndex:
+    """内存映射加载的地图网格索引"""
+
+    def __init__(self, index_dir: str):
+        """
+        Args:
+            index_dir: build_spatial_index 生成的索引目录
+        """
+        index_path = Path(index_dir)
+        with open(index_path / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"不支持的索引版本: {meta.get('version')}")
+
+        self.origin = np.array(meta["origin"])
+        self.cell_size = meta["cell_size"]
+        self.nx = meta["nx"]
+        self.ny = meta["ny"]
+
+        def load(name):
+            return np.load(index_path / f"{name}.npy", mmap_mode="r")
+
+        self.element_ids = load("element_ids")
+        self.element_type = load("element_type")
+        self.element_bbox = load("element_bbox")
+        self.shape_points = load("shape_points")
+        self.shape_offsets = load("shape_offsets")
+        self.shape_element = load("shape_element")
+        self.cell_start = load("cell_start")
+        self.cell_items = load("cell_items")
+
+        # 元素 -> 形状折线（shape_element 按元素有序）
+        self._element_shapes = np.searchsorted(
+            self.shape_element, np.arange(len(self.element_ids) + 1)
+        )
+
+    def _cell_range(self, min_x, min_y, max_x, max_y):
+        lo = np.floor((np.array([min_x, min_y]) - self.origin) / self.cell_size)
+        hi = np.floor((np.array([max_x, max_y]) - self.origin) / self.cell_size)
+        lo = np.clip(lo.astype(np.int64), 0, [self.nx - 1, self.ny - 1])
+        hi = np.clip(hi.astype(np.int64), 0, [self.nx - 1, self.ny - 1])
+        return lo, hi
+
+    def _candidates(self, min_x, min_y, max_x, max_y) -> np.ndarray:
+        """返回与查询框所覆盖网格单元相关的元素下标（已去重）"""
+        lo, hi = self._cell_range(min_x, min_y, max_x, max_y)
+        chunks = []
+        for cy in range(lo[1], hi[1] + 1):
+            row = cy * self.nx
+            start = self.cell_start[row + lo[0]]
+            end = self.cell_start[row + hi[0] + 1]
+            chunks.append(self.cell_items[start:end])
+        if not chunks:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(chunks))
+
+    def _type_mask(self, candidates: np.ndarray, types) -> np.ndarray:
+        if types is None:
+            return np.ones(len(candidates), dtype=bool)
+        codes = [ELEMENT_TYPE_CODES[t] for t in types]
+        return np.isin(self.element_type[candidates], codes)
+
+    def query_bbox(
+        self, min_x: float, min_y: float, max_x: float, max_y: float, types=None
+    ) -> List[str]:
+        """
+        查询包围盒与给定区域相交的元素
+
+        Args:
+            min_x, min_y, max_x, max_y: 查询区域
+            types: 元素类型过滤（如 ["lane"]），None 表示全部
+
+        Returns:
+            元素 ID 列表
+        """
+        candidates = self._candidates(min_x, min_y, max_x, max_y)
+        bbox = self.element_bbox[candidates]
+        mask = (
+            (bbox[:, 0] <= max_x)
+            & (bbox[:, 2] >= min_x)
+            & (bbox[:, 1] <= max_y)
+            & (bbox[:, 3] >= min_y)
+            & self._type_mask(candidates, types)
+        )
+        return [str(self.element_ids[i]) for i in candidates[mask]]
+
+    def element_distance(self, element: int, x: float, y: float) -> float:
+        """点到元素形状的最短距离"""
+        distance = np.inf
+        for shape in range(
+            self._element_shapes[element], self._element_shapes[element + 1]
+        ):
+            points = self.shape_points[
+                self.shape_offsets[shape] : self.shape_offsets[shape + 1]
+            ]
+            distance = min(distance, _point_polyline_distance(x, y, points))
+        return distance
+
+    def nearest(
+        self, x: float, y: float, types=("lane",), max_radius: float = 50.0
+    ) -> Tuple[str, float]:
+        """
+        查询距离给定点最近的元素
+
+        Args:
+            x, y: 查询点
+            types: 元素类型过滤，默认只查 lane
+            max_radius: 最大搜索半径（米）
+
+        Returns:
+            (元素 ID, 距离)，半径内没有元素时返回 (None, inf)
+        """
+        radius = min(self.cell_size, max_radius)
+        while True:
+            candidates = self._candidates(
+                x - radius, y - radius, x + radius, y + radius
+            )
+            candidates = candidates[self._type_mask(candidates, types)]
+
+            best_id, best_distance = None, np.inf
+            for element in candidates:
+                distance = self.element_distance(element, x, y)
+                if distance < best_distance:
+                    best_id, best_distance = str(self.element_ids[element]), distance
+
+            # 搜索框内切圆以内的结果才是确定的最近元素
+            if best_distance <= radius or radius >= max_radius:
+                if best_distance > max_radius:
+                    return None, np.inf
+                return best_id, best_distance
+            radius = min(radius * 2, max_radius)
+
+
+class LaneProjector:
+    """
+    车道投影器
+
+    对车道中心线的线段建立均匀网格（单元尺寸等于最大投影距离），
+    每个查询点只检查所在单元及周围 8 个单元，批量计算最近车道的 (lane_id, s, l)
+    """
+
+    def __init__(
+        self,
+        points: np.ndarray,
+        offsets: np.ndarray,
+        polyline_lane: np.ndarray,
+        lane_ids,
+        max_distance: float = 10.0,
+    ):
+        """
+        Args:
+            points: (N, 2) 中心线点
+            offsets: (P + 1,) 每条中心线折线的起始下标
+            polyline_lane: (P,) 每条折线所属车道（同一车道的折线按顺序相邻）
+            lane_ids: 车道 ID 列表
+            max_distance: 最大投影距离（米），超出时视为不在车道上
+        """
+        points = np.asarray(points, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        polyline_lane = np.asarray(polyline_lane, dtype=np.int64)
+        self.lane_ids = [str(lane_id) for lane_id in lane_ids]
+        self.max_distance = float(max_distance)
+
+        # 线段起点下标（不跨越折线）
+        seg_start = np.arange(max(len(points) - 1, 0))
+        seg_poly = np.searchsorted(offsets, seg_start, side="right") - 1
+        keep = seg_start + 1 < offsets[seg_poly + 1]
+        seg_start, seg_poly = seg_start[keep], seg_poly[keep]
+
+        self.seg_a = points[seg_start]
+        self.seg_d = points[seg_start + 1] - self.seg_a
+        seg_len = np.hypot(self.seg_d[:, 0], self.seg_d[:, 1])
+        self.seg_len2 = seg_len**2
+        self.seg_lane = polyline_lane[seg_poly]
+
+        # 线段起点在车道上的弧长 s：车道内的累计长度（同一车道的多条折线首尾相接）
+        seg_cum = np.cumsum(seg_len) - seg_len
+        lane_first_seg = np.searchsorted(self.seg_lane, self.seg_lane, side="left")
+        self.seg_s0 = seg_cum - seg_cum[lane_first_seg] if len(seg_len) else seg_cum
+
+        self._build_grid()
+
+    @classmethod
+    def from_geometry(cls, geometry: MapGeometry, max_distance: float = 10.0):
+        """由 MapGeometry 的车道中心线构建"""
+        polyline_type = geometry.element_type[geometry.polyline_element]
+        polylines = np.nonzero(
+            (polyline_type == ELEMENT_TYPE_CODES["lane"])
+            & (geometry.polyline_role == POLYLINE_ROLE_CODES["central_curve"])
+        )[0]
+        starts = geometry.offsets[polylines]
+        lengths = geometry.offsets[polylines + 1] - starts
+        point_index = np.repeat(
+            starts - np.cumsum(lengths) + lengths, lengths
+        ) + np.arange(lengths.sum())
+        lanes, polyline_lane = np.unique(
+            geometry.polyline_element[polylines], return_inverse=True
+        )
+        return cls(
+            geometry.points[point_index],
+            np.concatenate([[0], np.cumsum(lengths)]),
+            polyline_lane,
+            [geometry.element_ids[i] for i in lanes],
+            max_distance,
+        )
+
+    @classmethod
+    def from_spatial_index(cls, index: "MapSpatialIndex", max_distance: float = 10.0):
+        """由 MapSpatialIndex 中的车道形状（中心线）构建"""
+        shape_type = index.element_type[index.shape_element]
+        shapes = np.nonzero(shape_type == ELEMENT_TYPE_CODES["lane"])[0]
+        starts = index.shape_offsets[shapes]
+        lengths = index.shape_offsets[shapes + 1] - starts
+        point_index = np.repeat(
+            starts - np.cumsum(lengths) + lengths, lengths
+        ) + np.arange(lengths.sum())
+        lanes, polyline_lane = np.unique(
+            index.shape_element[shapes], return_inverse=True
+        )
+        return cls(
+            index.shape_points[point_index],
+            np.concatenate([[0], np.cumsum(lengths)]),
+            polyline_lane,
+            [str(index.element_ids[i]) for i in lanes],
+            max_distance,
+        )
+
+    def _build_grid(self):
+        """将线段按包围盒登记到网格单元"""
+        self._seg_ax = np.ascontiguousarray(self.seg_a[:, 0])
+        self._seg_ay = np.ascontiguousarray(self.seg_a[:, 1])
+        self._seg_dx = np.ascontiguousarray(self.seg_d[:, 0])
+        self._seg_dy = np.ascontiguousarray(self.seg_d[:, 1])
+        self._seg_inv_len2 = 1.0 / np.where(self.seg_len2 > 0, self.seg_len2, np.inf)
+        self.cell_size = max(self.max_distance, 1e-3)
+        seg_b = self.seg_a + self.seg_d
+        seg_min = np.minimum(self.seg_a, seg_b)
+        seg_max = np.maximum(self.seg_a, seg_b)
+        if len(seg_min):
+            self.origin = seg_min.min(axis=0)
+            extent = seg_max.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        self.nx, self.ny = (
+            np.floor(extent / self.cell_size).astype(np.int64) + 1
+        ).tolist()
+
+        cell_lo = np.floor((seg_min - self.origin) / self.cell_size).astype(np.int64)
+        cell_hi = np.floor((seg_max - self.origin) / self.cell_size).astype(np.int64)
+        span_x = cell_hi[:, 0] - cell_lo[:, 0] + 1
+        span_y = cell_hi[:, 1] - cell_lo[:, 1] + 1
+        counts = span_x * span_y
+
+        items = np.repeat(np.arange(len(seg_min), dtype=np.int64), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = np.repeat(cell_lo[:, 0], counts) + local % np.repeat(span_x, counts)
+        cy = np.repeat(cell_lo[:, 1], counts) + local // np.repeat(span_x, counts)
+        cells = cy * self.nx + cx
+
+        order = np.argsort(cells, kind="stable")
+        self.cell_items = items[order]
+        self.cell_start = np.searchsorted(
+            cells[order], np.arange(self.nx * self.ny + 1)
+        )
+
+    def project(self, xy: np.ndarray, chunk_size: int = 20000) -> dict:
+        """
+        批量投影到最近车道
+
+        Args:
+            xy: (M, 2) 查询点
+            chunk_size: 每批处理的点数（限制候选对数组的内存）
+
+        Returns:
+            {"lane": (M,) 车道下标（-1 表示最大距离内没有车道）,
+             "s": (M,) 弧长, "l": (M,) 横向偏移（左正右负）,
+             "distance": (M,) 到中心线的距离, "heading": (M,) 投影处车道朝向}
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        result = {
+            "lane": np.full(len(xy), -1, dtype=np.int64),
+            "s": np.full(len(xy), np.nan),
+            "l": np.full(len(xy), np.nan),
+            "distance": np.full(len(xy), np.inf),
+            "heading": np.full(len(xy), np.nan),
+        }
+        for start in range(0, len(xy), chunk_size):
+            self._project_chunk(xy[start : start + chunk_size], result, start)
+        return result
+
+    def _project_chunk(self, xy: np.ndarray, result: dict, base: int):
+        num = len(xy)
+        cell = np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+
+        # 3x3 邻域单元
+        dx, dy = np.meshgrid([-1, 0, 1], [-1, 0, 1])
+        nx_cells = cell[:, :1] + dx.ravel()
+        ny_cells = cell[:, 1:] + dy.ravel()
+        valid = (
+            (nx_cells >= 0)
+            & (nx_cells < self.nx)
+            & (ny_cells >= 0)
+            & (ny_cells < self.ny)
+        )
+        cell_id = np.where(valid, ny_cells * self.nx + nx_cells, 0)
+        starts = self.cell_start[cell_id]
+        counts = np.where(valid, self.cell_start[cell_id + 1] - starts, 0).ravel()
+        starts = starts.ravel()
+
+        # 展开 (点, 线段) 候选对，按点连续排列
+        total = counts.sum()
+        if total == 0:
+            return
+        pair_point = np.repeat(np.repeat(np.arange(num), 9), counts)
+        local = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_seg = self.cell_items[np.repeat(starts, counts) + local]
+
+        # 按列计算，避免 (P, 2) 临时数组
+        dx = self._seg_dx[pair_seg]
+        dy = self._seg_dy[pair_seg]
+        rx = xy[:, 0][pair_point] - self._seg_ax[pair_seg]
+        ry = xy[:, 1][pair_point] - self._seg_ay[pair_seg]
+        t = (rx * dx + ry * dy) * self._seg_inv_len2[pair_seg]
+        np.clip(t, 0.0, 1.0, out=t)
+        rx -= t * dx
+        ry -= t * dy
+        dist2 = rx * rx + ry * ry
+
+        # 每个点的最近线段（候选对按点连续，用 reduceat 求组内最小值）
+        group_start = np.cumsum(counts.reshape(num, 9).sum(axis=1))
+        group_len = np.diff(np.concatenate([[0], group_start]))
+        has_pairs = group_len > 0
+        first = (group_start - group_len)[has_pairs]
+        group_min = np.minimum.reduceat(dist2, first)
+        is_min = dist2 == np.repeat(group_min, group_len[has_pairs])
+        min_pairs = np.nonzero(is_min)[0]
+        points, first_min = np.unique(pair_point[min_pairs], return_index=True)
+        best = min_pairs[first_min]
+
+        distance = np.sqrt(dist2[best])
+        within = distance <= self.max_distance
+        points, best, distance = points[within], best[within], distance[within]
+
+        seg = pair_seg[best]
+        d = self.seg_d[seg]
+        rel = xy[points] - self.seg_a[seg]
+        seg_len = np.sqrt(self.seg_len2[seg])
+        out = base + points
+        result["lane"][out] = self.seg_lane[seg]
+        result["s"][out] = self.seg_s0[seg] + t[best] * seg_len
+        # 叉积符号：点在车道方向左侧为正
+        cross = d[:, 0] * rel[:, 1] - d[:, 1] * rel[:, 0]
+        result["l"][out] = np.where(cross >= 0, distance, -distance)
+        result["distance"][out] = distance
+        result["heading"][out] = np.arctan2(d[:, 1], d[:, 0])
+
+
+def load_lane_projector(path: str, max_distance: float = 10.0) -> LaneProjector:
+    """
+    从空间索引目录（.index）、几何文件（.npz）或地图文件加载车道投影器
+
+    Args:
+        path: base_map.index 目录、base_map_geometry.npz 或 base_map.bin/.txt
+        max_distance: 最大投影距离（米）
+
+    Returns:
+        LaneProjector 对象
+    """
+    source = Path(path)
+    if source.is_dir():
+        return LaneProjector.from_spatial_index(MapSpatialIndex(path), max_distance)
+    if source.suffix == ".npz":
+        from map_geometry import load_map_geometry
+
+        return LaneProjector.from_geometry(load_map_geometry(path), max_distance)
+
+    # 地图文件需要 Apollo proto
+    from map_geometry import extract_map_geometry
+    from step2_apply_offset_to_map import load_map
+
+    map_obj = load_map(path)
+    if map_obj is None:
+        raise ValueError(f"无法读取地图文件: {path}")
+    return LaneProjector.from_geometry(extract_map_geometry(map_obj), max_distance)
@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+"""
+障碍物过滤模块
+对 data.json 中的障碍物做重复检测合并和重叠过滤（均匀网格哈希 + 向量化有向包围盒相交），
+以及按感兴趣区域（地图车道/路口多边形或自定义走廊）过滤
+"""
+
+import json
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from map_geometry import (
+    ELEMENT_TYPE_CODES,
+    POLYLINE_ROLE_CODES,
+    MapGeometry,
+    extract_map_geometry,
+    load_map_geometry,
+)
+
+
+def obstacle_boxes(objects: List[dict]) -> dict:
+    """
+    提取障碍物的有向包围盒
+
+    Args:
+        objects: data.json 中的障碍物列表
+
+    Returns:
+        {"center": (N, 2), "heading": (N,), "length": (N,), "width": (N,)}
+    """
+    count = len(objects)
+    center = np.empty((count, 2))
+    heading = np.empty(count)
+    size = np.empty((count, 2))
+    for i, obj in enumerate(objects):
+        center[i] = (obj["positionX"], obj["positionY"])
+        heading[i] = obj.get("heading", 0.0)
+        size[i] = (obj.get("length", 0.0), obj.get("width", 0.0))
+    return {
+        "center": center,
+        "heading": heading,
+        "length": size[:, 0],
+        "width": size[:, 1],
+    }
+
+
+def box_corners(boxes: dict) -> np.ndarray:
+    """返回 (N, 4, 2) 逆时针排列的包围盒角点"""
+    cos_h = np.cos(boxes["heading"])
+    sin_h = np.sin(boxes["heading"])
+    half_l = boxes["length"] / 2
+    half_w = boxes["width"] / 2
+    # 局部坐标系下的四个角（逆时针）
+    local_x = np.stack([half_l, -half_l, -half_l, half_l], axis=1)
+    local_y = np.stack([half_w, half_w, -half_w, -half_w], axis=1)
+    cos_h = cos_h[:, None]
+    sin_h = sin_h[:, None]
+    corners = np.empty((len(cos_h), 4, 2))
+    corners[:, :, 0] = boxes["center"][:, :1] + local_x * cos_h - local_y * sin_h
+    corners[:, :, 1] = boxes["center"][:, 1:] + local_x * sin_h + local_y * cos_h
+    return corners
+
+
+def candidate_pairs(corners: np.ndarray, cell_size: float = None) -> np.ndarray:
+    """
+    用均匀网格找出包围盒可能相交的障碍物对
+
+    每个障碍物按轴对齐包围盒登记到覆盖的所有网格单元，只在同一单元内生成候选对，
+    单元尺寸取障碍物尺寸的中位数量级，密集的锥桶区域也只产生线性数量的候选对
+
+    Args:
+        corners: (N, 4, 2) 包围盒角点
+        cell_size: 网格单元尺寸（米），默认按障碍物尺寸自动选择
+
+    Returns:
+        (P, 2) 候选对 (i, j)，i < j
+    """
+    count = len(corners)
+    if count < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    box_min = corners.min(axis=1)
+    box_max = corners.max(axis=1)
+    if cell_size is None:
+        extent = (box_max - box_min).max(axis=1)
+        cell_size = max(2.0 * float(np.median(extent)), 0.5)
+
+    origin = box_min.min(axis=0)
+    cell_lo = np.floor((box_min - origin) / cell_size).astype(np.int64)
+    cell_hi = np.floor((box_max - origin) / cell_size).astype(np.int64)
+    nx = int(cell_hi[:, 0].max()) + 1
+    span_x = cell_hi[:, 0] - cell_lo[:, 0] + 1
+    span_y = cell_hi[:, 1] - cell_lo[:, 1] + 1
+    counts = span_x * span_y
+
+    # 展开 (障碍物, 单元) 对并按单元排序
+    items = np.repeat(np.arange(count, dtype=np.int64), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = np.repeat(cell_lo[:, 0], counts) + local % np.repeat(span_x, counts)
+    cy = np.repeat(cell_lo[:, 1], counts) + local // np.repeat(span_x, counts)
+    cells = cy * nx + cx
+    order = np.lexsort((items, cells))
+    cells = cells[order]
+    items = items[order]
+
+    # 同一单元内两两组合：每个元素与单元内排在它之后的元素配对
+    group_end = np.searchsorted(cells, cells, side="right")
+    position = np.arange(len(cells))
+    later = group_end - position - 1
+    first = np.repeat(items, later)
+    offset = np.arange(later.sum()) - np.repeat(np.cumsum(later) - later, later)
+    second = items[np.repeat(position + 1, later) + offset]
+
+    # 跨单元的障碍物会产生重复的候选对
+    pairs = np.unique(first * count + second)
+    return np.stack([pairs // count, pairs % count], axis=1)
+
+
+def _separated(corners_a: np.ndarray, corners_b: np.ndarray) -> np.ndarray:
+    """分离轴测试：返回 (P,) 布尔数组，True 表示两个矩形不相交"""
+    separated = np.zeros(len(corners_a), dtype=bool)
+    for corners in (corners_a, corners_b):
+        for edge in (0, 1):
+            axis = corners[:, edge + 1] - corners[:, edge]
+            proj_a = np.einsum("pkd,pd->pk", corners_a, axis)
+            proj_b = np.einsum("pkd,pd->pk", corners_b, axis)
+            separated |= (proj_a.max(axis=1) < proj_b.min(axis=1)) | (
+                proj_b.max(axis=1) < proj_a.min(axis=1)
+            )
+    return separated
+
+
+def _clip_area(subject: np.ndarray, clip: np.ndarray) -> np.ndarray:
+    """
+    向量化 Sutherland-Hodgman：计算凸四边形两两相交的面积
+
+    Args:
+        subject: (P, 4, 2) 被裁剪的四边形（逆时针）
+        clip: (P, 4, 2) 裁剪四边形（逆时针）
+
+    Returns:
+        (P,) 相交面积
+    """
+    max_vertices = 8
+    num = len(subject)
+    poly = np.zeros((num, max_vertices, 2))
+    poly[:, :4] = subject
+    size = np.full(num, 4)
+    rows = np.arange(num)
+
+    for edge in range(4):
+        q0 = clip[:, edge]
+        q1 = clip[:, (edge + 1) % 4]
+        edge_dir = q1 - q0
+        # 有向距离（左侧为内侧）
+        side = edge_dir[:, None, 0] * (poly[:, :, 1] - q0[:, None, 1]) - edge_dir[
+            :, None, 1
+        ] * (poly[:, :, 0] - q0[:, None, 0])
+
+        new_poly = np.zeros((num, 2 * max_vertices, 2))
+        new_size = np.zeros(num, dtype=np.int64)
+        for k in range(max_vertices):
+            active = k < size
+            prev = (k - 1) % np.maximum(size, 1)
+            cur_side = side[:, k]
+            prev_side = side[rows, prev]
+            cur_in = cur_side >= 0
+            prev_in = prev_side >= 0
+
+            # 穿越裁剪边时插入交点
+            cross = active & (cur_in != prev_in)
+            denom = np.where(cross, prev_side - cur_side, 1.0)
+            t = np.where(cross, prev_side / denom, 0.0)
+            prev_point = poly[rows, prev]
+            intersection = prev_point + t[:, None] * (poly[:, k] - prev_point)
+            new_poly[rows[cross], new_size[cross]] = intersection[cross]
+            new_size += cross
+
+            keep = active & cur_in
+            new_poly[rows[keep], new_size[keep]] = poly[keep, k]
+            new_size += keep
+
+        poly = new_poly[:, :max_vertices]
+        size = np.minimum(new_size, max_vertices)
+
+    # 鞋带公式
+    valid = np.arange(max_vertices)[None, :] < size[:, None]
+    next_index = (np.arange(max_vertices)[None, :] + 1) % np.maximum(size, 1)[:, None]
+    next_point = poly[rows[:, None], next_index]
+    cross = poly[:, :, 0] * next_point[:, :, 1] - next_point[:, :, 0] * poly[:, :, 1]
+    return np.abs(np.where(valid, cross, 0.0).sum(axis=1)) / 2
+
+
+def overlapping_pairs(
+    boxes: dict, cell_size: float = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    找出相交的障碍物对及其相交面积
+
+    Args:
+        boxes: obstacle_boxes 的结果
+        cell_size: 网格单元尺寸（米），默认自动选择
+
+    Returns:
+        (pairs, area)：(P, 2) 相交的障碍物对，(P,) 相交面积
+    """
+    corners = box_corners(boxes)
+    pairs = candidate_pairs(corners, cell_size)
+    if len(pairs) == 0:
+        return pairs, np.zeros(0)
+
+    corners_a = corners[pairs[:, 0]]
+    corners_b = corners[pairs[:, 1]]
+    hit = ~_separated(corners_a, corners_b)
+    pairs = pairs[hit]
+    area = _clip_area(corners_a[hit], corners_b[hit])
+    return pairs, area
+
+
+def filter_overlapping(
+    objects: List[dict],
+    duplicate_iou: float = 0.7,
+    max_overlap: float = 0.5,
+    cell_size: float = None,
+) -> Tuple[List[dict], dict]:
+    """
+    合并重复检测并过滤重叠的障碍物
+
+    1. 同类型、IoU >= duplicate_iou 的障碍物视为同一障碍物的重复检测，
+       合并为第一次出现的那个（合并的原始 ID 记录在 merged_ids 中）
+    2. 剩余障碍物中相交面积占较小者面积的比例超过 max_overlap 时，删除较小的一个
+
+    Args:
+        objects: data.json 中的障碍物列表
+        duplicate_iou: 判定为重复检测的 IoU 阈值
+        max_overlap: 允许的最大重叠比例（相交面积 / 较小障碍物面积）
+        cell_size: 网格单元尺寸（米），默认自动选择
+
+    Returns:
+        (保留的障碍物列表, {"duplicates": 合并的数量, "overlaps": 删除的数量, "pairs": 相交对数})
+    """
+    stats = {"duplicates": 0, "overlaps": 0, "pairs": 0}
+    if len(objects) < 2:
+        return list(objects), stats
+
+    boxes = obstacle_boxes(objects)
+    pairs, inter = overlapping_pairs(boxes, cell_size)
+    stats["pairs"] = len(pairs)
+    if len(pairs) == 0:
+        return list(objects), stats
+
+    area = boxes["length"] * boxes["width"]
+    area_a = area[pairs[:, 0]]
+    area_b = area[pairs[:, 1]]
+    union = area_a + area_b - inter
+    iou = np.where(union > 0, inter / np.where(union > 0, union, 1.0), 0.0)
+    smaller = np.minimum(area_a, area_b)
+    overlap = np.where(smaller > 0, inter / np.where(smaller > 0, smaller, 1.0), 0.0)
+
+    types = [obj.get("type") for obj in objects]
+    same_type = np.array(
+        [types[i] == types[j] for i, j in pairs.tolist()], dtype=bool
+    )
+
+    # 1. 重复检测：并查集合并到下标最小的障碍物
+    parent = list(range(len(objects)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs[same_type & (iou >= duplicate_iou)].tolist():
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    roots = [find(i) for i in range(len(objects))]
+    kept = np.array([root == i for i, root in enumerate(roots)], dtype=bool)
+    merged = {}
+    for i, root in enumerate(roots):
+        if root != i:
+            merged.setdefault(root, []).append(str(objects[i]["id"]))
+    stats["duplicates"] = int((~kept).sum())
+
+    # 2. 重叠过滤：按重叠比例从大到小，删除较小的障碍物
+    conflict = np.nonzero(overlap > max_overlap)[0]
+    for index in conflict[np.argsort(-overlap[conflict], kind="stable")].tolist():
+        i, j = pairs[index].tolist()
+        if not (kept[i] and kept[j]):
+            continue
+        drop = j if area[j] <= area[i] else i
+        kept[drop] = False
+        stats["overlaps"] += 1
+
+    result = []
+    for i in np.nonzero(kept)[0].tolist():
+        obj = objects[i]
+        if i in merged:
+            obj = {**obj, "merged_ids": merged[i]}
+        result.append(obj)
+    return result, stats
+
+
+class PolygonROI:
+    """
+    感兴趣区域：多边形集合
+
+    多边形按包围盒登记到均匀网格，查询时先按所在网格单元和包围盒筛选候选多边形，
+    再对候选多边形的边做向量化射线法（crossing number）点在多边形内测试
+    """
+
+    def __init__(self, polygons: List[np.ndarray], cell_size: float = 50.0):
+        """
+        Args:
+            polygons: 多边形列表，每个为 (n, 2) 顶点数组（n >= 3，首尾不必重复）
+            cell_size: 网格单元尺寸（米）
+        """
+        polygons = [np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in polygons]
+        polygons = [p for p in polygons if len(p) >= 3]
+        lengths = np.array([len(p) for p in polygons], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.vertices = (
+            np.concatenate(polygons) if polygons else np.zeros((0, 2), dtype=np.float64)
+        )
+        self.num_polygons = len(polygons)
+        self.cell_size = float(cell_size)
+
+        # 边: 顶点 i -> i + 1，每个多边形的最后一个顶点连回第一个
+        next_index = np.arange(1, len(self.vertices) + 1)
+        if self.num_polygons:
+            next_index[self.offsets[1:] - 1] = self.offsets[:-1]
+        self.edge_a = self.vertices
+        self.edge_b = self.vertices[next_index] if len(self.vertices) else self.vertices
+
+        if self.num_polygons:
+            starts = self.offsets[:-1]
+            self.bbox_min = np.minimum.reduceat(self.vertices, starts, axis=0)
+            self.bbox_max = np.maximum.reduceat(self.vertices, starts, axis=0)
+        else:
+            self.bbox_min = self.bbox_max = np.zeros((0, 2))
+        self._build_grid()
+
+    def _build_grid(self):
+        if self.num_polygons:
+            self.origin = self.bbox_min.min(axis=0)
+            extent = self.bbox_max.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        self.nx, self.ny = (
+            np.floor(extent / self.cell_size).astype(np.int64) + 1
+        ).tolist()
+
+        cell_lo = np.floor((self.bbox_min - self.origin) / self.cell_size).astype(
+            np.int64
+        )
+        cell_hi = np.floor((self.bbox_max - self.origin) / self.cell_size).astype(
+            np.int64
+        )
+        span_x = cell_hi[:, 0] - cell_lo[:, 0] + 1
+        span_y = cell_hi[:, 1] - cell_lo[:, 1] + 1
+        counts = span_x * span_y
+
+        items = np.repeat(np.arange(self.num_polygons, dtype=np.int64), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = np.repeat(cell_lo[:, 0], counts) + local % np.repeat(span_x, counts)
+        cy = np.repeat(cell_lo[:, 1], counts) + local // np.repeat(span_x, counts)
+        cells = cy * self.nx + cx
+        order = np.argsort(cells, kind="stable")
+        self.cell_items = items[order]
+        self.cell_start = np.searchsorted(
+            cells[order], np.arange(self.nx * self.ny + 1)
+        )
+
+    @classmethod
+    def from_geometry(
+        cls, geometry: MapGeometry, types=("lane", "junction"), cell_size: float = 50.0
+    ):
+        """
+        由地图几何构建（车道面 = 左边界 + 反向的右边界；路口等为自身多边形）
+
+        Args:
+            geometry: 变换后的地图几何
+            types: 参与的元素类型（lane 以外的类型使用 polygon 角色的折线）
+            cell_size: 网格单元尺寸（米）
+        """
+        polyline_type = geometry.element_type[geometry.polyline_element]
+        offsets = geometry.offsets
+        polygons = []
+
+        if "lane" in types:
+            is_lane = polyline_type == ELEMENT_TYPE_CODES["lane"]
+            # 同一车道的多段边界按顺序拼接
+            boundaries = {"left_boundary": {}, "right_boundary": {}}
+            for role, by_lane in boundaries.items():
+                selected = np.nonzero(
+                    is_lane & (geometry.polyline_role == POLYLINE_ROLE_CODES[role])
+                )[0]
+                for polyline in selected.tolist():
+                    by_lane.setdefault(
+                        int(geometry.polyline_element[polyline]), []
+                    ).append(geometry.points[offsets[polyline] : offsets[polyline + 1]])
+            for element, left_parts in boundaries["left_boundary"].items():
+                right_parts = boundaries["right_boundary"].get(element)
+                if right_parts:
+                    polygons.append(
+                        np.concatenate(left_parts + [np.concatenate(right_parts)[::-1]])
+                    )
+
+        polygon_role = POLYLINE_ROLE_CODES["polygon"]
+        for type_name in types:
+            if type_name == "lane":
+                continue
+            selected = np.nonzero(
+                (polyline_type == ELEMENT_TYPE_CODES[type_name])
+                & (geometry.polyline_role == polygon_role)
+            )[0]
+            for polyline in selected.tolist():
+                polygons.append(
+                    geometry.points[offsets[polyline] : offsets[polyline + 1]]
+                )
+
+        return cls(polygons, cell_size)
+
+    @classmethod
+    def from_file(cls, filepath: str, cell_size: float = 50.0):
+        """
+        由 JSON 文件构建自定义区域（如沿路线的走廊）
+
+        文件格式: [[[x, y], ...], ...] 或 {"polygons": [[[x, y], ...], ...]}
+        """
+        with open(filepath, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data["polygons"]
+        return cls([np.array(polygon, dtype=np.float64) for polygon in data], cell_size)
+
+    def locate(self, xy: np.ndarray, chunk_size: int = 5000) -> np.ndarray:
+        """
+        判断点是否在区域内
+
+        Args:
+            xy: (M, 2) 查询点
+            chunk_size: 每批处理的点数（限制候选对数组的内存）
+
+        Returns:
+            (M,) 状态码: 0 在区域内，1 不在任何多边形的包围盒内，2 在包围盒内但不在多边形内
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        status = np.ones(len(xy), dtype=np.int8)
+        if self.num_polygons == 0:
+            return status
+        for start in range(0, len(xy), chunk_size):
+            status[start : start + chunk_size] = self._locate_chunk(
+                xy[start : start + chunk_size]
+            )
+        return status
+
+    def _locate_chunk(self, xy: np.ndarray) -> np.ndarray:
+        num = len(xy)
+        status = np.ones(num, dtype=np.int8)
+
+        # 所在网格单元内的候选多边形
+        cell = np.floor((xy - self.origin) / self.cell_size).astype(np.int64)
+        valid = (
+            (cell[:, 0] >= 0)
+            & (cell[:, 0] < self.nx)
+            & (cell[:, 1] >= 0)
+            & (cell[:, 1] < self.ny)
+        )
+        cell_id = np.where(valid, cell[:, 1] * self.nx + cell[:, 0], 0)
+        starts = self.cell_start[cell_id]
+        counts = np.where(valid, self.cell_start[cell_id + 1] - starts, 0)
+        pair_point = np.repeat(np.arange(num), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_poly = self.cell_items[np.repeat(starts, counts) + local]
+
+        # 包围盒预筛选
+        pxy = xy[pair_point]
+        in_bbox = (
+            (pxy[:, 0] >= self.bbox_min[pair_poly, 0])
+            & (pxy[:, 0] <= self.bbox_max[pair_poly, 0])
+            & (pxy[:, 1] >= self.bbox_min[pair_poly, 1])
+            & (pxy[:, 1] <= self.bbox_max[pair_poly, 1])
+        )
+        pair_point = pair_point[in_bbox]
+        pair_poly = pair_poly[in_bbox]
+        status[pair_point] = 2
+        if len(pair_point) == 0:
+            return status
+
+        # 展开 (点, 边) 对，射线法统计穿越次数
+        edge_counts = self.offsets[pair_poly + 1] - self.offsets[pair_poly]
+        edge_pair = np.repeat(np.arange(len(pair_point)), edge_counts)
+        edge_local = np.arange(edge_counts.sum()) - np.repeat(
+            np.cumsum(edge_counts) - edge_counts, edge_counts
+        )
+        edge = np.repeat(self.offsets[pair_poly], edge_counts) + edge_local
+        px = xy[pair_point[edge_pair], 0]
+        py = xy[pair_point[edge_pair], 1]
+        ax, ay = self.edge_a[edge, 0], self.edge_a[edge, 1]
+        bx, by = self.edge_b[edge, 0], self.edge_b[edge, 1]
+        straddle = (ay > py) != (by > py)
+        dy = np.where(straddle, by - ay, 1.0)
+        x_cross = ax + (py - ay) * (bx - ax) / dy
+        crossing = straddle & (px < x_cross)
+
+        inside = np.bincount(edge_pair, crossing, minlength=len(pair_point)) % 2 == 1
+        status[pair_point[inside]] = 0
+        return status
+
+
+def filter_roi(objects: List[dict], roi: PolygonROI) -> Tuple[List[dict], dict]:
+    """
+    只保留位置在感兴趣区域内的障碍物
+
+    Args:
+        objects: data.json 中的障碍物列表
+        roi: 感兴趣区域
+
+    Returns:
+        (保留的障碍物列表, {"outside_bbox": 远离所有多边形的数量,
+                            "outside_polygon": 在包围盒内但不在多边形内的数量})
+    """
+    if not objects:
+        return [], {"outside_bbox": 0, "outside_polygon": 0}
+    xy = np.array(
+        [(obj["positionX"], obj["positionY"]) for obj in objects], dtype=np.float64
+    )
+    status = roi.locate(xy)
+    kept = [obj for obj, code in zip(objects, status.tolist()) if code == 0]
+    return kept, {
+        "outside_bbox": int((status == 1).sum()),
+        "outside_polygon": int((status == 2).sum()),
+    }
+
+
+def load_roi(path: str, cell_size: float = 50.0) -> PolygonROI:
+    """
+    加载感兴趣区域
+
+    Args:
+        path: 地图几何文件（_geometry.npz）、地图文件（.bin/.txt）
+            或自定义多边形 JSON 文件
+        cell_size: 网格单元尺寸（米）
+    """
+    source = Path(path)
+    if source.suffix == ".json":
+        return PolygonROI.from_file(path, cell_size)
+    if source.suffix == ".npz":
+        return PolygonROI.from_geometry(load_map_geometry(path), cell_size=cell_size)
+
+    # 地图文件需要 Apollo proto
+    from step2_apply_offset_to_map import load_map
+
+    map_obj = load_map(path)
+    if map_obj is None:
+        raise ValueError(f"无法读取地图文件: {path}")
+    return PolygonROI.from_geometry(extract_map_geometry(map_obj), cell_size=cell_size)
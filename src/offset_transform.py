@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+偏移变换模块
+从 step 1 的偏移结果加载地图使用的变换（平均平移 + 旋转），
+step 2（地图）和 step 3（场景中的其他位置）共用，保证两者的坐标一致
+"""
+
+import json
+
+import numpy as np
+
+# 小于该角度（弧度，约 0.57°）的旋转忽略，只做平移
+ROTATION_THRESHOLD = 0.01
+
+
+def load_offset_from_results(
+    results_file: str = "results/offset_results.json",
+) -> tuple:
+    """
+    从结果文件加载偏移量
+
+    Args:
+        results_file: 偏移结果文件路径
+
+    Returns:
+        (offset_x, offset_y, rotation) 元组
+    """
+    with open(results_file, "r", encoding="utf-8") as f:
+        results = json.load(f)
+
+    offset_x = results["simple_offset_stats"]["dx_mean"]
+    offset_y = results["simple_offset_stats"]["dy_mean"]
+    rotation = results["transformation"]["rotation_radians"]
+
+    return offset_x, offset_y, rotation
+
+
+class OffsetTransform:
+    """偏移变换: 先绕原点旋转（角度小于 ROTATION_THRESHOLD 时忽略），再平移"""
+
+    def __init__(self, offset_x: float, offset_y: float, rotation: float = 0.0):
+        """
+        Args:
+            offset_x: X方向偏移量（米）
+            offset_y: Y方向偏移量（米）
+            rotation: 旋转角度（弧度），默认为0
+        """
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.rotation = rotation
+
+    @classmethod
+    def from_results(cls, results_file: str = "results/offset_results.json"):
+        """从偏移结果文件创建（与 step 2 使用相同的字段）"""
+        return cls(*load_offset_from_results(results_file))
+
+    @property
+    def rotates(self) -> bool:
+        """是否应用旋转"""
+        return abs(self.rotation) >= ROTATION_THRESHOLD
+
+    @property
+    def heading_delta(self) -> float:
+        """朝向的变化量（忽略旋转时为 0）"""
+        return self.rotation if self.rotates else 0.0
+
+    def transform_points(self, xy: np.ndarray) -> np.ndarray:
+        """
+        对坐标数组批量应用变换
+
+        Args:
+            xy: (N, 2) 坐标数组
+
+        Returns:
+            变换后的 (N, 2) 坐标数组
+        """
+        if not self.rotates:
+            return xy + np.array([self.offset_x, self.offset_y])
+
+        cos_theta = np.cos(self.rotation)
+        sin_theta = np.sin(self.rotation)
+        rot = np.array([[cos_theta, -sin_theta], [sin_theta, cos_theta]])
+        return xy @ rot.T + np.array([self.offset_x, self.offset_y])
+
+    def inverse_transform_points(self, xy: np.ndarray) -> np.ndarray:
+        """
+        transform_points 的逆变换
+
+        Args:
+            xy: (N, 2) 变换后的坐标数组
+
+        Returns:
+            (N, 2) 原始坐标数组
+        """
+        shifted = xy - np.array([self.offset_x, self.offset_y])
+        if not self.rotates:
+            return shifted
+
+        cos_theta = np.cos(self.rotation)
+        sin_theta = np.sin(self.rotation)
+        rot = np.array([[cos_theta, -sin_theta], [sin_theta, cos_theta]])
+        return shifted @ rot
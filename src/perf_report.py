@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+性能记录模块
+按阶段记录耗时、处理点数、吞吐量和峰值内存，输出 JSON 报告
+"""
+
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB），不支持的平台返回 0"""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+class PerfRecorder:
+    """阶段性能记录器"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []
+
+    def add(self, name: str, seconds: float, points: int = None):
+        """
+        记录一个阶段
+
+        Args:
+            name: 阶段名称（如 "parse"、"extract.lane"）
+            seconds: 耗时（秒）
+            points: 处理的点数（可选）
+        """
+        stage = {"name": name, "seconds": seconds}
+        if points is not None:
+            stage["points"] = int(points)
+            stage["points_per_sec"] = points / seconds if seconds > 0 else None
+        stage["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        self.stages.append(stage)
+
+    @contextmanager
+    def stage(self, name: str, points: int = None):
+        """以上下文管理器的形式记录一个阶段"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, points)
+
+    def report(self, **extra) -> dict:
+        """生成报告字典"""
+        return {
+            **extra,
+            "total_seconds": time.perf_counter() - self.start,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": self.stages,
+        }
+
+    def save(self, filepath: str, **extra):
+        """将报告保存为 JSON"""
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(self.report(**extra), f, indent=2, ensure_ascii=False)
+
+    def print_summary(self):
+        """打印各阶段耗时"""
+        for stage in self.stages:
+            line = f"  {stage['name']:<28} {stage['seconds'] * 1000:>10.1f} ms"
+            if stage.get("points_per_sec"):
+                line += (
+                    f"  {stage['points']:>10} 点"
+                    f"  {stage['points_per_sec'] / 1e6:>8.2f} M点/s"
+                )
+            print(line)
+        print(f"  峰值内存: {peak_rss_mb():.1f} MB")
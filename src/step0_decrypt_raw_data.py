@@ -4,15 +4,158 @@ Step 0: 解密原始数据
 从 input/raw.json 解密数据到 input/data.json
 """
 
+import io
+import os
+import re
+import sys
+import time
+import gzip
 import json
+import lzma
+import heapq
 import base64
+import argparse
 import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
 
+from artifact_cache import make_cache_key
+from decrypt_cache import DecryptCache, ciphertext_key
+from frame_store import FrameStoreWriter, frame_columns
 
-def decrypt_sim_world(encrypted_data: str) -> dict:
+
+# 密钥口令
+PASSPHRASE = "明月几时有"
+
+
+@lru_cache(maxsize=None)
+def derive_key(passphrase: str = PASSPHRASE) -> bytes:
+    """由口令生成 AES 密钥 SHA256(passphrase)（每个进程只计算一次）"""
+    return hashlib.sha256(passphrase.encode("utf-8")).digest()
+
+
+# 标定（匹配）只需要的障碍物字段
+CALIBRATION_FIELDS = (
+    "id",
+    "type",
+    "positionX",
+    "positionY",
+    "heading",
+    "length",
+    "width",
+    "height",
+)
+
+# 投影时保留的 world 顶层字段
+WORLD_HEADER_FIELDS = ("timestamp", "sequenceNum")
+
+# 障碍物中体积最大的数组字段（占明文的大部分，元素中不含数组），
+# 投影时不需要的话在解析前替换为 null
+SKIPPABLE_ARRAY_FIELDS = ("polygonPoint",)
+_SKIPPABLE_ARRAY_PATTERNS = {
+    name: re.compile(rf'"{name}":\[[^\[\]]*\]') for name in SKIPPABLE_ARRAY_FIELDS
+}
+
+
+def project_world(text: str, object_fields: Sequence[str]) -> dict:
+    """
+    只解析 world 中障碍物的指定字段
+
+    解析前先用正则把不需要的 polygonPoint 等数组字段替换为 null，
+    json.loads 不会为这些点构建 Python 对象；解析后每个障碍物只保留 object_fields
+
+    Args:
+        text: 解密后的 world JSON 文本
+        object_fields: 需要保留的障碍物字段
+
+    Returns:
+        只包含 timestamp、sequenceNum 和投影后 object 列表的 world
+    """
+    for name, pattern in _SKIPPABLE_ARRAY_PATTERNS.items():
+        if name not in object_fields:
+            text = pattern.sub(f'"{name}":null', text)
+    world = json.loads(text)
+    projected = {key: world[key] for key in WORLD_HEADER_FIELDS if key in world}
+    projected["object"] = [
+        {field: obj[field] for field in object_fields if field in obj}
+        for obj in world.get("object", [])
+    ]
+    return projected
+
+
+# 解密缓存格式版本（缓存内容的格式变化时递增）
+DECRYPT_CACHE_VERSION = 2
+
+
+def open_decrypt_cache(
+    cache_dir: str,
+    object_fields: Optional[Sequence[str]] = None,
+    max_bytes: int = 2 << 30,
+) -> DecryptCache:
+    """
+    打开解密缓存，命名空间由密钥、字段投影和缓存格式版本决定
+
+    Args:
+        cache_dir: 缓存目录
+        object_fields: 只解析障碍物的这些字段（可选，缓存投影后的 world）
+        max_bytes: 缓存容量上限（字节）
+
+    Returns:
+        DecryptCache
+    """
+    fields = list(object_fields) if object_fields is not None else None
+    namespace = make_cache_key(
+        "sim_world",
+        DECRYPT_CACHE_VERSION,
+        hashlib.sha256(derive_key()).hexdigest(),
+        fields,
+    )[:16]
+    return DecryptCache(cache_dir, namespace, max_bytes)
+
+
+def dump_world(world: dict) -> str:
+    """把 world 序列化为紧凑 JSON（缓存内容，也用于拼接 JSONL 行）"""
+    return json.dumps(world, ensure_ascii=False, separators=(",", ":"))
+
+
+# 拼接 JSONL 行时 world 的占位符（私用区字符，不会出现在录制数据中）
+_WORLD_PLACEHOLDER = json.dumps("\ue000world\ue000", ensure_ascii=False)
+
+
+def serialize_record(record: dict, world_text: Optional[str] = None) -> str:
+    """
+    把记录序列化为一行紧凑 JSON
+
+    Args:
+        record: 记录
+        world_text: 已序列化的 world（可选），直接嵌入，不再重新编码
+
+    Returns:
+        JSON 行（与直接序列化解密后的记录逐字节相同）
+    """
+    if world_text is None:
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    envelope = json.dumps(
+        {**record, "world": json.loads(_WORLD_PLACEHOLDER)},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    head, _, tail = envelope.partition(_WORLD_PLACEHOLDER)
+    return head + world_text + tail
+
+
+def decrypt_sim_world(
+    encrypted_data: str,
+    object_fields: Optional[Sequence[str]] = None,
+    cache: Optional[DecryptCache] = None,
+) -> dict:
     """
     解密 SimWorldUpdate 数据
 
@@ -24,6 +167,10 @@ def decrypt_sim_world(encrypted_data: str) -> dict:
 
     Args:
         encrypted_data: Base64 编码的加密数据
+        object_fields: 只解析障碍物的这些字段（可选，见 project_world），
+            如 CALIBRATION_FIELDS
+        cache: 解密缓存（可选，命名空间须与 object_fields 一致）；
+            命中时跳过解密和投影，只解析缓存的紧凑 JSON
 
     Returns:
         解密后的 JSON 对象
@@ -31,6 +178,11 @@ def decrypt_sim_world(encrypted_data: str) -> dict:
     if not encrypted_data:
         return {}
 
+    if cache is not None:
+        cached = cache.get(ciphertext_key(encrypted_data))
+        if cached is not None:
+            return json.loads(cached)
+
     # Step 1: Base64 解码
     encrypted_bytes = base64.b64decode(encrypted_data)
 
@@ -41,8 +193,7 @@ def decrypt_sim_world(encrypted_data: str) -> dict:
     ciphertext = encrypted_bytes[16:]
 
     # Step 4: 生成密钥 (SHA256("明月几时有"))
-    passphrase = "明月几时有"
-    key = hashlib.sha256(passphrase.encode("utf-8")).digest()
+    key = derive_key()
 
     # Step 5: AES-CBC 解密
     cipher = AES.new(key, AES.MODE_CBC, iv)
@@ -53,110 +204,771 @@ def decrypt_sim_world(encrypted_data: str) -> dict:
 
     # Step 7: 解析 JSON
     decrypted_str = unpadded_bytes.decode("utf-8")
-    return json.loads(decrypted_str)
+    if object_fields is not None:
+        world = project_world(decrypted_str, object_fields)
+    else:
+        world = json.loads(decrypted_str)
 
+    if cache is not None:
+        cache.put(ciphertext_key(encrypted_data), dump_world(world).encode("utf-8"))
+    return world
 
-def main():
-    """主函数"""
-    print("""
-╔═══════════════════════════════════════════════════════════════════╗
-║              Step 0: 解密原始数据 (Decrypt Raw Data)              ║
-╚═══════════════════════════════════════════════════════════════════╝
-    """)
 
-    # 输入输出文件路径
-    input_file = Path("input/raw.json")
-    output_file = Path("input/data.json")
+# 流式读取时每次读取的字符数
+READ_CHUNK_SIZE = 1 << 20
 
-    # 检查输入文件是否存在
-    if not input_file.exists():
-        print(f"❌ 错误: 输入文件不存在: {input_file}")
-        print("\n请确保 input/raw.json 文件存在")
-        return 1
+# 压缩格式的魔数
+GZIP_MAGIC = b"\x1f\x8b"
+XZ_MAGIC = b"\xfd7zXZ\x00"
 
-    print(f"📖 读取加密数据: {input_file}")
+# 进度输出间隔（记录数）
+PROGRESS_INTERVAL = 1000
 
-    # 读取原始数据
-    with open(input_file, "r") as f:
-        content = f.read().strip()
+# 并行解密时每个任务包含的记录数
+DECRYPT_CHUNK_SIZE = 16
 
-    # 尝试解析为 JSON
-    try:
-        raw_data = json.loads(content)
-    except json.JSONDecodeError:
-        # 如果解析失败，尝试逐行解析（JSONL 格式）
-        raw_data = [json.loads(line) for line in content.split("\n") if line.strip()]
 
-    # 确保是列表格式
-    if isinstance(raw_data, dict):
-        raw_data = [raw_data]
+@contextmanager
+def open_raw_input(input_file):
+    """
+    以文本流打开原始数据，按魔数自动识别 gzip / xz 压缩
 
-    print(f"✅ 已读取 {len(raw_data)} 条记录")
+    Args:
+        input_file: 文件路径，"-" 表示标准输入
+    """
+    with ExitStack() as stack:
+        if str(input_file) == "-":
+            raw = sys.stdin.buffer
+        else:
+            raw = stack.enter_context(open(input_file, "rb"))
+        magic = raw.peek(len(XZ_MAGIC))[: len(XZ_MAGIC)]
+        if magic.startswith(GZIP_MAGIC):
+            raw = stack.enter_context(gzip.GzipFile(fileobj=raw, mode="rb"))
+        elif magic == XZ_MAGIC:
+            raw = stack.enter_context(lzma.LZMAFile(raw, mode="rb"))
+        yield io.TextIOWrapper(raw, encoding="utf-8")
+
+
+def iter_raw_records(stream, chunk_size: int = READ_CHUNK_SIZE) -> Iterator:
+    """
+    从文本流中逐条解析记录，内存占用只与单条记录的大小有关
 
-    # 解密数据
-    print("\n🔓 开始解密...")
-    decrypted_data = []
+    支持 JSONL（或连续的 JSON 对象）、顶层 JSON 列表（逐个元素）和单个 JSON 对象
 
-    for i, record in enumerate(raw_data, 1):
-        if isinstance(record, dict) and record.get("type") == "SimWorldUpdate":
-            try:
-                # 解密 world 字段
-                encrypted_world = record.get("world", "")
-                decrypted_world = decrypt_sim_world(encrypted_world)
+    Args:
+        stream: 文本流（open_raw_input 的结果）
+        chunk_size: 每次读取的字符数
 
-                # 更新记录
-                record["world"] = decrypted_world
+    Yields:
+        记录
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    in_array = None
+    while True:
+        # 跳过空白（顶层列表还要跳过元素间的逗号）
+        separators = " \t\r\n," if in_array else " \t\r\n"
+        while True:
+            while pos < len(buffer) and buffer[pos] in separators:
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            buffer, pos = stream.read(chunk_size), 0
+            eof = not buffer
+        if pos >= len(buffer):
+            return
+
+        if in_array is None:
+            in_array = buffer[pos] == "["
+            if in_array:
+                pos += 1
+                continue
+        if in_array and buffer[pos] == "]":
+            return
+
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+            # 标量（数字等）只有在后面跟着分隔符时才能确定已完整
+            complete = (
+                eof
+                or isinstance(record, (dict, list))
+                or (end < len(buffer) and buffer[end] in " \t\r\n,]")
+            )
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            # 记录跨越缓冲区：读入更多数据后重新解析（读取量随缓冲区翻倍）
+            chunk = stream.read(max(chunk_size, len(buffer) - pos))
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        pos = end
+        if pos > chunk_size:
+            buffer, pos = buffer[pos:], 0
+        yield record
+
+
+def is_sim_world_update(record) -> bool:
+    """是否为 SimWorldUpdate 记录"""
+    return isinstance(record, dict) and record.get("type") == "SimWorldUpdate"
+
+
+def extract_first_world(
+    raw_data: Iterable[dict],
+    object_fields: Optional[Sequence[str]] = None,
+    cache: Optional[DecryptCache] = None,
+) -> Optional[dict]:
+    """
+    解密第一条有效的 SimWorldUpdate 记录的 world（之后的记录不再读取和解密）
 
-                if i % 10 == 0 or i == len(raw_data):
-                    print(f"  进度: {i}/{len(raw_data)}")
+    Args:
+        raw_data: 记录迭代器
+        object_fields: 只解析障碍物的这些字段（可选）
+        cache: 解密缓存（可选）
 
+    Returns:
+        解密后的 world，没有有效记录时返回 None
+    """
+    for i, record in enumerate(raw_data, 1):
+        if is_sim_world_update(record):
+            try:
+                world = decrypt_sim_world(
+                    record.get("world", ""), object_fields, cache
+                )
             except Exception as e:
                 print(f"⚠️  警告: 第 {i} 条记录解密失败: {e}")
-                import traceback
+                continue
+            if world:
+                return world
+    return None
+
+
+def write_world_in_background(world: dict, output_file) -> threading.Thread:
+    """
+    在后台线程中把 world 写出为紧凑 JSON（不阻塞后续的匹配计算）
+
+    Returns:
+        写出线程，调用方退出前需要 join
+    """
+
+    def write():
+        output_path = Path(output_file)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(world, f, ensure_ascii=False, separators=(",", ":"))
+
+    thread = threading.Thread(target=write, name="write-data-json")
+    thread.start()
+    return thread
+
+
+def _decrypt_chunk(
+    chunk: List[Tuple[int, dict]],
+    serialize: bool = False,
+    columns: bool = False,
+    object_fields: Optional[Sequence[str]] = None,
+    world_text: bool = False,
+) -> List[tuple]:
+    """
+    解密一组记录（并行模式下在 worker 进程中执行）
+
+    Args:
+        chunk: [(记录序号, 记录)]
+        serialize: 是否把结果序列化为一行紧凑 JSON（避免把解析后的大字典传回主进程）
+        columns: 是否同时提取帧存储的障碍物列（frame_store.frame_columns）
+        object_fields: 只解析障碍物的这些字段（可选）
+        world_text: 是否同时返回序列化后的 world（写入解密缓存）
+
+    Returns:
+        [(记录序号, 是否为 SimWorldUpdate, 解密后的记录或 JSON 行, 错误信息, 障碍物列,
+          序列化后的 world)]
+    """
+    results = []
+    for index, record in chunk:
+        is_world = is_sim_world_update(record)
+        frame = None
+        text = None
+        try:
+            if is_world:
+                record["world"] = decrypt_sim_world(
+                    record.get("world", ""), object_fields
+                )
+            # 缺少字段等格式错误与解密失败一样按记录报告
+            if columns and is_world and record["world"]:
+                frame = frame_columns(record["world"], record.get("timestamp"))
+        except Exception as e:
+            results.append((index, is_world, None, str(e), None, None))
+            continue
+        if world_text and is_world and record["world"]:
+            text = dump_world(record["world"])
+        if serialize:
+            record = serialize_record(record, text)
+        results.append((index, is_world, record, None, frame, text))
+    return results
+
+
+def _cached_result(
+    index: int, record: dict, data: bytes, serialize: bool, columns: bool
+) -> tuple:
+    """
+    由解密缓存的内容构建 _decrypt_chunk 格式的结果
+
+    只需要 JSON 行时直接把缓存的 world 嵌入记录，不解析 JSON
+    """
+    text = data.decode("utf-8")
+    frame = None
+    try:
+        payload = serialize_record(record, text) if serialize else record
+        if columns or not serialize:
+            world = json.loads(text)
+            if columns and world:
+                frame = frame_columns(world, record.get("timestamp"))
+            if not serialize:
+                record["world"] = world
+    except Exception as e:
+        return (index, True, None, str(e), None, None)
+    return (index, True, payload, None, frame, None)
+
+
+def _ordered_map(executor, fn, tasks, window: int):
+    """按输入顺序返回结果，同时最多只有 window 个任务在进程池中排队"""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _iter_chunks(items: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_decrypted(
+    records: Iterable[Tuple[int, dict]],
+    jobs: int = 1,
+    serialize: bool = False,
+    columns: bool = False,
+    object_fields: Optional[Sequence[str]] = None,
+    chunk_size: int = DECRYPT_CHUNK_SIZE,
+    executor: Optional[ProcessPoolExecutor] = None,
+    cache: Optional[DecryptCache] = None,
+) -> Iterator[tuple]:
+    """
+    按输入顺序逐条解密记录
 
-                traceback.print_exc()
+    jobs > 1 时把记录按 chunk_size 分组交给进程池，每个 worker 进程只生成一次密钥；
+    同时在进程池中排队的分组数有上限，内存占用与记录总数无关。
+    使用解密缓存时，主进程先按密文查找缓存，只把未命中的记录交给 worker，
+    worker 返回的结果写入缓存
+
+    Args:
+        records: [(记录序号, 记录)] 迭代器
+        jobs: 并行进程数
+        serialize: 是否返回序列化后的 JSON 行（见 _decrypt_chunk）
+        columns: 是否同时返回帧存储的障碍物列
+        object_fields: 只解析障碍物的这些字段（可选）
+        chunk_size: 每组的记录数
+        executor: 复用已有的进程池（可选，跟随模式下每批新记录共用同一个进程池）
+        cache: 解密缓存（可选，命名空间须与 object_fields 一致）
+
+    Yields:
+        (记录序号, 是否为 SimWorldUpdate, 解密后的记录或 JSON 行, 错误信息, 障碍物列)
+    """
+    decrypt_chunk = partial(
+        _decrypt_chunk,
+        serialize=serialize,
+        columns=columns,
+        object_fields=object_fields,
+        world_text=cache is not None,
+    )
+    # 每组中命中缓存的结果和未命中记录的缓存 key，与交给 worker 的分组一一对应
+    cached_chunks = deque()
+
+    def chunks():
+        for chunk in _iter_chunks(records, chunk_size):
+            if cache is None:
+                yield chunk
                 continue
+            cached, missed, keys = [], [], {}
+            for index, record in chunk:
+                data = key = None
+                if is_sim_world_update(record) and record.get("world"):
+                    key = ciphertext_key(record["world"])
+                    data = cache.get(key)
+                if data is not None:
+                    cached.append(
+                        _cached_result(index, record, data, serialize, columns)
+                    )
+                    continue
+                missed.append((index, record))
+                keys[index] = key
+            cached_chunks.append((cached, keys))
+            yield missed
+
+    def merge(results):
+        if cache is None:
+            return results
+        cached, keys = cached_chunks.popleft()
+        for result in results:
+            if result[5] is not None:
+                cache.put(keys[result[0]], result[5].encode("utf-8"))
+        return heapq.merge(cached, results)
+
+    def run(batches):
+        for results in batches:
+            for result in merge(results):
+                yield result[:5]
+
+    if executor is not None:
+        yield from run(_ordered_map(executor, decrypt_chunk, chunks(), jobs * 4))
+        return
+    if jobs <= 1:
+        yield from run(map(decrypt_chunk, chunks()))
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=derive_key) as executor:
+        yield from run(_ordered_map(executor, decrypt_chunk, chunks(), jobs * 4))
+
+
+def keep_record(record, args) -> bool:
+    """按记录类型和时间戳过滤"""
+    if not isinstance(record, dict):
+        return not args.type
+    if args.type and record.get("type") not in args.type:
+        return False
+    timestamp = record.get("timestamp")
+    if args.start_timestamp is not None and (
+        timestamp is None or timestamp < args.start_timestamp
+    ):
+        return False
+    if args.end_timestamp is not None and (
+        timestamp is None or timestamp > args.end_timestamp
+    ):
+        return False
+    return True
+
+
+def enter_decrypt_cache(stack: ExitStack, args, object_fields):
+    """
+    按命令行参数打开解密缓存（退出 stack 时统一淘汰）
 
-        decrypted_data.append(record)
+    Returns:
+        DecryptCache，未指定 --cache-dir 时返回 None
+    """
+    if not args.cache_dir:
+        return None
+    cache = stack.enter_context(
+        open_decrypt_cache(
+            args.cache_dir, object_fields, int(args.cache_max_mb * 1024 * 1024)
+        )
+    )
+    print(f"🗄️  解密缓存: {args.cache_dir}（{len(cache)} 条）")
+    return cache
 
-    print(f"\n✅ 解密完成: {len(decrypted_data)} 条记录")
 
-    # 提取 world 字段作为最终数据
-    # data.json 应该是 world 的内容，而不是完整的 raw 数据
-    final_data = None
-    for record in decrypted_data:
-        if isinstance(record, dict) and record.get("type") == "SimWorldUpdate":
-            final_data = record.get("world")
-            break
+def print_cache_stats(cache: Optional[DecryptCache]):
+    """打印解密缓存的命中情况"""
+    if cache is not None:
+        print(f"  - 解密缓存: 命中 {cache.hits} 条, 未命中 {cache.misses} 条")
 
-    if not final_data:
-        print("❌ 错误: 未找到有效的 SimWorldUpdate 数据")
-        return 1
 
-    # 保存解密后的数据
-    print(f"\n💾 保存到: {output_file}")
-    output_file.parent.mkdir(parents=True, exist_ok=True)
+# 跟随模式每次最多读取的字节数（不足一行时会继续加倍读取）
+FOLLOW_READ_SIZE = 16 << 20
+
+
+def read_appended_lines(input_file, offset: int) -> Tuple[List[bytes], int]:
+    """
+    读取 offset 之后新追加的完整行
+
+    末尾没有换行符的行可能还在写入，留到下一次读取
+
+    Args:
+        input_file: 未压缩的 JSONL 文件
+        offset: 上次读到的字节偏移
+
+    Returns:
+        (完整行列表, 新的字节偏移)
+    """
+    size = FOLLOW_READ_SIZE
+    with open(input_file, "rb") as f:
+        while True:
+            f.seek(offset)
+            data = f.read(size)
+            end = data.rfind(b"\n")
+            if end >= 0:
+                return data[: end + 1].splitlines(), offset + end + 1
+            if len(data) < size:
+                return [], offset
+            size *= 2
+
+
+def load_checkpoint(checkpoint_file: Path, input_file) -> Tuple[int, int]:
+    """
+    读取跟随模式的检查点
+
+    Returns:
+        (字节偏移, 已读取的记录数)；没有检查点或检查点属于其他输入文件时为 (0, 0)
+    """
+    if not checkpoint_file.exists():
+        return 0, 0
+    with open(checkpoint_file, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("input") != str(Path(input_file).resolve()):
+        print(f"⚠️  警告: 检查点 {checkpoint_file} 属于其他输入文件，从头开始")
+        return 0, 0
+    return checkpoint["offset"], checkpoint["records"]
+
+
+def save_checkpoint(checkpoint_file: Path, input_file, offset: int, records: int):
+    """原子地保存检查点（先写临时文件再替换）"""
+    checkpoint = {
+        "input": str(Path(input_file).resolve()),
+        "offset": offset,
+        "records": records,
+    }
+    tmp_file = checkpoint_file.with_name(checkpoint_file.name + ".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def follow_capture(args, output_file: Path, object_fields) -> int:
+    """
+    跟随模式：持续解密不断追加的 JSONL 录制数据
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(final_data, f, ensure_ascii=False, indent=2)
+    从检查点记录的字节偏移继续读取，每次只解密新追加的完整行并追加写入输出文件，
+    写出后再更新检查点；中断后重新运行会从检查点继续，不会重复读取历史数据
 
-    print(f"✅ 解密完成！数据已保存到 {output_file}")
+    Args:
+        args: 命令行参数
+        output_file: 输出的 JSONL 文件
+        object_fields: 只解析障碍物的这些字段（可选）
+
+    Returns:
+        退出码
+    """
+    input_file = args.input
+    checkpoint_file = Path(args.checkpoint or f"{output_file}.checkpoint")
+    offset, num_records = load_checkpoint(checkpoint_file, input_file)
+    if offset == 0 and output_file.exists():
+        # 没有检查点时从头读取，输出文件也要从头写
+        output_file.unlink()
+
+    print(f"👀 跟随模式: {input_file}（从第 {offset} 字节、第 {num_records} 条记录继续）")
+    print(f"  - 检查点: {checkpoint_file}")
+    print("  - 按 Ctrl+C 停止")
+
+    num_written = 0
+    last_growth = time.monotonic()
+    with ExitStack() as stack:
+        executor = None
+        if args.jobs > 1:
+            executor = stack.enter_context(
+                ProcessPoolExecutor(max_workers=args.jobs, initializer=derive_key)
+            )
+        out = stack.enter_context(open(output_file, "a", encoding="utf-8"))
+        cache = enter_decrypt_cache(stack, args, object_fields)
+        try:
+            while True:
+                if os.path.getsize(input_file) < offset:
+                    print("⚠️  警告: 输入文件变小（被截断或替换），从头开始读取")
+                    offset = num_records = 0
+                    out.seek(0)
+                    out.truncate()
+
+                lines, new_offset = read_appended_lines(input_file, offset)
+                if not lines:
+                    idle = time.monotonic() - last_growth
+                    if args.idle_timeout is not None and idle >= args.idle_timeout:
+                        print(f"\n⏹️  {args.idle_timeout:g} 秒内没有新数据，停止跟随")
+                        break
+                    time.sleep(args.poll_interval)
+                    continue
+                last_growth = time.monotonic()
+
+                records = []
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    num_records += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        print(f"⚠️  警告: 第 {num_records} 条记录不是有效的 JSON: {e}")
+                        continue
+                    if keep_record(record, args):
+                        records.append((num_records, record))
+
+                batch_written = 0
+                for i, _, payload, error, _ in iter_decrypted(
+                    records,
+                    jobs=args.jobs,
+                    serialize=True,
+                    object_fields=object_fields,
+                    executor=executor,
+                    cache=cache,
+                ):
+                    if error is not None:
+                        print(f"⚠️  警告: 第 {i} 条记录解密失败: {error}")
+                        continue
+                    out.write(payload)
+                    out.write("\n")
+                    batch_written += 1
+                out.flush()
+                if cache is not None:
+                    cache.flush()
+
+                # 输出写完之后再推进检查点，中断时最多重复写出最后一批
+                offset = new_offset
+                save_checkpoint(checkpoint_file, input_file, offset, num_records)
+                num_written += batch_written
+                print(
+                    f"  +{batch_written} 条记录（共读取 {num_records} 条，"
+                    f"偏移 {offset} 字节）"
+                )
+        except KeyboardInterrupt:
+            print("\n⏹️  停止跟随")
+
+    print(f"\n✅ 本次写出 {num_written} 条记录到 {output_file}")
+    print(f"✅ 检查点: 第 {offset} 字节（{num_records} 条记录）")
+    print_cache_stats(cache)
+    return 0
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="解密原始数据")
+    parser.add_argument(
+        "--input",
+        "-i",
+        default="input/raw.json",
+        help="加密的原始数据（JSON / JSONL，支持 gzip、xz 压缩；- 表示标准输入，"
+        "默认: input/raw.json）",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default=None,
+        help="输出文件（默认: input/data.json，--jsonl 时为 input/frames.jsonl）",
+    )
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="逐条写出所有解密后的记录（JSONL），而不是只保存第一条 SimWorldUpdate 的 world",
+    )
+    parser.add_argument(
+        "--type",
+        action="append",
+        default=None,
+        help="只保留指定类型的记录（可重复，如 --type SimWorldUpdate）",
+    )
+    parser.add_argument(
+        "--start-timestamp", type=float, default=None, help="只保留不早于该时间戳的记录"
+    )
+    parser.add_argument(
+        "--end-timestamp", type=float, default=None, help="只保留不晚于该时间戳的记录"
+    )
+    parser.add_argument(
+        "--fields",
+        default=None,
+        help="只保留障碍物的这些字段（逗号分隔，如 "
+        + ",".join(CALIBRATION_FIELDS)
+        + "），跳过 polygonPoint 等字段的解析",
+    )
+    parser.add_argument(
+        "--frame-store",
+        default=None,
+        help="同时把每一帧的障碍物按列写入帧存储目录（时间戳索引，内存映射加载）",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="并行解密的进程数（默认: 1，即串行；大体积录制数据建议设为 CPU 核数）",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="解密缓存目录（按每条记录的密文缓存解密结果，已解密过的记录跳过解密）",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=2048,
+        help="解密缓存容量上限（MB，默认: 2048）",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="跟随模式：持续读取不断追加的 JSONL 录制数据，只解密新记录并追加写入"
+        "（隐含 --jsonl，输入须为未压缩文件）",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="跟随模式的检查点文件（默认: <输出文件>.checkpoint）",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="跟随模式下没有新数据时的等待间隔（秒，默认: 1.0）",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        help="跟随模式下超过该秒数没有新数据时退出（默认: 一直等待）",
+    )
+    args = parser.parse_args()
+    if args.follow:
+        args.jsonl = True
+
+    print("""
+╔═══════════════════════════════════════════════════════════════════╗
+║              Step 0: 解密原始数据 (Decrypt Raw Data)              ║
+╚═══════════════════════════════════════════════════════════════════╝
+    """)
+
+    # 输入输出文件路径
+    input_file = args.input
+    default_output = "input/frames.jsonl" if args.jsonl else "input/data.json"
+    output_file = Path(args.output or default_output)
+
+    # 检查输入文件是否存在
+    if input_file != "-" and not Path(input_file).exists():
+        print(f"❌ 错误: 输入文件不存在: {input_file}")
+        print(f"\n请确保 {input_file} 文件存在")
+        return 1
+
+    if args.follow:
+        if input_file == "-":
+            print("❌ 错误: 跟随模式不支持标准输入")
+            return 1
+        if args.frame_store:
+            print("❌ 错误: 跟随模式不支持 --frame-store")
+            return 1
+        with open(input_file, "rb") as f:
+            magic = f.read(len(XZ_MAGIC))
+        if magic.startswith(GZIP_MAGIC) or magic.startswith(XZ_MAGIC):
+            print("❌ 错误: 跟随模式的输入须为未压缩的 JSONL 文件")
+            return 1
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        object_fields = None
+        if args.fields:
+            object_fields = [field for field in args.fields.split(",") if field]
+        return follow_capture(args, output_file, object_fields)
+
+    print(f"📖 读取加密数据: {'标准输入' if input_file == '-' else input_file}")
+
+    # 逐条读取、解密并写出，内存占用与记录数无关
+    print("\n🔓 开始解密...")
+    num_records = num_filtered = num_worlds = num_written = 0
+    final_data = None
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with ExitStack() as stack:
+        stream = stack.enter_context(open_raw_input(input_file))
+        out = None
+        if args.jsonl:
+            out = stack.enter_context(open(output_file, "w", encoding="utf-8"))
+        # 字段投影：帧存储需要的字段总是保留
+        object_fields = None
+        if args.fields:
+            object_fields = [field for field in args.fields.split(",") if field]
+            if args.frame_store:
+                object_fields += [
+                    f for f in CALIBRATION_FIELDS if f not in object_fields
+                ]
+        store = None
+        if args.frame_store:
+            store = stack.enter_context(FrameStoreWriter(args.frame_store))
+        cache = enter_decrypt_cache(stack, args, object_fields)
+
+        def selected_records():
+            nonlocal num_records, num_filtered
+            for i, record in enumerate(iter_raw_records(stream), 1):
+                num_records = i
+                if i % PROGRESS_INTERVAL == 0:
+                    print(f"  进度: {i} 条记录")
+                if keep_record(record, args):
+                    yield i, record
+                else:
+                    num_filtered += 1
+
+        # --jsonl 时直接取回序列化后的行，主进程只负责按顺序写出
+        for i, is_world, payload, error, frame in iter_decrypted(
+            selected_records(),
+            jobs=args.jobs,
+            serialize=args.jsonl,
+            columns=store is not None,
+            object_fields=object_fields,
+            cache=cache,
+        ):
+            if error is not None:
+                print(f"⚠️  警告: 第 {i} 条记录解密失败: {error}")
+                continue
+            if is_world:
+                num_worlds += 1
+                # data.json 应该是 world 的内容，而不是完整的 raw 数据
+                if final_data is None and not args.jsonl and payload["world"]:
+                    final_data = payload["world"]
+
+            if frame is not None:
+                store.append(frame)
+            if out is not None:
+                out.write(payload)
+                out.write("\n")
+                num_written += 1
+
+    print(f"\n✅ 解密完成: 读取 {num_records} 条记录")
+
+    if store is not None:
+        print(
+            f"✅ 帧存储: {args.frame_store}（{len(store.frame_start)} 帧, "
+            f"{store.rows} 行障碍物）"
+        )
+    if args.jsonl:
+        print(f"✅ 已逐条写出 {num_written} 条记录到 {output_file}")
+    else:
+        if not final_data:
+            print("❌ 错误: 未找到有效的 SimWorldUpdate 数据")
+            return 1
+
+        # 保存解密后的数据
+        print(f"\n💾 保存到: {output_file}")
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(final_data, f, ensure_ascii=False, indent=2)
+
+        print(f"✅ 解密完成！数据已保存到 {output_file}")
 
     # 显示统计信息
     print("\n📊 统计信息:")
-    print(f"  - 输入记录: {len(raw_data)}")
-    print(
-        f"  - SimWorldUpdate 记录: {sum(1 for r in decrypted_data if isinstance(r, dict) and r.get('type') == 'SimWorldUpdate')}"
-    )
-    if isinstance(final_data, dict):
+    print(f"  - 输入记录: {num_records}")
+    if num_filtered:
+        print(f"  - 过滤的记录: {num_filtered}")
+    print(f"  - SimWorldUpdate 记录: {num_worlds}")
+    if isinstance(final_data, dict) and not args.jsonl:
         print(f"  - 提取的障碍物数量: {len(final_data.get('object', []))}")
+    print_cache_stats(cache)
 
     return 0
 
 
 if __name__ == "__main__":
-    import sys
-
     try:
         sys.exit(main())
     except KeyboardInterrupt:
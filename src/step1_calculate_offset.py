@@ -5,10 +5,13 @@ ID不可信，只使用坐标和尺寸信息
 """
 
 import json
+import argparse
 import numpy as np
 from scipy.optimize import linear_sum_assignment
 from typing import List, Tuple
 from dataclasses import dataclass
+from pathlib import Path
+from contextlib import ExitStack
 
 
 @dataclass
@@ -24,6 +27,74 @@ class Obstacle:
     height: float
 
 
+# 尺寸字段（与 ObstacleArrays.dims 的列顺序一致）
+DIMENSION_KEYS = ("length", "width", "height")
+
+
+@dataclass
+class ObstacleArrays:
+    """
+    障碍物的列式数组表示（匹配时按列向量化计算）
+
+    Attributes:
+        ids: 每个障碍物的 ID
+        xy: (N, 2) 位置
+        heading: (N,) 朝向
+        dims: (N, 3) 长、宽、高
+        dimensions: 每个障碍物的原始尺寸 (length, width, height)，输出时保持原始数值类型
+    """
+
+    ids: List[str]
+    xy: np.ndarray
+    heading: np.ndarray
+    dims: np.ndarray
+    dimensions: List[tuple]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, ids: List[str], rows: List[tuple]) -> "ObstacleArrays":
+        """由 (x, y, heading, length, width, height) 行构建"""
+        table = np.array(rows, dtype=np.float64).reshape(-1, 6)
+        return cls(
+            ids=ids,
+            xy=table[:, 0:2],
+            heading=table[:, 2],
+            dims=table[:, 3:6],
+            dimensions=[row[3:6] for row in rows],
+        )
+
+    @classmethod
+    def from_obstacles(cls, obstacles: List[Obstacle]) -> "ObstacleArrays":
+        """由 Obstacle 列表构建"""
+        return cls.from_rows(
+            [obs.id for obs in obstacles],
+            [
+                (obs.x, obs.y, obs.heading, obs.length, obs.width, obs.height)
+                for obs in obstacles
+            ],
+        )
+
+    @classmethod
+    def from_objects(cls, objects: List[dict]) -> "ObstacleArrays":
+        """直接由 data.json 格式的障碍物列表（如解密后的 world["object"]）构建"""
+        return cls.from_rows(
+            [str(obj["id"]) for obj in objects],
+            [
+                (
+                    obj["positionX"],
+                    obj["positionY"],
+                    obj["heading"],
+                    obj["length"],
+                    obj["width"],
+                    obj["height"],
+                )
+                for obj in objects
+            ],
+        )
+
+
 def load_scenarios_obstacles(filepath: str) -> List[Obstacle]:
     """从scenarios.json提取障碍物"""
     with open(filepath, "r", encoding="utf-8") as f:
@@ -68,6 +139,12 @@ def load_scenarios_obstacles(filepath: str) -> List[Obstacle]:
     return obstacles
 
 
+def load_json_objects(filepath: str) -> List[dict]:
+    """读取data.json中的障碍物列表"""
+    with open(filepath, "r", encoding="utf-8") as f:
+        return json.load(f).get("object", [])
+
+
 def load_data_obstacles(filepath: str) -> List[Obstacle]:
     """从data.json提取障碍物"""
     with open(filepath, "r", encoding="utf-8") as f:
@@ -91,22 +168,22 @@ def load_data_obstacles(filepath: str) -> List[Obstacle]:
 
 
 def estimate_initial_transform(
-    src_obs: List[Obstacle], dst_obs: List[Obstacle]
+    src_obs: ObstacleArrays, dst_obs: ObstacleArrays
 ) -> Tuple[float, float]:
     """
     估计初始平移偏移（假设没有旋转或旋转很小）
     使用中心点的偏移作为初始估计
     """
-    src_center = np.array([[obs.x, obs.y] for obs in src_obs]).mean(axis=0)
-    dst_center = np.array([[obs.x, obs.y] for obs in dst_obs]).mean(axis=0)
+    src_center = src_obs.xy.mean(axis=0)
+    dst_center = dst_obs.xy.mean(axis=0)
 
     offset = dst_center - src_center
     return offset[0], offset[1]
 
 
 def match_obstacles_hungarian(
-    src_obs: List[Obstacle],
-    dst_obs: List[Obstacle],
+    src_obs: ObstacleArrays,
+    dst_obs: ObstacleArrays,
     initial_offset: Tuple[float, float] = None,
     max_distance: float = 50.0,
     dimension_weight: float = 100.0,
@@ -124,9 +201,6 @@ def match_obstacles_hungarian(
     返回:
         匹配列表 [(src_idx, dst_idx, cost), ...]
     """
-    n_src = len(src_obs)
-    n_dst = len(dst_obs)
-
     # 如果没有提供初始偏移，估计一个
     if initial_offset is None:
         initial_offset = estimate_initial_transform(src_obs, dst_obs)
@@ -134,36 +208,27 @@ def match_obstacles_hungarian(
     dx_init, dy_init = initial_offset
     print(f"初始偏移估计: dx={dx_init:.2f}, dy={dy_init:.2f}")
 
-    # 构建成本矩阵
+    # 构建成本矩阵（按列广播，一次计算所有障碍物对）
     # 成本 = 坐标距离 + 尺寸差异
-    cost_matrix = np.zeros((n_src, n_dst))
-
-    for i, src in enumerate(src_obs):
-        # 应用初始偏移
-        src_x_adjusted = src.x + dx_init
-        src_y_adjusted = src.y + dy_init
-
-        for j, dst in enumerate(dst_obs):
-            # 坐标距离
-            pos_dist = np.sqrt(
-                (src_x_adjusted - dst.x) ** 2 + (src_y_adjusted - dst.y) ** 2
-            )
-
-            # 尺寸差异（L1距离）
-            dim_diff = (
-                abs(src.length - dst.length)
-                + abs(src.width - dst.width)
-                + abs(src.height - dst.height)
-            )
+    # 应用初始偏移
+    src_x_adjusted = src_obs.xy[:, 0] + dx_init
+    src_y_adjusted = src_obs.xy[:, 1] + dy_init
+
+    # 坐标距离
+    pos_dist = np.sqrt(
+        (src_x_adjusted[:, None] - dst_obs.xy[None, :, 0]) ** 2
+        + (src_y_adjusted[:, None] - dst_obs.xy[None, :, 1]) ** 2
+    )
 
-            # 总成本
-            cost = pos_dist + dimension_weight * dim_diff
+    # 尺寸差异（L1距离）
+    dim_abs = np.abs(src_obs.dims[:, None, :] - dst_obs.dims[None, :, :])
+    dim_diff = dim_abs[:, :, 0] + dim_abs[:, :, 1] + dim_abs[:, :, 2]
 
-            # 如果距离太远，设为无穷大（不匹配）
-            if pos_dist > max_distance:
-                cost = 1e10
+    # 总成本
+    cost_matrix = pos_dist + dimension_weight * dim_diff
 
-            cost_matrix[i, j] = cost
+    # 如果距离太远，设为无穷大（不匹配）
+    cost_matrix[pos_dist > max_distance] = 1e10
 
     # 使用匈牙利算法求解最优匹配
     print("运行匈牙利算法...")
@@ -181,8 +246,8 @@ def match_obstacles_hungarian(
 
 
 def calculate_transform_from_matches(
-    src_obs: List[Obstacle],
-    dst_obs: List[Obstacle],
+    src_obs: ObstacleArrays,
+    dst_obs: ObstacleArrays,
     matches: List[Tuple[int, int, float]],
 ) -> dict:
     """从匹配计算变换参数"""
@@ -190,8 +255,8 @@ def calculate_transform_from_matches(
         return None
 
     # 提取匹配点对
-    src_points = np.array([[src_obs[m[0]].x, src_obs[m[0]].y] for m in matches])
-    dst_points = np.array([[dst_obs[m[1]].x, dst_obs[m[1]].y] for m in matches])
+    src_points = src_obs.xy[[m[0] for m in matches]]
+    dst_points = dst_obs.xy[[m[1] for m in matches]]
 
     # 计算中心点
     src_center = src_points.mean(axis=0)
@@ -236,10 +301,80 @@ def calculate_transform_from_matches(
     }
 
 
+def load_raw_obstacles(raw_file: str, data_file: str = None, cache_dir: str = None):
+    """
+    在进程内解密 raw.json，解密后的 world 直接转换为列式数组（不经过 data.json）；
+    不写出 data.json 时只解析匹配需要的障碍物字段
+
+    Args:
+        raw_file: 加密的原始数据文件
+        data_file: 同时写出的 data.json（可选，紧凑格式，在后台线程中写出）
+        cache_dir: 解密缓存目录（可选，按密文缓存，重复运行时跳过解密）
+
+    Returns:
+        (ObstacleArrays, 后台写出线程或 None)
+    """
+    from step0_decrypt_raw_data import (
+        CALIBRATION_FIELDS,
+        extract_first_world,
+        iter_raw_records,
+        open_decrypt_cache,
+        open_raw_input,
+        write_world_in_background,
+    )
+
+    # 不写出 data.json 时只解析匹配需要的字段
+    object_fields = None if data_file else CALIBRATION_FIELDS
+    with ExitStack() as stack:
+        cache = None
+        if cache_dir:
+            cache = stack.enter_context(open_decrypt_cache(cache_dir, object_fields))
+        stream = stack.enter_context(open_raw_input(raw_file))
+        world = extract_first_world(iter_raw_records(stream), object_fields, cache)
+    if not world:
+        raise ValueError(f"未找到有效的 SimWorldUpdate 数据: {raw_file}")
+
+    writer = None
+    if data_file:
+        writer = write_world_in_background(world, data_file)
+    return ObstacleArrays.from_objects(world.get("object", [])), writer
+
+
 def main():
     """主函数"""
-    scenarios_file = "input/scenarios.json"
-    data_file = "input/data.json"
+    parser = argparse.ArgumentParser(description="使用匈牙利算法基于坐标匹配障碍物")
+    parser.add_argument(
+        "--scenarios",
+        default="input/scenarios.json",
+        help="场景文件（默认: input/scenarios.json）",
+    )
+    parser.add_argument(
+        "--data",
+        default="input/data.json",
+        help="障碍物数据文件（默认: input/data.json）",
+    )
+    parser.add_argument(
+        "--raw",
+        default=None,
+        help="直接解密加密的原始数据（如 input/raw.json）用于匹配，不读取 --data",
+    )
+    parser.add_argument(
+        "--write-data",
+        default=None,
+        help="与 --raw 一起使用：在后台线程中把解密后的数据写出为紧凑 JSON（如 input/data.json）",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="与 --raw 一起使用：解密缓存目录（按密文缓存，raw.json 不变时跳过解密）",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default="results/offset_results.json",
+        help="结果文件（默认: results/offset_results.json）",
+    )
+    args = parser.parse_args()
 
     print("=" * 70)
     print("使用匈牙利算法匹配障碍物（基于坐标，ID不可信）")
@@ -247,11 +382,21 @@ def main():
 
     # 加载数据
     print("\n1. 加载障碍物...")
-    scenarios_obs = load_scenarios_obstacles(scenarios_file)
-    data_obs = load_data_obstacles(data_file)
+    scenarios_obs = ObstacleArrays.from_obstacles(
+        load_scenarios_obstacles(args.scenarios)
+    )
+    writer = None
+    if args.raw:
+        data_obs, writer = load_raw_obstacles(
+            args.raw, args.write_data, args.cache_dir
+        )
+        data_label = f"{Path(args.raw).name}（解密）"
+    else:
+        data_obs = ObstacleArrays.from_objects(load_json_objects(args.data))
+        data_label = Path(args.data).name
 
     print(f"   scenarios.json: {len(scenarios_obs)} 个障碍物")
-    print(f"   data.json: {len(data_obs)} 个障碍物")
+    print(f"   {data_label}: {len(data_obs)} 个障碍物")
 
     # 估计初始偏移
     print("\n2. 估计初始偏移...")
@@ -269,6 +414,8 @@ def main():
 
     if not matches:
         print("错误: 没有找到任何匹配！")
+        if writer is not None:
+            writer.join()
         return
 
     # 计算变换
@@ -314,13 +461,13 @@ def main():
     )
     print("-" * 110)
     for i, (src_idx, dst_idx, cost) in enumerate(matches[:20]):
-        src = scenarios_obs[src_idx]
-        dst = data_obs[dst_idx]
+        src_x, src_y = scenarios_obs.xy[src_idx]
+        dst_x, dst_y = data_obs.xy[dst_idx]
         error = result["errors"][i]
-        src_pos = f"({src.x:.2f}, {src.y:.2f})"
-        dst_pos = f"({dst.x:.2f}, {dst.y:.2f})"
+        src_pos = f"({src_x:.2f}, {src_y:.2f})"
+        dst_pos = f"({dst_x:.2f}, {dst_y:.2f})"
         print(
-            f"{i + 1:<4} {src.id:<10} {dst.id:<10} {cost:<10.4f} {error:<10.4f} {src_pos:<25} {dst_pos:<25}"
+            f"{i + 1:<4} {scenarios_obs.ids[src_idx]:<10} {data_obs.ids[dst_idx]:<10} {cost:<10.4f} {error:<10.4f} {src_pos:<25} {dst_pos:<25}"
         )
 
     # 保存结果
@@ -352,29 +499,23 @@ def main():
             {
                 "src_index": int(src_idx),
                 "dst_index": int(dst_idx),
-                "src_id": scenarios_obs[src_idx].id,
-                "dst_id": data_obs[dst_idx].id,
+                "src_id": scenarios_obs.ids[src_idx],
+                "dst_id": data_obs.ids[dst_idx],
                 "src_pos": {
-                    "x": float(scenarios_obs[src_idx].x),
-                    "y": float(scenarios_obs[src_idx].y),
+                    "x": float(scenarios_obs.xy[src_idx, 0]),
+                    "y": float(scenarios_obs.xy[src_idx, 1]),
                 },
                 "dst_pos": {
-                    "x": float(data_obs[dst_idx].x),
-                    "y": float(data_obs[dst_idx].y),
+                    "x": float(data_obs.xy[dst_idx, 0]),
+                    "y": float(data_obs.xy[dst_idx, 1]),
                 },
                 "matching_cost": float(cost),
                 "transform_error": float(result["errors"][i]),
                 "dimensions": {
-                    "src": {
-                        "length": scenarios_obs[src_idx].length,
-                        "width": scenarios_obs[src_idx].width,
-                        "height": scenarios_obs[src_idx].height,
-                    },
-                    "dst": {
-                        "length": data_obs[dst_idx].length,
-                        "width": data_obs[dst_idx].width,
-                        "height": data_obs[dst_idx].height,
-                    },
+                    "src": dict(
+                        zip(DIMENSION_KEYS, scenarios_obs.dimensions[src_idx])
+                    ),
+                    "dst": dict(zip(DIMENSION_KEYS, data_obs.dimensions[dst_idx])),
                 },
             }
             for i, (src_idx, dst_idx, cost) in enumerate(matches)
@@ -385,11 +526,14 @@ def main():
         },
     }
 
-    output_file = "results/offset_results.json"
+    output_file = args.output
     with open(output_file, "w", encoding="utf-8") as f:
         json.dump(output, f, indent=2, ensure_ascii=False)
 
     print(f"\n结果已保存到 {output_file}")
+    if writer is not None:
+        writer.join()
+        print(f"解密数据已保存到 {args.write_data}")
     print("=" * 70)
 
 
@@ -4,11 +4,29 @@
 根据之前计算的偏移量，平移地图中的所有坐标点
 """
 
+import os
 import json
+import time
+import cProfile
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+
 from google.protobuf import text_format
 
+from artifact_cache import ArtifactCache, hash_file, make_cache_key
+from map_crop import crop_map, scenario_region
+from map_geometry import (
+    ELEMENT_TYPES,
+    MapGeometry,
+    compare_geometry,
+    extract_map_geometry,
+)
+from map_spatial_index import build_spatial_index
+from offset_transform import OffsetTransform, load_offset_from_results
+from perf_report import PerfRecorder
+
 # Apollo 10.0 proto 导入
 try:
     from modules.common_msgs.map_msgs.map_pb2 import Map
@@ -21,10 +39,16 @@ except ImportError:
     map_pb2 = None
 
 
-class MapOffsetTransformer:
+class MapOffsetTransformer(OffsetTransform):
     """地图偏移变换器"""
 
-    def __init__(self, offset_x: float, offset_y: float, rotation: float = 0.0):
+    def __init__(
+        self,
+        offset_x: float,
+        offset_y: float,
+        rotation: float = 0.0,
+        verbose: bool = True,
+    ):
         """
         初始化变换器
 
@@ -32,10 +56,12 @@ class MapOffsetTransformer:
             offset_x: X方向偏移量（米）
             offset_y: Y方向偏移量（米）
             rotation: 旋转角度（弧度），默认为0
+            verbose: 是否打印变换参数
         """
-        self.offset_x = offset_x
-        self.offset_y = offset_y
-        self.rotation = rotation
+        super().__init__(offset_x, offset_y, rotation)
+
+        if not verbose:
+            return
 
         print("初始化地图变换器:")
         print(f"  偏移: Δx={offset_x:.4f}m, Δy={offset_y:.4f}m")
@@ -52,7 +78,7 @@ class MapOffsetTransformer:
             变换后的 (x, y)
         """
         # 简单平移（如果旋转角度很小可以忽略）
-        if abs(self.rotation) < 0.01:  # 小于约0.57度
+        if not self.rotates:
             new_x = point.x + self.offset_x
             new_y = point.y + self.offset_y
         else:
@@ -78,203 +104,619 @@ class MapOffsetTransformer:
         Returns:
             变换的点数量
         """
-        point_count = 0
-
-        # 1. 变换所有 lane 中的点
-        print("\n处理 Lanes...")
-        for lane in map_obj.lane:
-            # Central curve
-            for segment in lane.central_curve.segment:
-                for point in segment.line_segment.point:
-                    point.x, point.y = self.transform_point(point)
-                    point_count += 1
-
-            # Left boundary
-            for segment in lane.left_boundary.curve.segment:
-                for point in segment.line_segment.point:
-                    point.x, point.y = self.transform_point(point)
-                    point_count += 1
-
-            # Right boundary
-            for segment in lane.right_boundary.curve.segment:
-                for point in segment.line_segment.point:
-                    point.x, point.y = self.transform_point(point)
-                    point_count += 1
-
-        print(f"  处理了 {len(map_obj.lane)} 个 lanes")
-
-        # 2. 变换所有 road 中的点
-        print("\n处理 Roads...")
-        for road in map_obj.road:
-            for section in road.section:
-                # Outer polygon edges
-                for edge in section.boundary.outer_polygon.edge:
-                    for segment in edge.curve.segment:
-                        for point in segment.line_segment.point:
-                            point.x, point.y = self.transform_point(point)
-                            point_count += 1
-
-        print(f"  处理了 {len(map_obj.road)} 个 roads")
-
-        # 3. 变换所有 junction 中的点（如果有）
-        if hasattr(map_obj, "junction"):
-            print("\n处理 Junctions...")
-            for junction in map_obj.junction:
-                if hasattr(junction, "polygon"):
-                    for point in junction.polygon.point:
-                        point.x, point.y = self.transform_point(point)
-                        point_count += 1
-            print(f"  处理了 {len(map_obj.junction)} 个 junctions")
-
-        # 4. 变换所有 crosswalk 中的点（如果有）
-        if hasattr(map_obj, "crosswalk"):
-            print("\n处理 Crosswalks...")
-            for crosswalk in map_obj.crosswalk:
-                if hasattr(crosswalk, "polygon"):
-                    for point in crosswalk.polygon.point:
-                        point.x, point.y = self.transform_point(point)
-                        point_count += 1
-            print(f"  处理了 {len(map_obj.crosswalk)} 个 crosswalks")
-
-        # 5. 变换所有 stop_sign 中的点（如果有）
-        if hasattr(map_obj, "stop_sign"):
-            print("\n处理 Stop Signs...")
-            for stop_sign in map_obj.stop_sign:
-                for stop_line in stop_sign.stop_line:
-                    for segment in stop_line.segment:
-                        for point in segment.line_segment.point:
-                            point.x, point.y = self.transform_point(point)
-                            point_count += 1
-            print(f"  处理了 {len(map_obj.stop_sign)} 个 stop signs")
-
-        # 6. 变换所有 signal 中的点（如果有）
-        if hasattr(map_obj, "signal"):
-            print("\n处理 Traffic Signals...")
-            for signal in map_obj.signal:
-                for stop_line in signal.stop_line:
-                    for segment in stop_line.segment:
-                        for point in segment.line_segment.point:
-                            point.x, point.y = self.transform_point(point)
-                            point_count += 1
-            print(f"  处理了 {len(map_obj.signal)} 个 signals")
-
-        # 7. 变换所有 yield_sign 中的点（如果有）
-        if hasattr(map_obj, "yield_sign"):
-            print("\n处理 Yield Signs...")
-            for yield_sign in map_obj.yield_sign:
-                for stop_line in yield_sign.stop_line:
-                    for segment in stop_line.segment:
-                        for point in segment.line_segment.point:
-                            point.x, point.y = self.transform_point(point)
-                            point_count += 1
-            print(f"  处理了 {len(map_obj.yield_sign)} 个 yield signs")
-
-        # 8. 变换所有 overlap 中的点（如果有）
-        if hasattr(map_obj, "overlap"):
-            print("\n处理 Overlaps...")
-            # Overlaps 通常不包含直接的点坐标，而是引用其他对象
-            # 这里可能不需要处理
-            pass
-
-        # 9. 变换所有 clear_area 中的点（如果有）
-        if hasattr(map_obj, "clear_area"):
-            print("\n处理 Clear Areas...")
-            for clear_area in map_obj.clear_area:
-                if hasattr(clear_area, "polygon"):
-                    for point in clear_area.polygon.point:
-                        point.x, point.y = self.transform_point(point)
-                        point_count += 1
-            print(f"  处理了 {len(map_obj.clear_area)} 个 clear areas")
-
-        # 10. 变换所有 speed_bump 中的点（如果有）
-        if hasattr(map_obj, "speed_bump"):
-            print("\n处理 Speed Bumps...")
-            for speed_bump in map_obj.speed_bump:
-                if hasattr(speed_bump, "position"):
-                    for segment in speed_bump.position:
-                        for point in segment.line_segment.point:
-                            point.x, point.y = self.transform_point(point)
-                            point_count += 1
-            print(f"  处理了 {len(map_obj.speed_bump)} 个 speed bumps")
-
-        # 11. 变换所有 parking_space 中的点（如果有）
-        if hasattr(map_obj, "parking_space"):
-            print("\n处理 Parking Spaces...")
-            for parking_space in map_obj.parking_space:
-                if hasattr(parking_space, "polygon"):
-                    for point in parking_space.polygon.point:
-                        point.x, point.y = self.transform_point(point)
-                        point_count += 1
-            print(f"  处理了 {len(map_obj.parking_space)} 个 parking spaces")
-
-        return point_count
-
-
-def load_offset_from_results(
-    results_file: str = "results/offset_results.json",
-) -> tuple:
+        return self.transform_geometry(map_obj).num_points
+
+    def transform_geometry(
+        self, map_obj, geometry: MapGeometry = None, perf: PerfRecorder = None
+    ) -> MapGeometry:
+        """
+        对整个地图应用变换，并返回变换后的几何
+
+        Args:
+            map_obj: map_pb2.Map 对象
+            geometry: 已从 map_obj 提取的几何（可选）；其 points 数组会被替换而非原地修改，
+                调用方持有的原始坐标数组保持不变
+            perf: 性能记录器（可选），记录 extract / transform / write 阶段
+
+        Returns:
+            MapGeometry 对象，points 为变换后的坐标
+        """
+        if geometry is None:
+            geometry = extract_map_geometry(map_obj, perf)
+        with (perf or PerfRecorder()).stage("transform", geometry.num_points):
+            geometry.points = self.transform_points(geometry.points)
+        geometry.write_points(geometry.points, perf)
+        print_geometry_summary(map_obj, geometry)
+        return geometry
+
+
+# 校验时允许的最大正向残差（米）
+VERIFY_TOLERANCE = 1e-6
+# 缓存命中时的输出可能来自量化精度以内的另一组偏移量，按量化精度放宽
+CACHED_VERIFY_TOLERANCE = 2e-4
+
+# 元素类型的显示名称（与 map_geometry.ELEMENT_TYPES 对应）
+ELEMENT_DISPLAY_NAMES = {
+    "lane": ("Lanes", "lanes"),
+    "road": ("Roads", "roads"),
+    "junction": ("Junctions", "junctions"),
+    "crosswalk": ("Crosswalks", "crosswalks"),
+    "stop_sign": ("Stop Signs", "stop signs"),
+    "signal": ("Traffic Signals", "signals"),
+    "yield_sign": ("Yield Signs", "yield signs"),
+    "clear_area": ("Clear Areas", "clear areas"),
+    "speed_bump": ("Speed Bumps", "speed bumps"),
+    "parking_space": ("Parking Spaces", "parking spaces"),
+}
+
+
+def print_geometry_summary(map_obj, geometry: MapGeometry):
+    """打印每类元素的数量和点数"""
+    point_counts = geometry.point_counts_by_type()
+    for element_type in ELEMENT_TYPES:
+        if not hasattr(map_obj, element_type):
+            continue
+        title, plural = ELEMENT_DISPLAY_NAMES[element_type]
+        print(f"\n处理 {title}...")
+        print(
+            f"  处理了 {len(getattr(map_obj, element_type))} 个 {plural}"
+            f"（{point_counts[element_type]} 个点）"
+        )
+
+
+def load_map(map_file: str, perf: PerfRecorder = None):
     """
-    从结果文件加载偏移量
+    读取地图文件（先尝试 Text 格式，失败后尝试 Binary 格式）
+
+    文件只读取一次，两种格式的解析共用同一份字节
 
     Args:
-        results_file: 偏移结果文件路径
+        map_file: 地图文件路径
+        perf: 性能记录器（可选），记录 load / parse 阶段
 
     Returns:
-        (offset_x, offset_y, rotation) 元组
+        map_pb2.Map 对象，读取失败时返回 None
     """
-    with open(results_file, "r", encoding="utf-8") as f:
-        results = json.load(f)
+    perf = perf or PerfRecorder()
+    try:
+        with perf.stage("load"):
+            with open(map_file, "rb") as f:
+                data = f.read()
+    except OSError as e:
+        print(f"错误: 无法读取地图文件: {e}")
+        return None
 
-    offset_x = results["simple_offset_stats"]["dx_mean"]
-    offset_y = results["simple_offset_stats"]["dy_mean"]
-    rotation = results["transformation"]["rotation_radians"]
+    map_obj = Map()
+    start = time.perf_counter()
+    try:
+        text_format.Merge(data.decode("utf-8"), map_obj)
+        perf.add("parse.text", time.perf_counter() - start)
+        print("  格式: Text")
+    except Exception as e:
+        perf.add("parse.text_failed", time.perf_counter() - start)
+        print(f"  Text格式读取失败，尝试Binary格式: {e}")
+        try:
+            map_obj = Map()
+            with perf.stage("parse.binary"):
+                map_obj.ParseFromString(data)
+            print("  格式: Binary")
+        except Exception as e2:
+            print(f"错误: 无法读取地图文件: {e2}")
+            return None
 
-    return offset_x, offset_y, rotation
+    return map_obj
 
 
-def main():
-    """主函数"""
-    parser = argparse.ArgumentParser(description="对 Apollo HD Map 应用偏移变换")
-    parser.add_argument(
-        "input_map", type=str, help="输入地图文件路径 (text format .txt 或 binary .bin)"
-    )
-    parser.add_argument("output_map", type=str, help="输出地图文件路径")
-    parser.add_argument(
-        "--offset-file",
-        type=str,
-        default="results/offset_results.json",
-        help="偏移结果文件路径（JSON格式）",
-    )
-    parser.add_argument(
-        "--offset-x", type=float, help="手动指定X偏移量（米），会覆盖文件中的值"
-    )
-    parser.add_argument(
-        "--offset-y", type=float, help="手动指定Y偏移量（米），会覆盖文件中的值"
-    )
-    parser.add_argument(
-        "--rotation", type=float, help="手动指定旋转角度（弧度），会覆盖文件中的值"
-    )
-    parser.add_argument(
-        "--format",
-        type=str,
-        choices=["text", "binary"],
-        default="text",
-        help="输出格式：text 或 binary（默认：text）",
-    )
-    parser.add_argument(
-        "--new-map-id",
-        type=str,
-        default=None,
-        help="新的地图ID（用于更新 metaInfo.json）",
+def map_output_paths(output_map: str, output_format: str) -> list:
+    """
+    根据输出格式确定要写出的文件
+
+    Args:
+        output_map: 输出地图文件路径
+        output_format: "text"、"binary" 或 "both"
+
+    Returns:
+        [(path, format), ...]，both 时分别写出 .bin 和 .txt
+    """
+    if output_format == "both":
+        path = Path(output_map)
+        return [
+            (str(path.with_suffix(".bin")), "binary"),
+            (str(path.with_suffix(".txt")), "text"),
+        ]
+    return [(output_map, output_format)]
+
+
+def save_map(
+    map_obj, output_map: str, output_format: str, perf: PerfRecorder = None
+) -> list:
+    """
+    保存地图文件
+
+    Text 格式直接流式写入文件，不在内存中拼接完整字符串；
+    先写临时文件再替换，避免改写与缓存硬链接的旧输出
+
+    Args:
+        map_obj: map_pb2.Map 对象
+        output_map: 输出地图文件路径
+        output_format: "text"、"binary" 或 "both"
+        perf: 性能记录器（可选），记录 serialize / write 阶段
+
+    Returns:
+        写出的文件路径列表
+    """
+    perf = perf or PerfRecorder()
+    written = []
+    for path, fmt in map_output_paths(output_map, output_format):
+        tmp_path = f"{path}.tmp"
+        if fmt == "text":
+            # 流式写出，序列化和写文件无法拆分
+            with perf.stage("serialize_write.text"):
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    text_format.PrintMessage(map_obj, f)
+        else:
+            with perf.stage("serialize.binary"):
+                data = map_obj.SerializeToString()
+            with perf.stage("write.binary"):
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+            del data
+        os.replace(tmp_path, path)
+        written.append(path)
+    return written
+
+
+def map_cache_keys(
+    input_hash: str,
+    output_map: str,
+    output_format: str,
+    offset_x: float,
+    offset_y: float,
+    rotation: float,
+    version_name: str = None,
+    variant: dict = None,
+) -> dict:
+    """
+    计算每个输出文件的缓存 key
+
+    平移按打印精度量化到 0.1mm；旋转绕原点作用于 UTM 量级（~1e6 m）的坐标，
+    量化到 1e-11 rad 才能使点位误差同样不超过 0.1mm。精度以内相同的变换复用同一份缓存
+
+    Args:
+        input_hash: 输入地图内容的 SHA-256
+        output_map: 输出地图文件路径
+        output_format: "text"、"binary" 或 "both"
+        offset_x: X方向偏移量（米）
+        offset_y: Y方向偏移量（米）
+        rotation: 旋转角度（弧度）
+        version_name: 写入 header 的 version（未更新 header 时为 None）
+        variant: 其他影响输出内容的参数（如裁剪区域）
+
+    Returns:
+        {output_path: cache_key}
+    """
+    return {
+        path: make_cache_key(
+            "step2_map_v1",
+            input_hash,
+            round(offset_x, 4),
+            round(offset_y, 4),
+            round(rotation, 11),
+            fmt,
+            version_name,
+            variant or {},
+        )
+        for path, fmt in map_output_paths(output_map, output_format)
+    }
+
+
+def verified_cache_key(cache_keys: dict) -> str:
+    """
+    缓存产物"已通过逐点校验"标记的 key
+
+    写出并校验通过的产物存入缓存时同时写入该标记。命中时若标记存在，
+    缓存条目自身的 SHA-256 完整性校验即可保证产物与当时校验过的内容一致，无需重新解析输入地图
+
+    Args:
+        cache_keys: map_cache_keys 的返回值
+
+    Returns:
+        标记的缓存 key
+    """
+    return make_cache_key("step2_map_verified_v1", sorted(cache_keys.values()))
+
+
+def update_map_header(map_obj, version_name: str, bounds, verbose=True):
+    """
+    更新地图 header 中的版本信息和边界坐标
+
+    Args:
+        map_obj: map_pb2.Map 对象
+        version_name: 新的 version（地图名称）
+        bounds: 变换后所有点的包围盒 (min_x, min_y, max_x, max_y)，
+            为 None 时不更新边界
+        verbose: 是否打印更新详情
+    """
+    if verbose:
+        print("\n更新地图 header...")
+        print(f"  原 version: {map_obj.header.version.decode('utf-8')}")
+        print(f"  新 version: {version_name}")
+
+    # 更新 version 字段（地图名称）
+    map_obj.header.version = version_name.encode("utf-8")
+
+    # 更新边界坐标（如果存在）
+    # 使用变换后坐标的包围盒重新计算，旋转时边界也能保持正确；
+    # 保留原 header 中 left/right、top/bottom 的大小关系
+    if map_obj.header.HasField("left") and bounds is not None:
+        old_left = map_obj.header.left
+        old_top = map_obj.header.top
+        old_right = map_obj.header.right
+        old_bottom = map_obj.header.bottom
+
+        min_x, min_y, max_x, max_y = bounds
+        if old_left <= old_right:
+            map_obj.header.left, map_obj.header.right = min_x, max_x
+        else:
+            map_obj.header.left, map_obj.header.right = max_x, min_x
+        if old_top >= old_bottom:
+            map_obj.header.top, map_obj.header.bottom = max_y, min_y
+        else:
+            map_obj.header.top, map_obj.header.bottom = min_y, max_y
+
+        if verbose:
+            print("  边界坐标已更新:")
+            print(f"    left:   {old_left:.4f} -> {map_obj.header.left:.4f}")
+            print(f"    top:    {old_top:.4f} -> {map_obj.header.top:.4f}")
+            print(f"    right:  {old_right:.4f} -> {map_obj.header.right:.4f}")
+            print(f"    bottom: {old_bottom:.4f} -> {map_obj.header.bottom:.4f}")
+
+
+def update_meta_info(
+    input_map: str,
+    output_map: str,
+    new_map_id: str,
+    offset_x: float,
+    offset_y: float,
+):
+    """
+    根据新的 map ID 和偏移量生成输出目录下的 metaInfo.json
+
+    Args:
+        input_map: 输入地图文件路径（metaInfo.json 位于同一目录）
+        output_map: 输出地图文件路径
+        new_map_id: 新的地图 ID
+        offset_x: X方向偏移量（米）
+        offset_y: Y方向偏移量（米）
+    """
+    input_map_dir = Path(input_map).parent
+    output_map_dir = Path(output_map).parent
+    meta_info_file = input_map_dir / "metaInfo.json"
+
+    if not meta_info_file.exists():
+        print("\n⚠️  未找到 metaInfo.json，跳过元信息更新")
+        return
+
+    try:
+        print("\n更新 metaInfo.json...")
+        with open(meta_info_file, "r") as f:
+            meta_data = json.load(f)
+
+        # 获取原始的 mapId (可能是字典的键)
+        if meta_data:
+            old_map_id = list(meta_data.keys())[0]
+            old_meta = meta_data[old_map_id]
+
+            # 应用偏移到 left 和 top 坐标
+            # left 和 top 是地图左上角的坐标
+            old_left = old_meta.get("left", 0)
+            old_top = old_meta.get("top", 0)
+
+            # 应用偏移变换（注意：只应用平移，不需要旋转）
+            new_left = old_left + offset_x
+            new_top = old_top + offset_y
+
+            # 创建新的元数据，使用新的 map ID 和偏移后的坐标
+            new_meta_data = {
+                new_map_id: {
+                    **old_meta,
+                    "mapid": new_map_id,
+                    "left": new_left,
+                    "top": new_top,
+                }
+            }
+
+            # 保存新的 metaInfo.json
+            output_meta_file = output_map_dir / "metaInfo.json"
+            with open(output_meta_file, "w") as f:
+                json.dump(new_meta_data, f)
+
+            print("✅ 已更新 metaInfo.json")
+            print(f"   原地图 ID: {old_map_id}")
+            print(f"   新地图 ID: {new_map_id}")
+            print(f"   left: {old_left:.4f} -> {new_left:.4f}")
+            print(f"   top: {old_top:.4f} -> {new_top:.4f}")
+    except Exception as e:
+        print(f"⚠️  警告: 更新 metaInfo.json 失败: {e}")
+
+
+def load_batch_transforms(batch_file: str) -> list:
+    """
+    加载批量变换列表
+
+    文件为 JSON 列表，每一项包含 name 以及以下两种形式之一:
+      {"name": "a", "offset_x": 1.0, "offset_y": 2.0, "rotation": 0.0}
+      {"name": "b", "offset_file": "results/offset_results.json"}
+    可选字段 new_map_id 用于更新 header 和 metaInfo.json
+
+    Args:
+        batch_file: 批量变换列表文件路径
+
+    Returns:
+        [{"name", "offset_x", "offset_y", "rotation", "new_map_id"}, ...]
+    """
+    with open(batch_file, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    transforms = []
+    names = set()
+    for i, entry in enumerate(entries):
+        name = entry.get("name")
+        if not name:
+            raise ValueError(f"第 {i + 1} 个变换缺少 name 字段")
+        if name in names:
+            raise ValueError(f"变换名称重复: {name}")
+        names.add(name)
+
+        if "offset_file" in entry:
+            offset_x, offset_y, rotation = load_offset_from_results(
+                entry["offset_file"]
+            )
+        else:
+            offset_x = float(entry["offset_x"])
+            offset_y = float(entry["offset_y"])
+            rotation = float(entry.get("rotation", 0.0))
+
+        transforms.append(
+            {
+                "name": name,
+                "offset_x": offset_x,
+                "offset_y": offset_y,
+                "rotation": rotation,
+                "new_map_id": entry.get("new_map_id"),
+            }
+        )
+
+    return transforms
+
+
+# 批量模式的共享状态：在创建进程池之前设置，fork 出的子进程直接继承，
+# 避免把解析好的地图重新序列化传给每个 worker
+_BATCH_STATE = {}
+
+
+def _apply_batch_transform(task: dict) -> dict:
+    """批量模式 worker：写回变换后的坐标并保存一个输出"""
+    start = time.time()
+    map_obj = _BATCH_STATE["map"]
+    geometry = _BATCH_STATE["geometry"]
+
+    transformer = MapOffsetTransformer(
+        task["offset_x"], task["offset_y"], task["rotation"], verbose=False
     )
+    xy = transformer.transform_points(geometry.points)
+    geometry.write_points(xy)
+
+    # 每个输出都从原始 header 开始更新
+    map_obj.header.CopyFrom(_BATCH_STATE["header"])
+    if task["new_map_id"]:
+        bounds = (*xy.min(axis=0), *xy.max(axis=0)) if len(xy) else None
+        update_map_header(
+            map_obj, Path(task["output"]).parent.name, bounds, verbose=False
+        )
+
+    written = save_map(map_obj, task["output"], task["format"])
+
+    # 空间索引和几何数组基于变换后的坐标，不修改共享的 geometry
+    if task["spatial_index"] or task["export_geometry"]:
+        output_geometry = geometry.detached()
+        output_geometry.points = xy
+        output_path = Path(task["output"])
+        if task["spatial_index"]:
+            index_dir = output_path.with_suffix(".index")
+            build_spatial_index(output_geometry, str(index_dir), task["cell_size"])
+            written.append(str(index_dir))
+        if task["export_geometry"]:
+            geometry_file = output_path.with_name(f"{output_path.stem}_geometry.npz")
+            output_geometry.save_npz(str(geometry_file))
+            written.append(str(geometry_file))
+
+    return {
+        "name": task["name"],
+        "output": ", ".join(written),
+        "points": geometry.num_points,
+        "seconds": time.time() - start,
+    }
+
+
+def run_batch(args) -> int:
+    """
+    批量模式：加载一次地图，依次（或并行）写出多个变换结果
 
-    args = parser.parse_args()
+    输出路径为 <output_map>/<name>/base_map.<txt|bin>（both 时两者都写出），
+    空间索引和几何数组（如果启用）写在每个输出地图旁边。
+    裁剪和简化会改变地图结构，无法复用共享的几何，批量模式下不支持
+    """
+    unsupported = [
+        flag
+        for flag, value in (
+            ("--crop-scenario", args.crop_scenario),
+            ("--simplify-tolerance", args.simplify_tolerance),
+        )
+        if value
+    ]
+    if unsupported:
+        print(f"错误: 批量模式不支持 {', '.join(unsupported)}，请对每个变换单独运行")
+        return 1
 
-    if Map is None:
-        print("错误: 未找到 Apollo proto 模块")
-        print("请确保已编译 Apollo 10.0 proto 文件并正确安装")
+    try:
+        transforms = load_batch_transforms(args.batch)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"错误: 无法加载批量变换列表: {e}")
         return 1
 
+    if not transforms:
+        print("错误: 批量变换列表为空")
+        return 1
+
+    print(f"批量模式: {len(transforms)} 个变换")
+
+    # 读取并提取地图（只做一次）
+    print(f"\n读取地图: {args.input_map}")
+    map_obj = load_map(args.input_map)
+    if map_obj is None:
+        return 1
+
+    geometry = extract_map_geometry(map_obj)
+    print(f"  提取了 {geometry.num_points} 个点（{geometry.num_polylines} 条折线）")
+
+    header = type(map_obj.header)()
+    header.CopyFrom(map_obj.header)
+    _BATCH_STATE.update(map=map_obj, geometry=geometry, header=header)
+
+    suffix = ".txt" if args.format == "text" else ".bin"
+    tasks = []
+    for transform in transforms:
+        output_dir = Path(args.output_map) / transform["name"]
+        output_dir.mkdir(parents=True, exist_ok=True)
+        tasks.append(
+            {
+                **transform,
+                "output": str(output_dir / f"base_map{suffix}"),
+                "format": args.format,
+                "spatial_index": args.spatial_index,
+                "export_geometry": args.export_geometry,
+                "cell_size": args.index_cell_size,
+            }
+        )
+
+    jobs = args.jobs or min(len(tasks), os.cpu_count() or 1)
+    use_pool = jobs > 1 and "fork" in multiprocessing.get_all_start_methods()
+
+    print(f"\n开始批量变换（{'并行 ' + str(jobs) + ' 进程' if use_pool else '串行'}）...")
+    if use_pool:
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            results = list(executor.map(_apply_batch_transform, tasks))
+    else:
+        results = [_apply_batch_transform(task) for task in tasks]
+
+    for task, result in zip(tasks, results):
+        print(
+            f"  ✅ {result['name']}: Δx={task['offset_x']:.4f}m, "
+            f"Δy={task['offset_y']:.4f}m, θ={task['rotation']:.6f}rad "
+            f"-> {result['output']} ({result['seconds']:.2f}s)"
+        )
+        if task["new_map_id"]:
+            update_meta_info(
+                args.input_map,
+                task["output"],
+                task["new_map_id"],
+                task["offset_x"],
+                task["offset_y"],
+            )
+
+    print(f"\n✅ 批量地图偏移完成！共 {len(results)} 个输出")
+    return 0
+
+
+def verify_output_maps(
+    source: MapGeometry,
+    output_paths: list,
+    transformer: MapOffsetTransformer,
+    tolerance: float = VERIFY_TOLERANCE,
+) -> bool:
+    """
+    重新读取输出地图，与输入几何逐点比对
+
+    同时写出 .bin 和 .txt 时只校验 .bin（两者来自同一内存对象，且解析快得多）
+
+    Args:
+        source: 输入地图的几何（变换前）
+        output_paths: 写出的地图文件列表
+        transformer: 使用的变换器
+        tolerance: 允许的最大正向残差（米）
+
+    Returns:
+        是否通过校验
+    """
+    binary_paths = [p for p in output_paths if not str(p).endswith(".txt")]
+    paths = binary_paths or list(output_paths)[:1]
+
+    passed = True
+    for path in paths:
+        print(f"\n校验输出地图: {path}")
+        output_map = load_map(path)
+        if output_map is None:
+            return False
+        report = compare_geometry(
+            source,
+            extract_map_geometry(output_map),
+            transformer.transform_points,
+            transformer.inverse_transform_points,
+        )
+
+        if not report["structure_ok"]:
+            passed = False
+            print("  ❌ 结构不一致")
+            print(f"    点数: {report['num_points'][0]} -> {report['num_points'][1]}")
+            print(
+                f"    折线数: {report['num_polylines'][0]} -> "
+                f"{report['num_polylines'][1]}"
+            )
+            for name in report["mismatched_types"]:
+                before, after = report["point_counts"][name]
+                print(f"    {name}: {before} -> {after} 个点")
+            continue
+
+        if "forward_max" not in report:
+            print("  ✅ 结构一致（无坐标点）")
+            continue
+
+        ok = report["forward_max"] <= tolerance
+        passed &= ok
+        print(f"  {'✅' if ok else '❌'} 结构一致，{report['num_points'][1]} 个点")
+        print(
+            f"    正向残差: max={report['forward_max']:.3e}m, "
+            f"mean={report['forward_mean']:.3e}m"
+        )
+        print(
+            f"    逆向残差: max={report['inverse_max']:.3e}m, "
+            f"mean={report['inverse_mean']:.3e}m"
+        )
+
+    return passed
+
+
+def finish_single(args, offset_x: float, offset_y: float, rotation: float) -> int:
+    """单次变换的收尾：更新 metaInfo.json 并打印汇总"""
+    # 处理 metaInfo.json（如果提供了新的 map ID）
+    if args.new_map_id:
+        update_meta_info(
+            args.input_map, args.output_map, args.new_map_id, offset_x, offset_y
+        )
+
+    print("\n✅ 地图偏移完成！")
+    print(f"输入: {args.input_map}")
+    print(f"输出: {args.output_map}")
+    print(f"偏移: Δx={offset_x:.4f}m, Δy={offset_y:.4f}m, θ={rotation:.6f}rad")
+
+    return 0
+
+
+def run_single(args, perf: PerfRecorder) -> int:
+    """单次变换：加载偏移量、读取地图、变换并保存，各阶段耗时记录到 perf"""
     # 加载偏移量
     if args.offset_x is not None and args.offset_y is not None:
         offset_x = args.offset_x
@@ -288,134 +730,330 @@ def main():
     # 创建变换器
     transformer = MapOffsetTransformer(offset_x, offset_y, rotation)
 
-    # 读取地图
-    print(f"\n读取地图: {args.input_map}")
-    map_obj = Map()
-
-    try:
-        with open(args.input_map, "r", encoding="utf-8") as f:
-            text_format.Merge(f.read(), map_obj)
-        print("  格式: Text")
-    except Exception as e:
-        print(f"  Text格式读取失败，尝试Binary格式: {e}")
+    # 影响输出内容的附加处理（同时作为缓存 key 的一部分）
+    variant = {}
+    crop_region = None
+    if args.crop_scenario:
         try:
-            with open(args.input_map, "rb") as f:
-                map_obj.ParseFromString(f.read())
-            print("  格式: Binary")
-        except Exception as e2:
-            print(f"错误: 无法读取地图文件: {e2}")
+            crop_region = scenario_region(args.crop_scenario, args.crop_margin)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"错误: 无法从场景计算裁剪区域 {args.crop_scenario}: {e}")
             return 1
+        variant["crop"] = [round(v, 4) for v in crop_region]
+        print(
+            "裁剪区域: x=[{:.2f}, {:.2f}], y=[{:.2f}, {:.2f}]".format(
+                crop_region[0], crop_region[2], crop_region[1], crop_region[3]
+            )
+        )
+    if args.simplify_tolerance:
+        variant["simplify"] = args.simplify_tolerance
+
+    # 裁剪和简化会有意改变地图结构，此时无法逐点校验
+    verify = args.verify and not variant
+    if args.verify and variant:
+        print("⚠️  启用了裁剪或简化，跳过逐点校验")
+
+    # 检查缓存
+    cache = None
+    cache_keys = {}
+    if args.cache_dir:
+        cache = ArtifactCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024))
+        version_name = Path(args.output_map).parent.name if args.new_map_id else None
+        with perf.stage("cache.hash_input"):
+            input_hash = hash_file(args.input_map)
+        cache_keys = map_cache_keys(
+            input_hash,
+            args.output_map,
+            args.format,
+            offset_x,
+            offset_y,
+            rotation,
+            version_name,
+            variant,
+        )
+        # 空间索引等附加产物需要解析后的几何，此时不走缓存命中
+        needs_geometry = args.spatial_index or args.export_geometry
+        with perf.stage("cache.lookup"):
+            hit = not needs_geometry and all(
+                cache.get(key, path) for path, key in cache_keys.items()
+            )
+        if hit:
+            print(f"\n✅ 命中缓存: {args.cache_dir}")
+            for path in cache_keys:
+                print(f"  已写出: {path}")
+            if verify and cache.get_bytes(verified_cache_key(cache_keys)) is not None:
+                print("\n✅ 缓存产物已通过校验（SHA-256 与校验时一致）")
+            elif verify:
+                print(f"\n读取输入地图用于校验: {args.input_map}")
+                input_map = load_map(args.input_map, perf)
+                if input_map is None:
+                    return 1
+                source_geometry = extract_map_geometry(input_map, perf)
+                with perf.stage("verify", source_geometry.num_points):
+                    passed = verify_output_maps(
+                        source_geometry,
+                        list(cache_keys),
+                        transformer,
+                        CACHED_VERIFY_TOLERANCE,
+                    )
+                if not passed:
+                    print("\n❌ 地图校验失败")
+                    return 1
+                cache.put_bytes(verified_cache_key(cache_keys), b"")
+            return finish_single(args, offset_x, offset_y, rotation)
+
+    # 读取地图
+    print(f"\n读取地图: {args.input_map}")
+    map_obj = load_map(args.input_map, perf)
+    if map_obj is None:
+        return 1
 
     # 应用变换
     print("\n" + "=" * 60)
     print("开始变换地图...")
     print("=" * 60)
-    point_count = transformer.transform_map(map_obj)
+    geometry = extract_map_geometry(map_obj, perf)
+    source_geometry = geometry.detached() if verify else None
+    geometry = transformer.transform_geometry(map_obj, geometry, perf)
+    point_count = geometry.num_points
 
     print("\n" + "=" * 60)
     print(f"变换完成！共处理 {point_count} 个点")
     print("=" * 60)
 
+    # 裁剪地图
+    if crop_region is not None:
+        print("\n裁剪地图...")
+        with perf.stage("crop", geometry.num_points):
+            map_obj, crop_stats = crop_map(map_obj, geometry, crop_region)
+        geometry = extract_map_geometry(map_obj)
+        for name, (before, after) in crop_stats["counts"].items():
+            if before:
+                print(f"  {name}: {before} -> {after}")
+        print(f"  删除悬空引用: {crop_stats['removed_refs']} 个")
+        print(f"  剩余点数: {point_count} -> {geometry.num_points}")
+
+    # 简化折线
+    if args.simplify_tolerance:
+        print(f"\n简化折线（容差 {args.simplify_tolerance}m）...")
+        before = geometry.num_points
+        with perf.stage("simplify", before):
+            removed = geometry.simplify(args.simplify_tolerance)
+        for element_type, count in removed.items():
+            if count:
+                print(f"  {element_type}: 删除 {count} 个点")
+        print(
+            f"  点数: {before} -> {geometry.num_points}"
+            f"（删除 {before - geometry.num_points} 个，"
+            f"{(before - geometry.num_points) / max(before, 1):.1%}）"
+        )
+
     # 更新地图 header 中的边界坐标和版本信息
     if args.new_map_id:
         output_map_name = Path(args.output_map).parent.name
-        print("\n更新地图 header...")
-        print(f"  原 version: {map_obj.header.version.decode('utf-8')}")
-        print(f"  新 version: {output_map_name}")
-
-        # 更新 version 字段（地图名称）
-        map_obj.header.version = output_map_name.encode("utf-8")
-
-        # 更新边界坐标（如果存在）
-        if map_obj.header.HasField("left"):
-            old_left = map_obj.header.left
-            old_top = map_obj.header.top
-            old_right = map_obj.header.right
-            old_bottom = map_obj.header.bottom
-
-            map_obj.header.left += offset_x
-            map_obj.header.top += offset_y
-            map_obj.header.right += offset_x
-            map_obj.header.bottom += offset_y
-
-            print("  边界坐标已更新:")
-            print(f"    left:   {old_left:.4f} -> {map_obj.header.left:.4f}")
-            print(f"    top:    {old_top:.4f} -> {map_obj.header.top:.4f}")
-            print(f"    right:  {old_right:.4f} -> {map_obj.header.right:.4f}")
-            print(f"    bottom: {old_bottom:.4f} -> {map_obj.header.bottom:.4f}")
+        with perf.stage("header"):
+            update_map_header(map_obj, output_map_name, geometry.bounds())
 
     # 保存地图
     print(f"\n保存地图: {args.output_map}")
     try:
-        if args.format == "text":
-            with open(args.output_map, "w", encoding="utf-8") as f:
-                f.write(text_format.MessageToString(map_obj))
-            print("  格式: Text")
-        else:
-            with open(args.output_map, "wb") as f:
-                f.write(map_obj.SerializeToString())
-            print("  格式: Binary")
+        written = save_map(map_obj, args.output_map, args.format, perf)
+        for path in written:
+            print(f"  已写出: {path}")
     except Exception as e:
         print(f"错误: 无法保存地图文件: {e}")
         return 1
 
-    # 处理 metaInfo.json（如果提供了新的 map ID）
-    if args.new_map_id:
-        input_map_dir = Path(args.input_map).parent
-        output_map_dir = Path(args.output_map).parent
-        meta_info_file = input_map_dir / "metaInfo.json"
-
-        if meta_info_file.exists():
-            try:
-                print("\n更新 metaInfo.json...")
-                with open(meta_info_file, "r") as f:
-                    meta_data = json.load(f)
-
-                # 获取原始的 mapId (可能是字典的键)
-                if meta_data:
-                    old_map_id = list(meta_data.keys())[0]
-                    old_meta = meta_data[old_map_id]
-
-                    # 应用偏移到 left 和 top 坐标
-                    # left 和 top 是地图左上角的坐标
-                    old_left = old_meta.get("left", 0)
-                    old_top = old_meta.get("top", 0)
-
-                    # 应用偏移变换（注意：只应用平移，不需要旋转）
-                    new_left = old_left + offset_x
-                    new_top = old_top + offset_y
-
-                    # 创建新的元数据，使用新的 map ID 和偏移后的坐标
-                    new_meta_data = {
-                        args.new_map_id: {
-                            **old_meta,
-                            "mapid": args.new_map_id,
-                            "left": new_left,
-                            "top": new_top,
-                        }
-                    }
-
-                    # 保存新的 metaInfo.json
-                    output_meta_file = output_map_dir / "metaInfo.json"
-                    with open(output_meta_file, "w") as f:
-                        json.dump(new_meta_data, f)
-
-                    print("✅ 已更新 metaInfo.json")
-                    print(f"   原地图 ID: {old_map_id}")
-                    print(f"   新地图 ID: {args.new_map_id}")
-                    print(f"   left: {old_left:.4f} -> {new_left:.4f}")
-                    print(f"   top: {old_top:.4f} -> {new_top:.4f}")
-            except Exception as e:
-                print(f"⚠️  警告: 更新 metaInfo.json 失败: {e}")
-        else:
-            print("\n⚠️  未找到 metaInfo.json，跳过元信息更新")
+    if verify:
+        with perf.stage("verify", source_geometry.num_points):
+            passed = verify_output_maps(source_geometry, written, transformer)
+        if not passed:
+            print("\n❌ 地图校验失败")
+            return 1
 
-    print("\n✅ 地图偏移完成！")
-    print(f"输入: {args.input_map}")
-    print(f"输出: {args.output_map}")
-    print(f"偏移: Δx={offset_x:.4f}m, Δy={offset_y:.4f}m, θ={rotation:.6f}rad")
+    if args.spatial_index:
+        index_dir = Path(args.output_map).with_suffix(".index")
+        with perf.stage("spatial_index", geometry.num_points):
+            stats = build_spatial_index(
+                geometry, str(index_dir), args.index_cell_size
+            )
+        print(f"\n空间索引: {index_dir}")
+        print(
+            f"  {stats['elements']} 个元素, {stats['cells']} 个网格单元, "
+            f"{stats['entries']} 个索引项"
+        )
+
+    if args.export_geometry:
+        output_path = Path(args.output_map)
+        geometry_file = output_path.with_name(f"{output_path.stem}_geometry.npz")
+        with perf.stage("export_geometry", geometry.num_points):
+            geometry.save_npz(str(geometry_file))
+        print(f"\n几何数组: {geometry_file}")
+        print(
+            f"  {geometry.num_points} 个点, {geometry.num_polylines} 条折线, "
+            f"{len(geometry.element_ids)} 个元素"
+        )
+
+    if cache is not None:
+        with perf.stage("cache.store"):
+            for path, key in cache_keys.items():
+                cache.put(key, path)
+            if verify:
+                cache.put_bytes(verified_cache_key(cache_keys), b"")
+        print(f"  已写入缓存: {args.cache_dir}")
+
+    return finish_single(args, offset_x, offset_y, rotation)
 
-    return 0
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="对 Apollo HD Map 应用偏移变换")
+    parser.add_argument(
+        "input_map", type=str, help="输入地图文件路径 (text format .txt 或 binary .bin)"
+    )
+    parser.add_argument(
+        "output_map", type=str, help="输出地图文件路径（批量模式下为输出根目录）"
+    )
+    parser.add_argument(
+        "--offset-file",
+        type=str,
+        default="results/offset_results.json",
+        help="偏移结果文件路径（JSON格式）",
+    )
+    parser.add_argument(
+        "--offset-x", type=float, help="手动指定X偏移量（米），会覆盖文件中的值"
+    )
+    parser.add_argument(
+        "--offset-y", type=float, help="手动指定Y偏移量（米），会覆盖文件中的值"
+    )
+    parser.add_argument(
+        "--rotation", type=float, help="手动指定旋转角度（弧度），会覆盖文件中的值"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=["text", "binary", "both"],
+        default="text",
+        help="输出格式：text、binary 或 both（同时写出 .bin 和 .txt，默认：text）",
+    )
+    parser.add_argument(
+        "--new-map-id",
+        type=str,
+        default=None,
+        help="新的地图ID（用于更新 metaInfo.json）",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="变换结果缓存目录（按输入地图内容和偏移量缓存，命中时直接链接输出）",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=2048,
+        help="缓存容量上限（MB，默认: 2048）",
+    )
+    parser.add_argument(
+        "--spatial-index",
+        action="store_true",
+        help="同时构建空间索引，保存到输出地图旁的 <name>.index/ 目录",
+    )
+    parser.add_argument(
+        "--index-cell-size",
+        type=float,
+        default=50.0,
+        help="空间索引网格尺寸（米，默认: 50）",
+    )
+    parser.add_argument(
+        "--export-geometry",
+        action="store_true",
+        help="同时导出列式几何数组，保存到输出地图旁的 <name>_geometry.npz",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="写出后重新读取输出地图，校验其确为输入在该变换下的结果",
+    )
+    parser.add_argument(
+        "--crop-scenario",
+        type=str,
+        default=None,
+        help="按场景（偏移后的坐标系）中障碍物和主车的范围裁剪地图",
+    )
+    parser.add_argument(
+        "--crop-margin",
+        type=float,
+        default=100.0,
+        help="裁剪区域的边距（米，默认: 100）",
+    )
+    parser.add_argument(
+        "--simplify-tolerance",
+        type=float,
+        default=None,
+        help="对 line_segment 折线做 Douglas-Peucker 简化的容差（米），默认不简化",
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        default=None,
+        help="批量变换列表（JSON），只加载一次地图并输出到 <output_map>/<name>/",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="批量模式的并行进程数（默认: min(变换数, CPU 核数)）",
+    )
+    parser.add_argument(
+        "--perf-report",
+        type=str,
+        default=None,
+        help="保存各阶段耗时、点数和峰值内存的 JSON 报告",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="保存 cProfile 结果（可用 snakeviz / pstats 查看）",
+    )
+
+    args = parser.parse_args()
+
+    if Map is None:
+        print("错误: 未找到 Apollo proto 模块")
+        print("请确保已编译 Apollo 10.0 proto 文件并正确安装")
+        return 1
+
+    if args.batch:
+        return run_batch(args)
+
+    perf = PerfRecorder()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        result = run_single(args, perf)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"\ncProfile 结果: {args.profile}")
+
+    if args.perf_report:
+        print("\n各阶段耗时:")
+        perf.print_summary()
+        perf.save(
+            args.perf_report,
+            input_map=args.input_map,
+            output_map=args.output_map,
+            format=args.format,
+            exit_code=result,
+        )
+        print(f"性能报告: {args.perf_report}")
+
+    return result
 
 
 if __name__ == "__main__":
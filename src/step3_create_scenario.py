@@ -4,11 +4,27 @@
 使用 scenarios.json 作为模板，替换为 data.json 中的障碍物数据
 """
 
+import io
+import os
+import gzip
 import json
 import copy
 import argparse
 import hashlib
-from typing import List
+import multiprocessing
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from frame_store import FrameStore
+from map_spatial_index import load_lane_projector
+from obstacle_filters import filter_overlapping, filter_roi, load_roi
+from offset_transform import OffsetTransform
 
 
 def load_json(filepath: str) -> dict:
@@ -23,6 +39,123 @@ def save_json(data: dict, filepath: str):
         json.dump(data, f, indent=2, ensure_ascii=False)
 
 
+# 过滤统计项的显示名称
+FILTER_STAT_LABELS = {
+    "duplicates": "合并重复",
+    "overlaps": "删除重叠",
+    "pairs": "相交对",
+    "outside_bbox": "远离区域",
+    "outside_polygon": "区域外",
+}
+
+# 流式写出时占位的列表元素
+_STREAM_PLACEHOLDER = "__scenario_stream_section_{}__"
+
+
+@contextmanager
+def _open_output(filepath: str, compress: bool):
+    if not compress:
+        with open(filepath, "w", encoding="utf-8") as f:
+            yield f
+        return
+    # gzip 头中不写文件名和时间戳，相同内容的输出逐字节一致
+    with open(filepath, "wb") as raw, gzip.GzipFile(
+        filename="", mode="wb", fileobj=raw, mtime=0
+    ) as compressed, io.TextIOWrapper(compressed, encoding="utf-8") as f:
+        yield f
+
+
+def stream_json(
+    data: dict,
+    sections: Dict[Tuple[str, ...], Iterable],
+    filepath: str,
+    compact: bool = False,
+    compress: bool = False,
+) -> Dict[Tuple[str, ...], int]:
+    """
+    流式保存 JSON：先序列化骨架，再逐个写出各列表的元素
+
+    默认输出与 save_json（indent=2）逐字节一致；内存占用只与骨架和单个元素有关
+
+    Args:
+        data: 骨架字典，sections 中的路径必须指向列表（其原有内容会被忽略）
+        sections: 列表路径 -> 元素迭代器
+        filepath: 输出文件路径
+        compact: 是否输出无缩进的紧凑 JSON
+        compress: 是否使用 gzip 压缩
+
+    Returns:
+        每个列表写出的元素数量
+    """
+    # 在骨架中放入占位元素，序列化后按位置切开
+    placeholders = {}
+    saved = []
+    for index, path in enumerate(sections):
+        node = data
+        for key in path[:-1]:
+            node = node[key]
+        saved.append((node, path[-1], node[path[-1]]))
+        placeholder = _STREAM_PLACEHOLDER.format(index)
+        node[path[-1]] = [placeholder]
+        placeholders[path] = json.dumps(placeholder)
+
+    try:
+        if compact:
+            text = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        else:
+            text = json.dumps(data, indent=2, ensure_ascii=False)
+    finally:
+        for node, key, value in saved:
+            node[key] = value
+
+    # 按占位元素在文本中的顺序写出
+    ordered = sorted(
+        (text.index(placeholder), path, placeholder)
+        for path, placeholder in placeholders.items()
+    )
+    if compact:
+        encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    else:
+        encoder = json.JSONEncoder(indent=2, ensure_ascii=False)
+
+    counts = {}
+    with _open_output(filepath, compress) as f:
+        position = 0
+        for start, path, placeholder in ordered:
+            end = start + len(placeholder)
+            if compact:
+                open_end, close_start = start, end
+                indent = separator = ""
+            else:
+                # 占位元素独占一行: "[\n<indent>placeholder\n<outer>]"
+                line_start = text.rfind("\n", 0, start) + 1
+                open_end = line_start - 1
+                close_start = end
+                indent = text[line_start:start]
+                separator = "\n" + indent
+            close_end = text.index("]", end) + 1
+
+            f.write(text[position:open_end])
+            count = 0
+            for item in sections[path]:
+                if count:
+                    f.write(",")
+                if compact:
+                    f.write(encoder.encode(item))
+                else:
+                    f.write(separator)
+                    f.write(encoder.encode(item).replace("\n", separator))
+                count += 1
+            # 空列表输出 "[]"，与 json.dump 一致
+            f.write(text[close_start : close_end - 1] if count else "")
+            f.write("]")
+            position = close_end
+            counts[path] = count
+        f.write(text[position:])
+
+    return counts
+
+
 def map_object_type(data_type: str) -> tuple:
     """
     将 data.json 中的类型映射到 scenarios.json 格式
@@ -46,31 +179,92 @@ def map_object_type(data_type: str) -> tuple:
         return "unknownUnmovableObject", "miscObject"
 
 
-def create_scenario_object(new_id: str, original_id: str, obj_data: dict) -> dict:
+# 场景中障碍物列表的路径（模板骨架不包含这两个列表）
+ENTITY_LIST_PATHS = (
+    ("scenario", "entities", "scenarioObjects"),
+    ("scenario", "storyboard", "init", "actions", "privates"),
+)
+
+# 各实体类型的固定字段（保持输出字段顺序），boundingBox / properties 创建时填充。
+# 嵌套的固定字段（performance、axles）在所有障碍物之间共享，只读
+ENTITY_PROTOTYPES = {
+    "vehicle": {
+        "name": "",
+        "vehicleCategory": "car",
+        "boundingBox": None,
+        "performance": {
+            "maxSpeed": 69.444,
+            "maxAcceleration": 200,
+            "maxDeceleration": 10.0,
+        },
+        "axles": {
+            "frontAxle": {
+                "maxSteering": 0.5,
+                "wheelDiameter": 0.8,
+                "trackWidth": 1.68,
+                "positionX": 2.98,
+                "positionZ": 0.4,
+            },
+            "rearAxle": {
+                "maxSteering": 0.0,
+                "wheelDiameter": 0.8,
+                "trackWidth": 1.68,
+                "positionX": 0.0,
+                "positionZ": 0.4,
+            },
+        },
+        "properties": None,
+    },
+    "pedestrian": {
+        "name": "",
+        "mass": 80.0,
+        "model": "walker.pedestrian.0001",
+        "pedestrianCategory": "pedestrian",
+        "boundingBox": None,
+        "properties": None,
+    },
+    "unknownUnmovableObject": {
+        "mass": 500.0,
+        "boundingBox": None,
+        "properties": None,
+    },
+}
+
+# 障碍物名称前缀
+ENTITY_NAME_PREFIXES = {
+    "vehicle": "vehicle",
+    "pedestrian": "pedestrian",
+    "unknownUnmovableObject": "object",
+}
+
+
+# 目录引用模式下实体定义所在的目录（scenario.catalog）
+CATALOG_NAME = "obstacleCatalog"
+CATALOG_PATH = ("scenario", "catalog", "entries")
+
+
+def scenario_entity_type(data_type: str) -> str:
     """
-    创建 scenarioObject
+    场景中实体对象的类型
+
+    没有专门实体定义的类型（如 BICYCLE）按静态障碍物 unknownUnmovableObject 处理
 
     Args:
-        new_id: 新的障碍物 ID（连续递增）
-        original_id: data.json 中的原始 ID
-        obj_data: data.json 中的障碍物数据
+        data_type: data.json 中的类型
 
     Returns:
-        scenarioObject 字典
+        ENTITY_PROTOTYPES 中的实体类型
     """
-    entity_type, catalog_type = map_object_type(obj_data["type"])
-
-    # 根据类型生成名称
-    type_prefix = {
-        "vehicle": "vehicle",
-        "pedestrian": "pedestrian",
-        "unknownUnmovableObject": "object",
-    }.get(entity_type, "object")
+    entity_type, _ = map_object_type(data_type)
+    if entity_type not in ENTITY_PROTOTYPES:
+        return "unknownUnmovableObject"
+    return entity_type
 
-    scenario_obj = {"name": f"{type_prefix}_{new_id}", "id": new_id, "entityObject": {}}
 
-    # 构建边界框
-    bounding_box = {
+def create_entity(entity_type: str, obj_data: dict) -> dict:
+    """由原型构建实体定义，只新建随障碍物变化的 boundingBox（properties 为 None）"""
+    entity = dict(ENTITY_PROTOTYPES[entity_type])
+    entity["boundingBox"] = {
         "center": {"x": 0.0, "y": 0.0, "z": 0.0},
         "dimensions": {
             "length": obj_data["length"],
@@ -78,90 +272,220 @@ def create_scenario_object(new_id: str, original_id: str, obj_data: dict) -> dic
             "height": obj_data["height"],
         },
     }
+    return entity
 
-    # 根据类型构建实体对象
-    if entity_type == "vehicle":
-        scenario_obj["entityObject"]["vehicle"] = {
-            "name": "",
-            "vehicleCategory": "car",
-            "boundingBox": bounding_box,
-            "performance": {
-                "maxSpeed": 69.444,
-                "maxAcceleration": 200,
-                "maxDeceleration": 10.0,
-            },
-            "axles": {
-                "frontAxle": {
-                    "maxSteering": 0.5,
-                    "wheelDiameter": 0.8,
-                    "trackWidth": 1.68,
-                    "positionX": 2.98,
-                    "positionZ": 0.4,
-                },
-                "rearAxle": {
-                    "maxSteering": 0.0,
-                    "wheelDiameter": 0.8,
-                    "trackWidth": 1.68,
-                    "positionX": 0.0,
-                    "positionZ": 0.4,
-                },
-            },
-            "properties": {
-                "property": [{"name": "original_id", "value": str(original_id)}]
-            },
-        }
-    elif entity_type == "pedestrian":
-        scenario_obj["entityObject"]["pedestrian"] = {
-            "name": "",
-            "mass": 80.0,
-            "model": "walker.pedestrian.0001",
-            "pedestrianCategory": "pedestrian",
-            "boundingBox": bounding_box,
-            "properties": {
-                "property": [{"name": "original_id", "value": str(original_id)}]
-            },
-        }
+
+def entity_properties(
+    original_id: str, obj_data: dict, lane: tuple = None, world_position: bool = False
+) -> dict:
+    """
+    障碍物自身的属性（原始 ID、合并的重复检测、车道投影结果）
+
+    world_position 为 True 时（初始位置使用 lanePosition）同时保留世界坐标 world_x / world_y，
+    供不解析地图的下游（如 step 2 --crop-scenario）定位障碍物
+    """
+    properties = [{"name": "original_id", "value": str(original_id)}]
+    if obj_data.get("merged_ids"):
+        # 合并到该障碍物的重复检测
+        properties.append(
+            {"name": "merged_ids", "value": ",".join(obj_data["merged_ids"])}
+        )
+    if lane is not None:
+        lane_id, s, l = lane
+        properties += [
+            {"name": "lane_id", "value": lane_id},
+            {"name": "lane_s", "value": f"{s:.3f}"},
+            {"name": "lane_l", "value": f"{l:.3f}"},
+        ]
+        if world_position:
+            properties += [
+                {"name": "world_x", "value": f"{obj_data['positionX']:.3f}"},
+                {"name": "world_y", "value": f"{obj_data['positionY']:.3f}"},
+            ]
+    return {"property": properties}
+
+
+def create_scenario_object(
+    new_id: str,
+    original_id: str,
+    obj_data: dict,
+    lane: tuple = None,
+    world_position: bool = False,
+) -> dict:
+    """
+    创建 scenarioObject
+
+    Args:
+        new_id: 新的障碍物 ID（连续递增）
+        original_id: data.json 中的原始 ID
+        obj_data: data.json 中的障碍物数据
+        lane: 车道投影结果 (lane_id, s, l)（可选），写入 properties
+        world_position: 是否在 properties 中保留世界坐标（初始位置使用 lanePosition 时）
+
+    Returns:
+        scenarioObject 字典
+    """
+    entity_type = scenario_entity_type(obj_data["type"])
+    entity = create_entity(entity_type, obj_data)
+    entity["properties"] = entity_properties(
+        original_id, obj_data, lane, world_position
+    )
+
+    return {
+        "name": f"{ENTITY_NAME_PREFIXES[entity_type]}_{new_id}",
+        "id": new_id,
+        "entityObject": {entity_type: entity},
+    }
+
+
+def build_entity_catalog(objects: List[dict]) -> Tuple[List[dict], List[int]]:
+    """
+    收集不同的实体定义（按类型和尺寸去重），按首次出现的顺序编号
+
+    Args:
+        objects: data.json 格式的障碍物列表
+
+    Returns:
+        (目录条目列表, 每个障碍物对应的条目下标)
+    """
+    entries = []
+    refs = []
+    index_by_key = {}
+    for obj in objects:
+        entity_type = scenario_entity_type(obj["type"])
+        key = (entity_type, obj["length"], obj["width"], obj["height"])
+        index = index_by_key.get(key)
+        if index is None:
+            index = index_by_key[key] = len(entries)
+            entity = create_entity(entity_type, obj)
+            del entity["properties"]
+            entries.append(
+                {
+                    "name": f"{ENTITY_NAME_PREFIXES[entity_type]}_def_{index + 1}",
+                    "entityObject": {entity_type: entity},
+                }
+            )
+        refs.append(index)
+    return entries, refs
+
+
+def estimate_catalog_savings(
+    objects: List[dict], compact: bool = False, catalog: tuple = None
+) -> tuple:
+    """
+    估算目录引用模式对障碍物定义部分的压缩效果
+
+    每个目录条目只用首个障碍物编码一次内联和引用两种形式，
+    同一条目下障碍物的差别只在属性值，两种形式相同。
+    按列表元素在文件中的缩进计算，与 stream_json 的输出一致
+
+    Args:
+        objects: data.json 格式的障碍物列表
+        compact: 是否按紧凑 JSON 计算
+        catalog: 已构建的 (entries, refs)（可选，避免重复构建）
+
+    Returns:
+        (内联定义的字节数, 目录 + 引用的字节数)
+    """
+    if compact:
+        encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
     else:
-        scenario_obj["entityObject"]["unknownUnmovableObject"] = {
-            "mass": 500.0,
-            "boundingBox": bounding_box,
-            "properties": {
-                "property": [{"name": "original_id", "value": str(original_id)}]
-            },
-        }
+        encoder = json.JSONEncoder(indent=2, ensure_ascii=False)
+
+    def encoded_size(item: dict, path: tuple) -> int:
+        text = encoder.encode(item)
+        size = len(text.encode("utf-8")) + 1  # 元素间的逗号
+        if not compact:
+            # 元素前的换行，以及每行前列表元素的缩进
+            size += 1 + (text.count("\n") + 1) * 2 * (len(path) + 1)
+        return size
+
+    entries, refs = catalog or build_entity_catalog(objects)
+    uses = Counter(refs)
+    first = {}
+    for obj, index in zip(objects, refs):
+        first.setdefault(index, obj)
+
+    inline_bytes = catalog_bytes = 0
+    for index, entry in enumerate(entries):
+        obj = first[index]
+        inline = create_scenario_object("1", obj["id"], obj)
+        reference = create_catalog_reference("1", obj["id"], obj, entry)
+        path = ENTITY_LIST_PATHS[0]
+        inline_bytes += uses[index] * encoded_size(inline, path)
+        catalog_bytes += uses[index] * encoded_size(reference, path)
+        catalog_bytes += encoded_size(entry, CATALOG_PATH)
+    return inline_bytes, catalog_bytes
+
+
+def create_catalog_reference(
+    new_id: str,
+    original_id: str,
+    obj_data: dict,
+    entry: dict,
+    lane: tuple = None,
+    world_position: bool = False,
+) -> dict:
+    """
+    创建引用目录条目的 scenarioObject，只保留障碍物自身的属性
 
-    return scenario_obj
+    Args:
+        new_id: 新的障碍物 ID（连续递增）
+        original_id: data.json 中的原始 ID
+        obj_data: data.json 中的障碍物数据
+        entry: 障碍物对应的目录条目（build_entity_catalog 的结果）
+        lane: 车道投影结果 (lane_id, s, l)（可选），写入 properties
+        world_position: 是否在 properties 中保留世界坐标（初始位置使用 lanePosition 时）
 
+    Returns:
+        scenarioObject 字典
+    """
+    (entity_type,) = entry["entityObject"]
+    return {
+        "name": f"{ENTITY_NAME_PREFIXES[entity_type]}_{new_id}",
+        "id": new_id,
+        "catalogReference": {"catalogName": CATALOG_NAME, "entryName": entry["name"]},
+        "properties": entity_properties(original_id, obj_data, lane, world_position),
+    }
 
-def create_init_action(entity_ref: str, obj_data: dict) -> dict:
+
+def create_init_action(entity_ref: str, obj_data: dict, lane: tuple = None) -> dict:
     """
     创建初始化动作（位置）
 
     Args:
         entity_ref: 实体引用 ID
         obj_data: data.json 中的障碍物数据
+        lane: 车道投影结果 (lane_id, s, l)（可选），提供时使用 lanePosition
 
     Returns:
         private action 字典
     """
+    if lane is not None:
+        lane_id, s, l = lane
+        position = {
+            "lanePosition": {
+                "roadId": "",
+                "laneId": lane_id,
+                "offset": l,
+                "s": s,
+                "orientation": {"type": "absolute", "h": obj_data["heading"]},
+            }
+        }
+    else:
+        position = {
+            "worldPosition": {
+                "x": obj_data["positionX"],
+                "y": obj_data["positionY"],
+                "z": 0.0,
+                "h": obj_data["heading"],
+                "p": 0.0,
+                "r": 0.0,
+            }
+        }
     return {
         "entityRef": {"entityRef": entity_ref},
-        "privateActions": [
-            {
-                "teleportAction": {
-                    "position": {
-                        "worldPosition": {
-                            "x": obj_data["positionX"],
-                            "y": obj_data["positionY"],
-                            "z": 0.0,
-                            "h": obj_data["heading"],
-                            "p": 0.0,
-                            "r": 0.0,
-                        }
-                    }
-                }
-            }
-        ],
+        "privateActions": [{"teleportAction": {"position": position}}],
     }
 
 
@@ -210,12 +534,393 @@ def update_map_filepath(filepath: str, map_name: str) -> str:
     Returns:
         更新后的路径
     """
-    from pathlib import Path
-
     path = Path(filepath)
     return str(path.parent / map_name)
 
 
+# 模板中的位置节点: 父字段名 -> 朝向字段名
+POSITION_FIELDS = {
+    "worldPosition": "h",
+    "start": "heading",
+    "end": "heading",
+    "pose": "heading",
+}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def compile_position_plan(node) -> List[Tuple[tuple, Optional[str]]]:
+    """
+    遍历一次场景，收集所有位置节点的路径
+
+    位置节点为 POSITION_FIELDS 中字段名下、带数值 x / y 的字典
+    （worldPosition、autoCarInfo 的 start / end、路由点 pose）
+
+    Args:
+        node: 场景字典（或其中的任意子树）
+
+    Returns:
+        [(路径, 朝向字段名或 None), ...]
+    """
+    plan = []
+    stack = [((), node)]
+    while stack:
+        path, value = stack.pop()
+        if isinstance(value, dict):
+            key = path[-1] if path else None
+            if (
+                key in POSITION_FIELDS
+                and _is_number(value.get("x"))
+                and _is_number(value.get("y"))
+            ):
+                heading_key = POSITION_FIELDS[key]
+                plan.append((path, heading_key if heading_key in value else None))
+                continue
+            items = value.items()
+        elif isinstance(value, list):
+            items = enumerate(value)
+        else:
+            continue
+        for child_key, child in items:
+            stack.append((path + (child_key,), child))
+
+    # 按文档顺序排列，便于对照
+    plan.reverse()
+    return plan
+
+
+def apply_position_plan(data, plan, transform: OffsetTransform) -> int:
+    """
+    对位置节点批量应用地图的偏移变换（与 step 2 变换地图的方式一致）
+
+    Args:
+        data: 场景字典（compile_position_plan 的输入）
+        plan: compile_position_plan 的结果
+        transform: 偏移变换（OffsetTransform.from_results）
+
+    Returns:
+        变换的位置数量
+    """
+    nodes = []
+    for path, _ in plan:
+        node = data
+        for key in path:
+            node = node[key]
+        nodes.append(node)
+    if not nodes:
+        return 0
+
+    xy = np.array([(node["x"], node["y"]) for node in nodes], dtype=np.float64)
+    xy = transform.transform_points(xy)
+    heading_delta = transform.heading_delta
+
+    for node, (x, y), (_, heading_key) in zip(nodes, xy.tolist(), plan):
+        node["x"] = x
+        node["y"] = y
+        if heading_key and _is_number(node[heading_key]):
+            node[heading_key] = node[heading_key] + heading_delta
+
+    return len(nodes)
+
+
+def template_skeleton(scenarios_template: dict) -> dict:
+    """
+    深拷贝模板中除障碍物列表以外的部分（骨架）
+
+    Args:
+        scenarios_template: scenarios.json 模板
+
+    Returns:
+        骨架字典，scenarioObjects 和 privates 为空列表
+    """
+    skeleton = dict(scenarios_template)
+    for path in ENTITY_LIST_PATHS:
+        node = skeleton
+        for key in path[:-1]:
+            node[key] = dict(node.get(key, {}))
+            node = node[key]
+        node[path[-1]] = []
+    return copy.deepcopy(skeleton)
+
+
+def select_objects(
+    data_objects: List[dict], match_results: dict = None, verbose: bool = True
+) -> List[dict]:
+    """
+    选出要写入场景的障碍物
+
+    Args:
+        data_objects: data.json 中的障碍物列表
+        match_results: 匹配结果（可选），提供时只保留匹配的障碍物
+        verbose: 是否打印信息
+
+    Returns:
+        障碍物列表（按匹配对顺序）
+    """
+    if not match_results:
+        if verbose:
+            print(f"处理所有 {len(data_objects)} 个障碍物")
+        return data_objects
+
+    if verbose:
+        print(
+            f"使用匹配结果，只保留 {len(match_results['matched_pairs'])} 个匹配的障碍物"
+        )
+    # 按照匹配对的顺序处理障碍物
+    id_to_obj = {str(obj["id"]): obj for obj in data_objects}
+    return [
+        id_to_obj[pair["dst_id"]]
+        for pair in match_results["matched_pairs"]
+        if pair["dst_id"] in id_to_obj
+    ]
+
+
+class ScenarioBuilder:
+    """
+    场景构建器
+
+    模板骨架（去掉原有障碍物）只深拷贝一次，每个障碍物由实体原型生成，
+    生成大场景时只需对障碍物做一次线性遍历
+    """
+
+    def __init__(
+        self,
+        scenarios_template: dict,
+        map_name: str = None,
+        lane_projector=None,
+        lane_position: bool = False,
+        object_filters=None,
+        catalog: bool = False,
+    ):
+        """
+        Args:
+            scenarios_template: scenarios.json 模板
+            map_name: 偏移后的地图名称（可选），用于更新 filepath
+            lane_projector: 车道投影器（可选，map_spatial_index.LaneProjector），
+                提供时将每个障碍物投影到最近车道
+            lane_position: 是否用 lanePosition 代替 worldPosition（否则只写入 properties）
+            object_filters: 障碍物过滤器列表 [(名称, 函数)]，函数接收障碍物列表，
+                返回 (保留的障碍物列表, 统计字典)
+            catalog: 是否把相同的实体定义放入共享目录，scenarioObject 只引用目录条目
+        """
+        self.skeleton = template_skeleton(scenarios_template)
+        self.map_name = map_name
+        self.lane_projector = lane_projector
+        self.lane_position = lane_position
+        self.object_filters = list(object_filters or [])
+        self.catalog = catalog
+
+    def new_scenario(self, suffix: str = "_offset", verbose: bool = True) -> dict:
+        """
+        生成不含障碍物的新场景（新的场景 ID、地图 ID、描述标识和地图路径）
+
+        Args:
+            suffix: 生成 ID 时使用的后缀
+            verbose: 是否打印更新信息
+
+        Returns:
+            新的场景字典
+        """
+        new_scenario = copy.deepcopy(self.skeleton)
+
+        # 生成新的场景 ID
+        original_id = new_scenario.get("id", "unknown")
+        new_id = generate_scenario_id(original_id, suffix=suffix)
+        new_scenario["id"] = new_id
+        if verbose:
+            print(f"生成新场景 ID: {new_id}")
+
+        # 生成新的地图 ID（如果存在）
+        original_map_id = new_scenario.get("mapId", "")
+        if original_map_id:
+            new_map_id = generate_map_id(original_map_id, suffix="_offset")
+            new_scenario["mapId"] = new_map_id
+            if verbose:
+                print(f"生成新地图 ID: {new_map_id}")
+
+        # 更新 descriptionEnTokens（如果存在）
+        if new_scenario.get("descriptionEnTokens"):
+            original_tokens = new_scenario["descriptionEnTokens"]
+            # 为每个 token 添加后缀
+            new_scenario["descriptionEnTokens"] = [
+                f"{token}{suffix}" for token in original_tokens
+            ]
+            if verbose:
+                print(
+                    f"更新描述标识: {original_tokens[0]} -> "
+                    f"{new_scenario['descriptionEnTokens'][0]}"
+                )
+
+        # 目录引用模式：实体定义放在 entities 之前的共享目录中
+        if self.catalog:
+            new_scenario["scenario"] = {
+                "catalog": {"name": CATALOG_NAME, "entries": []},
+                **new_scenario["scenario"],
+            }
+
+        # 更新地图路径（如果提供了 map_name）
+        if self.map_name:
+            logic_file = (
+                new_scenario.get("scenario", {})
+                .get("roadNetwork", {})
+                .get("logicFile", {})
+            )
+            original_filepath = logic_file.get("filepath", "")
+            if original_filepath:
+                new_filepath = update_map_filepath(original_filepath, self.map_name)
+                logic_file["filepath"] = new_filepath
+                if verbose:
+                    print(f"更新地图路径: {original_filepath} -> {new_filepath}")
+
+        return new_scenario
+
+    def transform_positions(self, transform: OffsetTransform) -> int:
+        """
+        对模板骨架中的所有位置节点（主车起终点、路由点、触发条件等）应用地图的偏移变换
+
+        骨架只变换一次，之后生成的所有场景都继承变换后的位置
+
+        Returns:
+            变换的位置数量
+        """
+        plan = compile_position_plan(self.skeleton)
+        return apply_position_plan(self.skeleton, plan, transform)
+
+    def filter_objects(self, objects: List[dict], verbose: bool = True):
+        """
+        依次应用障碍物过滤器
+
+        Returns:
+            (过滤后的障碍物列表, {过滤器名称: 统计字典})
+        """
+        stats = {}
+        for name, object_filter in self.object_filters:
+            before = len(objects)
+            objects, filter_stats = object_filter(objects)
+            stats[name] = filter_stats
+            if verbose:
+                details = ", ".join(
+                    f"{FILTER_STAT_LABELS.get(key, key)} {value}"
+                    for key, value in filter_stats.items()
+                )
+                print(f"  {name}: {before} -> {len(objects)} 个障碍物（{details}）")
+        return objects, stats
+
+    def snap_to_lanes(self, objects: List[dict]) -> list:
+        """
+        批量将障碍物投影到最近车道
+
+        Returns:
+            与 objects 对应的 (lane_id, s, l) 列表，未投影到车道的为 None；
+            未设置车道投影器时返回 None
+        """
+        if self.lane_projector is None:
+            return None
+        xy = np.array(
+            [(obj["positionX"], obj["positionY"]) for obj in objects], dtype=np.float64
+        )
+        result = self.lane_projector.project(xy)
+        lane_ids = self.lane_projector.lane_ids
+        return [
+            (lane_ids[lane], s, l) if lane >= 0 else None
+            for lane, s, l in zip(
+                result["lane"].tolist(), result["s"].tolist(), result["l"].tolist()
+            )
+        ]
+
+    def iter_scenario_objects(
+        self, objects: List[dict], ids: List[str], lanes: list = None
+    ):
+        """按顺序生成 scenarioObject"""
+        for idx, (entity_id, obj) in enumerate(zip(ids, objects)):
+            lane = lanes[idx] if lanes else None
+            yield create_scenario_object(
+                entity_id, str(obj["id"]), obj, lane, self.lane_position
+            )
+
+    def iter_catalog_references(
+        self,
+        objects: List[dict],
+        ids: List[str],
+        entries: List[dict],
+        refs: List[int],
+        lanes: list = None,
+    ):
+        """按顺序生成引用目录条目的 scenarioObject"""
+        for idx, (entity_id, obj) in enumerate(zip(ids, objects)):
+            lane = lanes[idx] if lanes else None
+            entry = entries[refs[idx]]
+            yield create_catalog_reference(
+                entity_id, str(obj["id"]), obj, entry, lane, self.lane_position
+            )
+
+    def iter_privates(self, objects: List[dict], ids: List[str], lanes: list = None):
+        """按顺序生成初始化位置（与 iter_scenario_objects 的 ID 对应）"""
+        for idx, (entity_id, obj) in enumerate(zip(ids, objects)):
+            lane = lanes[idx] if lanes and self.lane_position else None
+            yield create_init_action(entity_id, obj, lane)
+
+    def sections(
+        self, objects: List[dict], ids: List[str] = None, catalog: tuple = None
+    ) -> Dict[Tuple[str, ...], Iterable]:
+        """
+        障碍物列表路径 -> 元素迭代器（供 build 和 stream_json 使用）
+
+        Args:
+            objects: 障碍物列表
+            ids: 各障碍物的实体 ID（可选，默认从 1 开始连续编号）
+            catalog: 已构建的 (entries, refs)（可选，目录模式下默认按 objects 构建）
+        """
+        if ids is None:
+            ids = [str(idx) for idx in range(1, len(objects) + 1)]
+        lanes = self.snap_to_lanes(objects)
+        if not self.catalog:
+            return {
+                ENTITY_LIST_PATHS[0]: self.iter_scenario_objects(objects, ids, lanes),
+                ENTITY_LIST_PATHS[1]: self.iter_privates(objects, ids, lanes),
+            }
+        entries, refs = catalog or build_entity_catalog(objects)
+        return {
+            CATALOG_PATH: entries,
+            ENTITY_LIST_PATHS[0]: self.iter_catalog_references(
+                objects, ids, entries, refs, lanes
+            ),
+            ENTITY_LIST_PATHS[1]: self.iter_privates(objects, ids, lanes),
+        }
+
+    def build(
+        self,
+        data_objects: List[dict],
+        match_results: dict = None,
+        suffix: str = "_offset",
+    ) -> dict:
+        """
+        构建完整场景
+
+        Args:
+            data_objects: data.json 中的障碍物列表
+            match_results: 匹配结果（可选），用于保留匹配的障碍物
+            suffix: 生成 ID 时使用的后缀
+
+        Returns:
+            新的场景字典
+        """
+        new_scenario = self.new_scenario(suffix)
+        objects = select_objects(data_objects, match_results)
+        objects, _ = self.filter_objects(objects)
+
+        for path, items in self.sections(objects).items():
+            node = new_scenario
+            for key in path[:-1]:
+                node = node[key]
+            node[path[-1]] = list(items)
+
+        print(f"创建了 {len(objects)} 个障碍物（ID: 1-{len(objects)}）")
+        return new_scenario
+
+
 def create_scenario_from_data(
     scenarios_template: dict,
     data_objects: List[dict],
@@ -234,89 +939,467 @@ def create_scenario_from_data(
     Returns:
         新的场景字典
     """
-    # 深拷贝模板
-    new_scenario = copy.deepcopy(scenarios_template)
-
-    # 生成新的场景 ID
-    original_id = new_scenario.get("id", "unknown")
-    new_id = generate_scenario_id(original_id, suffix="_offset")
-    new_scenario["id"] = new_id
-    print(f"生成新场景 ID: {new_id}")
-
-    # 生成新的地图 ID（如果存在）
-    original_map_id = new_scenario.get("mapId", "")
-    if original_map_id:
-        new_map_id = generate_map_id(original_map_id, suffix="_offset")
-        new_scenario["mapId"] = new_map_id
-        print(f"生成新地图 ID: {new_map_id}")
-
-    # 更新 descriptionEnTokens（如果存在）
-    if "descriptionEnTokens" in new_scenario and new_scenario["descriptionEnTokens"]:
-        original_tokens = new_scenario["descriptionEnTokens"]
-        # 为每个 token 添加 _offset 后缀
-        new_scenario["descriptionEnTokens"] = [
-            f"{token}_offset" for token in original_tokens
-        ]
-        print(
-            f"更新描述标识: {original_tokens[0]} -> {new_scenario['descriptionEnTokens'][0]}"
-        )
+    builder = ScenarioBuilder(scenarios_template, map_name)
+    return builder.build(data_objects, match_results)
 
-    # 更新地图路径（如果提供了 map_name）
-    if map_name:
-        original_filepath = (
-            new_scenario.get("scenario", {})
-            .get("roadNetwork", {})
-            .get("logicFile", {})
-            .get("filepath", "")
+
+def create_builder(args, scenarios_template: dict) -> ScenarioBuilder:
+    """根据命令行参数创建场景构建器（可选地变换模板中的位置）"""
+    lane_projector = None
+    if args.snap_lanes:
+        print(f"\n加载车道几何: {args.snap_lanes}")
+        lane_projector = load_lane_projector(args.snap_lanes, args.snap_max_distance)
+        print(
+            f"  {len(lane_projector.lane_ids)} 条车道, "
+            f"{len(lane_projector.seg_a)} 个中心线线段"
         )
 
-        if original_filepath:
-            new_filepath = update_map_filepath(original_filepath, map_name)
-            new_scenario["scenario"]["roadNetwork"]["logicFile"]["filepath"] = (
-                new_filepath
+    object_filters = []
+    if args.roi:
+        print(f"\n加载感兴趣区域: {args.roi}")
+        roi = load_roi(args.roi)
+        print(f"  {roi.num_polygons} 个多边形")
+        object_filters.append(("区域过滤", partial(filter_roi, roi=roi)))
+    if args.dedupe:
+        object_filters.append(
+            (
+                "重复/重叠过滤",
+                partial(
+                    filter_overlapping,
+                    duplicate_iou=args.duplicate_iou,
+                    max_overlap=args.max_overlap,
+                ),
             )
-            print(f"更新地图路径: {original_filepath} -> {new_filepath}")
-
-    # 清空原有的障碍物
-    new_scenario["scenario"]["entities"]["scenarioObjects"] = []
-    new_scenario["scenario"]["storyboard"]["init"]["actions"]["privates"] = []
+        )
 
-    # 如果提供了匹配结果，只处理匹配的障碍物
-    if match_results:
+    builder = ScenarioBuilder(
+        scenarios_template,
+        map_name=args.map_name,
+        lane_projector=lane_projector,
+        lane_position=args.lane_position,
+        object_filters=object_filters,
+        catalog=args.catalog,
+    )
+    if args.transform_positions:
+        print(f"\n加载地图偏移变换: {args.match_results}")
+        transform = OffsetTransform.from_results(args.match_results)
+        count = builder.transform_positions(transform)
         print(
-            f"使用匹配结果，只保留 {len(match_results['matched_pairs'])} 个匹配的障碍物"
+            f"  变换模板位置: {count} 个（Δx={transform.offset_x:.3f}, "
+            f"Δy={transform.offset_y:.3f}, θ={transform.heading_delta:.6f}rad）"
         )
-        # 按照匹配对的顺序处理障碍物
-        id_to_obj = {str(obj["id"]): obj for obj in data_objects}
-        objects_to_process = []
-        for pair in match_results["matched_pairs"]:
-            dst_id = pair["dst_id"]
-            if dst_id in id_to_obj:
-                objects_to_process.append(id_to_obj[dst_id])
+    return builder
+
+
+def load_scenario_file(filepath: str) -> Tuple[dict, bool, bool]:
+    """
+    加载已生成的场景文件（自动识别 gzip）
+
+    Returns:
+        (场景字典, 是否为紧凑 JSON, 是否 gzip 压缩)
+    """
+    with open(filepath, "rb") as f:
+        raw = f.read()
+    compressed = raw[:2] == b"\x1f\x8b"
+    if compressed:
+        raw = gzip.decompress(raw)
+    # indent=2 的输出以 "{\n" 开头
+    compact = raw[1:2] != b"\n"
+    return json.loads(raw), compact, compressed
+
+
+def _object_properties(scenario_object: dict) -> List[dict]:
+    """scenarioObject 的属性列表（兼容内联定义和目录引用两种形式）"""
+    if "properties" in scenario_object:
+        return scenario_object["properties"].get("property", [])
+    for entity in scenario_object.get("entityObject", {}).values():
+        return (entity.get("properties") or {}).get("property", [])
+    return []
+
+
+def index_previous_scenario(previous: dict) -> Dict[str, deque]:
+    """
+    按 original_id 属性索引上一次输出中的实体 ID
+
+    Returns:
+        {original_id: 实体 ID 队列}（同一原始 ID 的重复检测按出现顺序排列）
+    """
+    ids_by_original = {}
+    for scenario_object in previous["scenario"]["entities"]["scenarioObjects"]:
+        for prop in _object_properties(scenario_object):
+            if prop.get("name") == "original_id":
+                ids_by_original.setdefault(prop["value"], deque()).append(
+                    str(scenario_object["id"])
+                )
+                break
+    return ids_by_original
+
+
+def assign_entity_ids(
+    objects: List[dict], ids_by_original: Dict[str, deque]
+) -> Tuple[List[dict], List[str]]:
+    """
+    沿用上一次输出的实体 ID，新增障碍物从已有最大 ID 之后顺序编号
+
+    结果按实体 ID 排序：未变化的障碍物保持上一次的顺序，新增的排在最后，
+    输出只取决于上一次的输出和本次的障碍物集合
+
+    Returns:
+        (排序后的障碍物列表, 对应的实体 ID 列表)
+    """
+    next_id = 1 + max(
+        (int(entity_id) for queue in ids_by_original.values() for entity_id in queue),
+        default=0,
+    )
+    available = {key: deque(queue) for key, queue in ids_by_original.items()}
+    assigned = []
+    for obj in objects:
+        queue = available.get(str(obj["id"]))
+        if queue:
+            entity_id = int(queue.popleft())
+        else:
+            entity_id = next_id
+            next_id += 1
+        assigned.append((entity_id, obj))
+    assigned.sort(key=lambda item: item[0])
+    return [obj for _, obj in assigned], [str(entity_id) for entity_id, _ in assigned]
+
+
+def diff_scenario(
+    previous: dict, new_scenario: dict, sections: Dict[Tuple[str, ...], list]
+) -> dict:
+    """
+    比较新场景与上一次的输出
+
+    Args:
+        previous: 上一次输出的场景（会被修改：障碍物列表被清空）
+        new_scenario: 新场景骨架
+        sections: 已展开为列表的障碍物列表路径 -> 元素
+
+    Returns:
+        统计字典: added / removed / changed / unchanged（按实体计），
+        skeleton_changed（骨架或目录是否变化）
+    """
+    previous_sections = {}
+    for path in set(sections) | {CATALOG_PATH}:
+        node = previous
+        for key in path[:-1]:
+            node = node.get(key, {})
+        if path[-1] in node:
+            previous_sections[path] = node[path[-1]]
+            node[path[-1]] = []
+
+    old_objects = {
+        str(item["id"]): item
+        for item in previous_sections.get(ENTITY_LIST_PATHS[0], [])
+    }
+    old_privates = {
+        item["entityRef"]["entityRef"]: item
+        for item in previous_sections.get(ENTITY_LIST_PATHS[1], [])
+    }
+    new_privates = {
+        item["entityRef"]["entityRef"]: item for item in sections[ENTITY_LIST_PATHS[1]]
+    }
+
+    stats = Counter()
+    for item in sections[ENTITY_LIST_PATHS[0]]:
+        entity_id = item["id"]
+        if entity_id not in old_objects:
+            stats["added"] += 1
+        elif (
+            old_objects[entity_id] == item
+            and old_privates.get(entity_id) == new_privates.get(entity_id)
+        ):
+            stats["unchanged"] += 1
+        else:
+            stats["changed"] += 1
+    stats["removed"] = len(old_objects) - stats["changed"] - stats["unchanged"]
+
+    skeleton_changed = previous != new_scenario or previous_sections.get(
+        CATALOG_PATH
+    ) != sections.get(CATALOG_PATH)
+    return {
+        "added": stats["added"],
+        "removed": stats["removed"],
+        "changed": stats["changed"],
+        "unchanged": stats["unchanged"],
+        "skeleton_changed": skeleton_changed,
+    }
+
+
+def write_incremental(
+    builder: "ScenarioBuilder",
+    new_scenario: dict,
+    objects: List[dict],
+    output_path: str,
+    compact: bool = False,
+    compress: bool = False,
+) -> Tuple[List[dict], tuple, dict]:
+    """
+    增量更新已有的场景文件
+
+    按 original_id 沿用上一次输出的实体 ID，逐个比较 scenarioObject 和初始位置；
+    没有任何变化（且输出格式相同）时不写文件，原文件保持逐字节不变，
+    否则写出到临时文件后原子替换
+
+    Args:
+        builder: 场景构建器
+        new_scenario: 新场景骨架
+        objects: 过滤后的障碍物列表
+        output_path: 输出文件路径（即上一次的输出）
+        compact: 是否输出紧凑 JSON
+        compress: 是否使用 gzip 压缩
+
+    Returns:
+        (按实体 ID 排序后的障碍物列表, 实体目录 (entries, refs)（未启用目录时为 None）,
+         diff_scenario 的统计字典，written 表示是否写出)
+    """
+    previous, previous_compact, previous_compressed = load_scenario_file(output_path)
+    objects, ids = assign_entity_ids(objects, index_previous_scenario(previous))
+    catalog = build_entity_catalog(objects) if builder.catalog else None
+    sections = {
+        path: list(items)
+        for path, items in builder.sections(objects, ids, catalog).items()
+    }
+    stats = diff_scenario(previous, new_scenario, sections)
+
+    changed = (
+        stats["added"]
+        or stats["removed"]
+        or stats["changed"]
+        or stats["skeleton_changed"]
+        or (previous_compact, previous_compressed) != (compact, compress)
+    )
+    if changed:
+        tmp_path = f"{output_path}.tmp"
+        stream_json(new_scenario, sections, tmp_path, compact, compress)
+        os.replace(tmp_path, output_path)
+    stats["written"] = bool(changed)
+    return objects, catalog, stats
+
+
+def iter_frames(frames_file: str):
+    """
+    逐帧读取批量输入
+
+    支持 JSONL（每行一帧，推荐，读取时内存占用与帧数无关）、JSON 列表，
+    或 step 0 --frame-store 生成的帧存储目录（按时间顺序）。
+    每帧可以是 data.json 格式的 world（{"timestamp", "object": [...]}），
+    也可以是解密后的原始记录（{"timestamp", "world": {...}}）；
+    可选字段 matched_pairs 为该帧的匹配结果，提供时只保留匹配的障碍物
+
+    Yields:
+        (帧序号, 原始记录)
+    """
+    if Path(frames_file).is_dir():
+        store = FrameStore(frames_file)
+        for index in store.time_order.tolist():
+            timestamp = float(store.frame_timestamp[index])
+            if timestamp.is_integer():
+                timestamp = int(timestamp)
+            yield index, {"timestamp": timestamp, "object": store.objects(index)}
+        return
+
+    with open(frames_file, "r", encoding="utf-8") as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from enumerate(json.load(f))
+            return
+        index = 0
+        for line in f:
+            if line.strip():
+                yield index, json.loads(line)
+                index += 1
+
+
+def frame_task(index: int, record: dict):
+    """
+    将一帧记录转换为批量任务
+
+    帧可以是单独的 world（带 "object" 字段），或 world 已解密的 SimWorldUpdate 记录；
+    其他类型的记录（如 step 0 --jsonl 输出中的非 SimWorldUpdate 记录）不是帧
+
+    Returns:
+        (timestamp, data_objects, match_results)，记录不是帧时返回 None
+
+    Raises:
+        ValueError: SimWorldUpdate 记录的 world 未解密
+    """
+    if not isinstance(record, dict):
+        return None
+    if record.get("type") == "SimWorldUpdate":
+        world = record.get("world")
+        if not isinstance(world, dict):
+            raise ValueError("没有已解密的 world")
+    elif "object" in record:
+        world = record
     else:
-        print(f"处理所有 {len(data_objects)} 个障碍物")
-        objects_to_process = data_objects
-
-    # 创建新的障碍物（使用连续的新 ID）
-    for idx, obj in enumerate(objects_to_process, start=1):
-        original_id = str(obj["id"])
-        new_id = str(idx)  # 从 1 开始的连续 ID
-
-        # 创建 scenarioObject
-        scenario_obj = create_scenario_object(new_id, original_id, obj)
-        new_scenario["scenario"]["entities"]["scenarioObjects"].append(scenario_obj)
-
-        # 创建初始化位置
-        init_action = create_init_action(new_id, obj)
-        new_scenario["scenario"]["storyboard"]["init"]["actions"]["privates"].append(
-            init_action
-        )
+        return None
+    timestamp = world.get("timestamp", record.get("timestamp", index))
+    matched_pairs = record.get("matched_pairs", world.get("matched_pairs"))
+    match_results = {"matched_pairs": matched_pairs} if matched_pairs else None
+    return timestamp, world.get("object", []), match_results
+
+
+# 批量模式的共享状态：在创建进程池之前设置，fork 出的子进程直接继承
+_BATCH_STATE = {}
+
 
-    print(
-        f"创建了 {len(objects_to_process)} 个障碍物（ID: 1-{len(objects_to_process)}）"
+def _generate_frame_scenario(task: dict) -> dict:
+    """
+    批量模式 worker：生成并写出一帧的场景，只返回清单条目
+
+    单帧出错时不影响其他帧，返回带 error 字段的条目
+    """
+    try:
+        return _write_frame_scenario(task)
+    except Exception as e:
+        return {"frame": task["frame"], "timestamp": task["timestamp"], "error": str(e)}
+
+
+def _write_frame_scenario(task: dict) -> dict:
+    builder = _BATCH_STATE["builder"]
+    suffix = f"_offset_{task['frame']}"
+    new_scenario = builder.new_scenario(suffix, verbose=False)
+    objects = select_objects(task["objects"], task["match_results"], verbose=False)
+    selected = len(objects)
+    objects, _ = builder.filter_objects(objects, verbose=False)
+
+    extension = ".json.gz" if _BATCH_STATE["gzip"] else ".json"
+    output_path = Path(_BATCH_STATE["output_dir"]) / f"{new_scenario['id']}{extension}"
+    stream_json(
+        new_scenario,
+        builder.sections(objects),
+        str(output_path),
+        compact=_BATCH_STATE["compact"],
+        compress=_BATCH_STATE["gzip"],
     )
 
-    return new_scenario
+    return {
+        "frame": task["frame"],
+        "timestamp": task["timestamp"],
+        "scenario_id": new_scenario["id"],
+        "file": output_path.name,
+        "objects": len(objects),
+        "filtered": selected - len(objects),
+    }
+
+
+def _ordered_map(executor, fn, tasks, window: int):
+    """按输入顺序返回结果，同时最多只有 window 个任务在进程池中排队"""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def run_batch(args, scenarios_template: dict) -> int:
+    """
+    批量模式：为输入中的每一帧生成一个场景
+
+    场景写到 <output_dir>/<scenario_id>.json，并生成 manifest.json 清单。
+    场景 ID 由模板 ID 和帧后缀 "_offset_<timestamp>" 确定性生成。
+    每一帧都完整写出，不支持 --incremental
+    """
+    if args.incremental:
+        print("❌ 错误: 批量模式（--frames）不支持 --incremental，请对每一帧单独运行")
+        return 1
+
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    builder = create_builder(args, scenarios_template)
+    _BATCH_STATE.update(
+        builder=builder,
+        output_dir=str(output_dir),
+        compact=args.compact,
+        gzip=args.gzip,
+    )
+
+    failed = []
+    skipped = Counter()
+
+    def tasks():
+        seen = set()
+        for index, record in iter_frames(args.frames):
+            try:
+                task = frame_task(index, record)
+            except ValueError as e:
+                print(f"  ⚠️  第 {index + 1} 条记录{e}，跳过")
+                failed.append({"frame": index + 1, "error": str(e)})
+                continue
+            if task is None:
+                record_type = record.get("type") if isinstance(record, dict) else None
+                skipped[record_type or "unknown"] += 1
+                continue
+            timestamp, objects, match_results = task
+            # 时间戳重复时追加帧序号，保证场景 ID 不冲突
+            frame = str(timestamp)
+            if frame in seen:
+                frame = f"{timestamp}_{index}"
+            seen.add(frame)
+            yield {
+                "frame": frame,
+                "timestamp": timestamp,
+                "objects": objects,
+                "match_results": None if args.all_objects else match_results,
+            }
+
+    jobs = args.jobs or os.cpu_count() or 1
+    use_pool = jobs > 1 and "fork" in multiprocessing.get_all_start_methods()
+    print(f"\n开始批量生成（{'并行 ' + str(jobs) + ' 进程' if use_pool else '串行'}）...")
+
+    manifest = []
+
+    def collect(entry):
+        if "error" in entry:
+            print(f"  ❌ 帧 {entry['frame']} 生成失败: {entry['error']}")
+            failed.append(entry)
+            return
+        manifest.append(entry)
+        if len(manifest) % 100 == 0:
+            print(f"  进度: {len(manifest)} 个场景")
+
+    if use_pool:
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            for entry in _ordered_map(
+                executor, _generate_frame_scenario, tasks(), jobs * 4
+            ):
+                collect(entry)
+    else:
+        for task in tasks():
+            collect(_generate_frame_scenario(task))
+
+    manifest_path = output_dir / "manifest.json"
+    save_json(
+        {
+            "template_id": scenarios_template.get("id"),
+            "frames": args.frames,
+            "count": len(manifest),
+            "scenarios": manifest,
+            "skipped": dict(skipped),
+            "failed": failed,
+        },
+        str(manifest_path),
+    )
+
+    print(f"\n✅ 批量场景生成完成！共 {len(manifest)} 个场景")
+    if skipped:
+        details = ", ".join(f"{name}: {count}" for name, count in skipped.items())
+        print(f"跳过非帧记录: {sum(skipped.values())} 条（{details}）")
+    print(f"输出目录: {output_dir}")
+    print(f"场景清单: {manifest_path}")
+    if failed:
+        print(f"❌ {len(failed)} 帧生成失败（见清单中的 failed）")
+        return 1
+    return 0
 
 
 def main():
@@ -359,6 +1442,92 @@ def main():
         help="偏移后的地图名称（如 xh_2025_gs_contest_offset），用于更新场景中的地图路径",
     )
 
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="输出无缩进的紧凑 JSON（文件更小、写出更快）",
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="使用 gzip 压缩输出（文件名自动追加 .gz）",
+    )
+
+    parser.add_argument(
+        "--catalog",
+        action="store_true",
+        help="相同类型和尺寸的实体定义只在共享目录中写一次，障碍物只引用目录条目",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="输出文件已存在时增量更新：按 original_id 沿用实体 ID，只更新变化的障碍物，"
+        "没有变化时不改写文件",
+    )
+
+    parser.add_argument(
+        "--transform-positions",
+        action="store_true",
+        help="用与 step 2 变换地图相同的偏移（平均平移，旋转小于 0.01rad 时忽略）"
+        "变换模板中的其他位置（主车起终点、路由点等）",
+    )
+    parser.add_argument(
+        "--snap-lanes",
+        type=str,
+        default=None,
+        help="将障碍物投影到最近车道：变换后地图的空间索引目录（.index）、"
+        "几何文件（_geometry.npz）或地图文件",
+    )
+    parser.add_argument(
+        "--snap-max-distance",
+        type=float,
+        default=10.0,
+        help="车道投影的最大距离（米，默认: 10）",
+    )
+    parser.add_argument(
+        "--lane-position",
+        action="store_true",
+        help="初始位置使用 lanePosition（默认只把 lane_id / s / l 写入 properties）",
+    )
+    parser.add_argument(
+        "--roi",
+        type=str,
+        default=None,
+        help="只保留感兴趣区域内的障碍物：变换后地图的几何文件（_geometry.npz）/ 地图文件"
+        "（车道面和路口），或自定义多边形 JSON（如路线走廊）",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="合并重复检测并删除重叠的障碍物",
+    )
+    parser.add_argument(
+        "--duplicate-iou",
+        type=float,
+        default=0.7,
+        help="同类型障碍物 IoU 超过该值时视为重复检测（默认: 0.7）",
+    )
+    parser.add_argument(
+        "--max-overlap",
+        type=float,
+        default=0.5,
+        help="允许的最大重叠比例（相交面积 / 较小障碍物面积，默认: 0.5）",
+    )
+    parser.add_argument(
+        "--frames",
+        type=str,
+        default=None,
+        help="批量模式：逐帧输入（JSONL），为每一帧生成一个场景，--output 作为输出目录",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="批量模式的并行进程数（默认: CPU 核数）",
+    )
+
     args = parser.parse_args()
 
     print("=" * 60)
@@ -369,6 +1538,17 @@ def main():
     print(f"\n加载场景模板: {args.template}")
     scenarios_template = load_json(args.template)
 
+    if args.transform_positions:
+        try:
+            OffsetTransform.from_results(args.match_results)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"❌ 错误: 无法加载地图偏移变换 {args.match_results}: {e}")
+            return 1
+
+    if args.frames:
+        print(f"批量模式: {args.frames}")
+        return run_batch(args, scenarios_template)
+
     # 加载障碍物数据
     print(f"加载障碍物数据: {args.data}")
     data = load_json(args.data)
@@ -386,14 +1566,14 @@ def main():
             print(f"  未找到匹配结果文件: {args.match_results}")
             print("  将包含所有障碍物")
 
-    # 创建新场景
+    # 创建新场景（只生成骨架，障碍物在写出时逐个生成）
     print("\n创建新场景...")
-    new_scenario = create_scenario_from_data(
-        scenarios_template,
-        data_objects,
-        match_results if not args.all_objects else None,
-        map_name=args.map_name,
+    builder = create_builder(args, scenarios_template)
+    new_scenario = builder.new_scenario()
+    objects = select_objects(
+        data_objects, match_results if not args.all_objects else None
     )
+    objects, _ = builder.filter_objects(objects)
 
     # 保存 - 使用新的场景ID作为文件名
     new_scenario_id = new_scenario["id"]
@@ -401,32 +1581,57 @@ def main():
 
     # 如果输出路径没有指定，使用新ID
     if args.output == "scenarios_new.json":
-        from pathlib import Path
-
         output_dir = Path("output")
         output_dir.mkdir(exist_ok=True)
         output_path = str(output_dir / f"{new_scenario_id}.json")
-
-    print(f"\n保存新场景: {output_path}")
-    save_json(new_scenario, output_path)
+    if args.gzip and not output_path.endswith(".gz"):
+        output_path += ".gz"
+
+    if args.incremental and os.path.exists(output_path):
+        print(f"\n增量更新场景: {output_path}")
+        objects, catalog, diff = write_incremental(
+            builder,
+            new_scenario,
+            objects,
+            output_path,
+            compact=args.compact,
+            compress=args.gzip,
+        )
+        print(
+            f"  新增 {diff['added']}, 删除 {diff['removed']}, "
+            f"变化 {diff['changed']}, 未变化 {diff['unchanged']}"
+        )
+        if diff["written"]:
+            print("  已写出更新后的场景")
+        else:
+            print("  场景未变化，保留原文件")
+    else:
+        print(f"\n保存新场景: {output_path}")
+        catalog = build_entity_catalog(objects) if args.catalog else None
+        stream_json(
+            new_scenario,
+            builder.sections(objects, catalog=catalog),
+            output_path,
+            compact=args.compact,
+            compress=args.gzip,
+        )
+        print(f"创建了 {len(objects)} 个障碍物（ID: 1-{len(objects)}）")
+    if args.catalog and objects:
+        inline_bytes, catalog_bytes = estimate_catalog_savings(
+            objects, args.compact, catalog
+        )
+        print(
+            f"目录引用: {len(objects)} 个障碍物共用 {len(catalog[0])} 个实体定义，"
+            f"障碍物定义 {inline_bytes / 1024:.1f} KB -> {catalog_bytes / 1024:.1f} KB"
+            f"（减少 {(1 - catalog_bytes / inline_bytes) * 100:.1f}%）"
+        )
 
     # 统计信息
-    num_objects = len(new_scenario["scenario"]["entities"]["scenarioObjects"])
-    num_vehicles = sum(
-        1
-        for obj in new_scenario["scenario"]["entities"]["scenarioObjects"]
-        if "vehicle" in obj["entityObject"]
-    )
-    num_static = sum(
-        1
-        for obj in new_scenario["scenario"]["entities"]["scenarioObjects"]
-        if "unknownUnmovableObject" in obj["entityObject"]
-    )
-    num_pedestrians = sum(
-        1
-        for obj in new_scenario["scenario"]["entities"]["scenarioObjects"]
-        if "pedestrian" in obj["entityObject"]
-    )
+    num_objects = len(objects)
+    type_counts = Counter(scenario_entity_type(obj["type"]) for obj in objects)
+    num_vehicles = type_counts["vehicle"]
+    num_static = type_counts["unknownUnmovableObject"]
+    num_pedestrians = type_counts["pedestrian"]
 
     print("\n" + "=" * 60)
     print("场景创建完成！")
@@ -441,7 +1646,10 @@ def main():
     if args.map_name:
         print(f"地图路径: modules/map/data/{args.map_name}")
     print(f"\n输出文件: {output_path}")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    import sys
+
+    sys.exit(main())